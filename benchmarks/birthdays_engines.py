@@ -0,0 +1,72 @@
+import argparse
+import datetime
+import random
+import timeit
+from typing import List, Optional
+
+from service import database_framework
+from service import service_framework
+
+ENGINES = ['python', 'aggregation', 'numpy']
+
+
+def generate_citizens(citizens_count: int, relations_count: int, seed: int) -> database_framework.Citizens:
+    rnd = random.Random(seed)
+    citizens = []
+    for citizen_id in range(1, citizens_count + 1):
+        citizens.append({
+            'citizen_id': citizen_id,
+            'town': f'Город {citizen_id % 100}',
+            'street': 'Льва Толстого',
+            'building': '16к7стр5',
+            'apartment': citizen_id,
+            'name': 'Иванов Иван Иванович',
+            'birth_date': datetime.datetime(rnd.randint(1940, 2010), rnd.randint(1, 12), rnd.randint(1, 28)),
+            'gender': rnd.choice(['male', 'female']),
+            'relatives': [],
+        })
+    relations = set()
+    while len(relations) < min(relations_count, citizens_count * (citizens_count - 1) // 2):
+        citizen_id, relative_id = sorted(rnd.sample(range(1, citizens_count + 1), 2))
+        relations.add((citizen_id, relative_id))
+    for citizen_id, relative_id in relations:
+        citizens[citizen_id - 1]['relatives'].append(relative_id)
+        citizens[relative_id - 1]['relatives'].append(citizen_id)
+    return citizens
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Birthdays presents engines benchmark')
+    parser.add_argument('--citizens', type=int, default=10000)
+    parser.add_argument('--relations', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES)
+    parsed_args = parser.parse_args(args)
+    database = database_framework.DataBase()
+    import_id = database.insert_citizens_to_new_import(
+        generate_citizens(parsed_args.citizens, parsed_args.relations, parsed_args.seed)
+    )
+    try:
+        expected_birthdays_presents = None
+        for engine in parsed_args.engines:
+            birthdays_presents = service_framework.CitizensBirthdays.calculate_import_presents(
+                database, import_id, engine,
+            )
+            if expected_birthdays_presents is None:
+                expected_birthdays_presents = birthdays_presents
+            elif birthdays_presents != expected_birthdays_presents:
+                raise AssertionError(f'Engine {engine!r} result differs from {parsed_args.engines[0]!r}')
+            times = timeit.repeat(
+                lambda: service_framework.CitizensBirthdays.calculate_import_presents(database, import_id, engine),
+                number=1,
+                repeat=parsed_args.repeat,
+            )
+            print(f'{engine:<12} best {min(times) * 1000:9.1f} ms   mean {sum(times) / len(times) * 1000:9.1f} ms')
+    finally:
+        database.drop_import(import_id)
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import io
+import timeit
+from typing import List, Optional
+
+from benchmarks import birthdays_engines
+from service import database_framework
+from service import json_backend
+from service import json_stream
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='JSON backends benchmark')
+    parser.add_argument('--citizens', type=int, default=10000)
+    parser.add_argument('--relations', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parsed_args = parser.parse_args(args)
+    citizens = birthdays_engines.generate_citizens(parsed_args.citizens, parsed_args.relations, parsed_args.seed)
+    for citizen in citizens:
+        citizen['birth_date'] = citizen['birth_date'].strftime(database_framework.BirthDateFmt)
+    data = {'citizens': citizens}
+    body = json_backend.JSONBackend.dumps(data).encode('utf-8')
+    print(f'payload {len(body) / 1024 / 1024:.1f} MiB')
+
+    def report(name: str, operation: str, function) -> None:
+        times = timeit.repeat(function, number=1, repeat=parsed_args.repeat)
+        print(f'{name:<8} {operation:<8} best {min(times) * 1000:9.1f} ms   mean {sum(times) / len(times) * 1000:9.1f} ms')
+
+    for backend in json_backend.BACKENDS.values():
+        if not backend:
+            continue
+        report(backend.NAME, 'loads', lambda: backend.loads(body))
+        report(backend.NAME, 'dumps', lambda: backend.dumps({'data': citizens}, sort_keys=True))
+    report('stream', 'loads', lambda: list(json_stream.iter_array_items(io.BytesIO(body), 'citizens')))
+
+
+if __name__ == '__main__':
+    main()
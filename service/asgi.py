@@ -0,0 +1,7 @@
+import uvicorn
+
+from service.asgi_api import app
+
+
+if __name__ == '__main__':
+    uvicorn.run(app)
@@ -0,0 +1,182 @@
+import datetime
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Hashable, Optional, Tuple
+
+from starlette import applications
+from starlette import requests
+from starlette import responses
+from starlette import routing
+
+from service import async_service_framework
+from service import config
+from service import json_backend
+from service import service_framework
+
+service = async_service_framework.AsyncService()
+response_cache = service_framework.LRUCache(config.RESPONSE_CACHE_SIZE, sizeof=len)
+
+
+def bad_request() -> responses.Response:
+    return responses.PlainTextResponse('Bad Request', 400)
+
+
+def json_response(data: Any, status_code: int) -> responses.Response:
+    return responses.Response(
+        json_backend.BACKEND.dumps(data) + '\n', status_code, media_type='application/json',
+    )
+
+
+def is_json(request: requests.Request) -> bool:
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    return mimetype == 'application/json' or (mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag.strip('"') == etag:
+            return True
+    return False
+
+
+async def iter_data_json_array(items: AsyncIterable[Any]) -> AsyncIterator[str]:
+    separator = ''
+    batch = []
+    yield '{"data":['
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= config.CITIZENS_STREAM_BATCH_SIZE:
+            yield separator + ','.join(json_backend.BACKEND.dumps(item) for item in batch)
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + ','.join(json_backend.BACKEND.dumps(item) for item in batch)
+    yield ']}\n'
+
+
+async def iter_data_json(data: Any) -> AsyncIterator[str]:
+    yield json_backend.BACKEND.dumps({'data': data}) + '\n'
+
+
+async def iter_cached_body(chunks: AsyncIterable[str], cache_key: Hashable) -> AsyncIterator[bytes]:
+    body = []
+    body_size = 0
+    async for chunk in chunks:
+        chunk = chunk.encode('utf-8')
+        if body is not None:
+            body_size += len(chunk)
+            if body_size <= response_cache.max_size:
+                body.append(chunk)
+            else:
+                body = None
+        yield chunk
+    if body is not None:
+        response_cache.put(cache_key, b''.join(body))
+
+
+async def make_cached_response(
+        request: requests.Request,
+        import_id: int,
+        cache_key: Tuple[Hashable, ...],
+        iter_body: Callable[[], Awaitable[Optional[AsyncIterable[str]]]],
+) -> responses.Response:
+    import_version = await service.get_import_version(import_id)
+    if import_version is None:
+        chunks = await iter_body()
+        if chunks is None:
+            return bad_request()
+        return responses.StreamingResponse(chunks, 200, media_type='application/json')
+    cache_key = (import_id,) + import_version + cache_key
+    etag = '-'.join(str(key) for key in cache_key)
+    headers = {'ETag': f'"{etag}"'}
+    if etag_matches(request.headers.get('if-none-match', ''), etag):
+        return responses.Response(status_code=304, headers=headers)
+    body = response_cache.get(cache_key)
+    if body is not None:
+        return responses.Response(body, 200, headers=headers, media_type='application/json')
+    chunks = await iter_body()
+    if chunks is None:
+        return bad_request()
+    return responses.StreamingResponse(
+        iter_cached_body(chunks, cache_key), 200, headers=headers, media_type='application/json',
+    )
+
+
+async def import_citizens(request: requests.Request) -> responses.Response:
+    if not is_json(request):
+        return bad_request()
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) <= config.IMPORT_STREAM_THRESHOLD:
+        new_import_id = await service.import_citizens(await request.body())
+    else:
+        new_import_id = await service.import_citizens_from_stream(request.stream())
+    if new_import_id:
+        return json_response({'data': {'import_id': new_import_id}}, 201)
+    return bad_request()
+
+
+async def patch_import_citizen(request: requests.Request) -> responses.Response:
+    request_json = None
+    if is_json(request):
+        try:
+            request_json = json_backend.BACKEND.loads(await request.body())
+        except ValueError:
+            return bad_request()
+    patched_citizen = await service.patch_import_citizen(
+        request.path_params['import_id'], request.path_params['citizen_id'], request_json,
+    )
+    if patched_citizen:
+        return json_response({'data': patched_citizen}, 200)
+    return bad_request()
+
+
+async def get_import_citizens(request: requests.Request) -> responses.Response:
+    import_id = request.path_params['import_id']
+    query = dict(request.query_params)
+
+    async def iter_body() -> Optional[AsyncIterator[str]]:
+        citizens = await service.iter_import_citizens(import_id, query)
+        return iter_data_json_array(citizens) if citizens is not None else None
+
+    return await make_cached_response(request, import_id, ('citizens',) + tuple(sorted(query.items())), iter_body)
+
+
+async def get_import_citizens_birthdays(request: requests.Request) -> responses.Response:
+    import_id = request.path_params['import_id']
+
+    async def iter_body() -> Optional[AsyncIterator[str]]:
+        birthdays = await service.get_import_citizens_birthdays(import_id)
+        return iter_data_json(birthdays) if birthdays else None
+
+    return await make_cached_response(request, import_id, ('birthdays',), iter_body)
+
+
+async def get_towns_percentile_age_stats(request: requests.Request) -> responses.Response:
+    import_id = request.path_params['import_id']
+
+    async def iter_body() -> Optional[AsyncIterator[str]]:
+        towns_percentile_age_stats = await service.get_towns_percentile_age_stats(import_id)
+        return iter_data_json(towns_percentile_age_stats) if towns_percentile_age_stats else None
+
+    return await make_cached_response(
+        request, import_id, ('percentile', datetime.datetime.utcnow().date().isoformat()), iter_body,
+    )
+
+
+async def get_pool_metrics(request: requests.Request) -> responses.Response:
+    return json_response({'data': service.get_pool_metrics()}, 200)
+
+
+app = applications.Starlette(routes=[
+    routing.Route('/imports', import_citizens, methods=['POST']),
+    routing.Route('/imports/{import_id:int}/citizens/{citizen_id:int}', patch_import_citizen, methods=['PATCH']),
+    routing.Route('/imports/{import_id:int}/citizens', get_import_citizens, methods=['GET']),
+    routing.Route('/imports/{import_id:int}/citizens/birthdays', get_import_citizens_birthdays, methods=['GET']),
+    routing.Route(
+        '/imports/{import_id:int}/towns/stat/percentile/age', get_towns_percentile_age_stats, methods=['GET'],
+    ),
+    routing.Route('/metrics/pool', get_pool_metrics, methods=['GET']),
+])
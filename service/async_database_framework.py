@@ -0,0 +1,99 @@
+import os
+from typing import AsyncIterator, List, Optional
+
+import pymongo
+from motor import motor_asyncio
+from pymongo import read_preferences
+
+from service import columnar_database_framework
+from service import config
+from service import database_client
+from service import database_framework
+
+
+class AsyncDataBase:
+    def __init__(self) -> None:
+        self.pool_metrics = database_client.PoolMetrics()
+        self.client = motor_asyncio.AsyncIOMotorClient(
+            config.MONGO_URI,
+            event_listeners=[self.pool_metrics],
+            **database_client.DataBaseClient.get_client_options(),
+        )
+        self.db = self.client.get_database(config.MONGO_DATABASE, read_preference=read_preferences.Primary())
+        self.read_db = self.client.get_database(
+            config.MONGO_DATABASE, read_preference=database_client.DataBaseClient.get_read_preference(),
+        )
+        self.known_imports = database_framework.KnownImports()
+
+    def close(self) -> None:
+        self.client.close()
+
+    def get_pool_metrics(self) -> database_client.PoolMetricsSnapshot:
+        snapshot = self.pool_metrics.snapshot()
+        snapshot['pid'] = os.getpid()
+        return snapshot
+
+    async def import_exists(self, import_id: int) -> bool:
+        await self._check_imports_signal()
+        if self.known_imports.contains(import_id):
+            return True
+        if await self.db[f'{import_id}'].find_one({}, projection={'_id': 1}) is None:
+            return await self.is_columnar_import(import_id)
+        self.known_imports.add(import_id)
+        return True
+
+    async def is_columnar_import(self, import_id: int) -> bool:
+        if self.known_imports.is_columnar(import_id):
+            return True
+        columnar_imports = self.db[columnar_database_framework.ColumnarImportsCollection]
+        if await columnar_imports.find_one(
+                columnar_database_framework.ColumnarDataBase.get_ready_import_query(import_id),
+                projection={'_id': 1},
+        ) is None:
+            return False
+        self.known_imports.add(import_id, columnar=True)
+        return True
+
+    async def get_import_version(self, import_id: int) -> Optional[database_framework.ImportVersion]:
+        if not database_client.DataBaseClient.is_read_database_primary():
+            return None
+        import_versions = self.db[database_framework.ImportVersionsCollection]
+        return database_framework.DataBase.deserialize_import_version(await import_versions.find_one({'_id': import_id}))
+
+    async def iter_import_citizens(
+            self,
+            import_id: int,
+            limit: Optional[int] = None,
+            after_citizen_id: Optional[int] = None,
+            fields: Optional[List[str]] = None,
+    ) -> AsyncIterator[database_framework.Citizen]:
+        import_ = self.read_db[f'{import_id}']
+        query, projection = database_framework.DataBase.get_citizens_query(after_citizen_id, fields)
+        citizens = import_.find(query, projection=projection).sort('citizen_id', pymongo.ASCENDING)
+        if limit:
+            citizens = citizens.limit(limit)
+        async for citizen in citizens:
+            yield database_framework.DataBase.format_citizen_birth_date(citizen)
+
+    async def get_towns_birth_dates(self, import_id: int) -> Optional[database_framework.TownsBirthDates]:
+        towns = self.read_db[database_framework.TownsBirthDatesCollection].find({'import_id': import_id}).sort(
+            [('position', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
+        )
+        return database_framework.DataBase.deserialize_towns_birth_dates(await towns.to_list(None))
+
+    async def get_birthdays_presents(self, import_id: int) -> Optional[database_framework.BirthdaysPresents]:
+        birthdays = self.read_db[database_framework.BirthdaysCollection].find({'import_id': import_id})
+        return database_framework.DataBase.deserialize_birthdays_presents(await birthdays.to_list(None))
+
+    async def _check_imports_signal(self) -> None:
+        if not self.known_imports.is_signal_expired():
+            return
+        signals = self.db[database_framework.SignalsCollection]
+        signal = await signals.find_one({'_id': database_framework.ImportsSignal})
+        if signal is None:
+            signal = await signals.find_one_and_update(
+                *database_framework.DataBase.get_imports_signal_upsert(),
+                upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER,
+            )
+        self.known_imports.update_signal(signal)
@@ -0,0 +1,162 @@
+import asyncio
+import datetime
+import io
+import itertools
+from concurrent import futures
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, NewType, Optional
+
+from service import async_database_framework
+from service import config
+from service import database_client
+from service import database_framework
+from service import json_backend
+from service import service_framework
+
+PoolsMetricsSnapshot = NewType('PoolsMetricsSnapshot', Dict[str, database_client.PoolMetricsSnapshot])
+
+
+class AsyncChunksReader(io.RawIOBase):
+    def __init__(self, chunks: AsyncIterator[bytes], loop: asyncio.AbstractEventLoop) -> None:
+        super().__init__()
+        self.chunks = chunks
+        self.loop = loop
+        self.pending = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        data = bytearray(self.pending)
+        while size < 0 or len(data) < size:
+            chunk = asyncio.run_coroutine_threadsafe(self._next_chunk(), self.loop).result()
+            if chunk is None:
+                break
+            data += chunk
+        if size < 0:
+            size = len(data)
+        self.pending = bytes(data[size:])
+        return bytes(data[:size])
+
+    async def _next_chunk(self) -> Optional[bytes]:
+        try:
+            return await self.chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+
+
+class AsyncService:
+    def __init__(self) -> None:
+        self.database = async_database_framework.AsyncDataBase()
+        self.service = service_framework.Service()
+        self.executor = futures.ThreadPoolExecutor(config.ASYNC_EXECUTOR_THREADS)
+        self.imports_executor = futures.ThreadPoolExecutor(
+            config.MAX_IMPORTS_IN_FLIGHT if config.MAX_IMPORTS_IN_FLIGHT > 0 else config.ASYNC_EXECUTOR_THREADS,
+        )
+        self.towns_age_stats_cache = service_framework.LRUCache(config.TOWNS_AGE_STATS_CACHE_SIZE)
+
+    async def import_citizens(self, body: bytes) -> Optional[service_framework.NewImportId]:
+        return await self._run_import_in_executor(self._import_citizens, body)
+
+    async def import_citizens_from_stream(
+            self,
+            chunks: AsyncIterator[bytes],
+    ) -> Optional[service_framework.NewImportId]:
+        stream = AsyncChunksReader(chunks, asyncio.get_event_loop())
+        return await self._run_import_in_executor(self.service.import_citizens_from_stream, stream)
+
+    async def patch_import_citizen(
+            self,
+            import_id: int,
+            citizen_id: int,
+            request_json: Any,
+    ) -> Optional[service_framework.PatchedCitizen]:
+        if not await self.database.import_exists(import_id):
+            return None
+        return await self._run_in_executor(self.service.patch_import_citizen, import_id, citizen_id, request_json)
+
+    def get_pool_metrics(self) -> PoolsMetricsSnapshot:
+        return {'async': self.database.get_pool_metrics(), 'sync': self.service.get_pool_metrics()}
+
+    async def get_import_version(self, import_id: int) -> Optional[database_framework.ImportVersion]:
+        if not await self.database.import_exists(import_id):
+            return None
+        return await self.database.get_import_version(import_id)
+
+    async def iter_import_citizens(
+            self,
+            import_id: int,
+            query: Optional[Dict[str, str]] = None,
+    ) -> Optional[AsyncIterator[service_framework.Citizen]]:
+        if not await self.database.import_exists(import_id):
+            return None
+        if await self.database.is_columnar_import(import_id):
+            citizens = await self._run_in_executor(self.service.iter_import_citizens, import_id, query)
+            return None if citizens is None else self._iter_in_executor(citizens)
+        citizens_query = service_framework.Service.validate_citizens_query(query)
+        if citizens_query is None:
+            return None
+        return self.database.iter_import_citizens(import_id, **citizens_query)
+
+    async def get_import_citizens_birthdays(
+            self,
+            import_id: int,
+    ) -> Optional[service_framework.ImportCitizensBirthdays]:
+        if not await self.database.import_exists(import_id):
+            return None
+        if await self.database.is_columnar_import(import_id):
+            return await self._run_in_executor(self.service.get_import_citizens_birthdays, import_id)
+        birthdays_presents = await self.database.get_birthdays_presents(import_id)
+        if birthdays_presents is None:
+            return await self._run_in_executor(self.service.get_import_citizens_birthdays, import_id)
+        return service_framework.CitizensBirthdays.format_birthdays(birthdays_presents)
+
+    async def get_towns_percentile_age_stats(
+            self,
+            import_id: int,
+    ) -> Optional[service_framework.TownsPercentileAgeStats]:
+        if not await self.database.import_exists(import_id):
+            return None
+        if await self.database.is_columnar_import(import_id):
+            return await self._run_in_executor(self.service.get_towns_percentile_age_stats, import_id)
+        current_date = datetime.datetime.utcnow().date()
+        import_version = await self.database.get_import_version(import_id)
+        cache_key = (import_id, current_date, import_version)
+        towns_percentile_age_stats = (
+            self.towns_age_stats_cache.get(cache_key) if import_version is not None else None
+        )
+        if towns_percentile_age_stats is None:
+            towns_birth_dates = await self.database.get_towns_birth_dates(import_id)
+            if towns_birth_dates is None:
+                return await self._run_in_executor(self.service.get_towns_percentile_age_stats, import_id)
+            towns_percentile_age_stats = await asyncio.wrap_future(
+                service_framework.ComputeExecutor.submit(
+                    service_framework.TownsAgeStats.calculate_towns_birth_dates_percentile_age_stats,
+                    towns_birth_dates,
+                    current_date,
+                    size=sum(len(town_birth_dates) for _, town_birth_dates in towns_birth_dates),
+                )
+            )
+            if import_version is not None:
+                self.towns_age_stats_cache.put(cache_key, towns_percentile_age_stats)
+        return towns_percentile_age_stats
+
+    def _import_citizens(self, body: bytes) -> Optional[service_framework.NewImportId]:
+        try:
+            request_json = json_backend.BACKEND.loads(body)
+        except ValueError:
+            return None
+        return self.service.import_citizens(request_json)
+
+    async def _iter_in_executor(self, items: Iterator[Any]) -> AsyncIterator[Any]:
+        while True:
+            batch = await self._run_in_executor(list, itertools.islice(items, config.CITIZENS_STREAM_BATCH_SIZE))
+            if not batch:
+                return
+            for item in batch:
+                yield item
+
+    async def _run_in_executor(self, function: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+
+    async def _run_import_in_executor(self, function: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(self.imports_executor, function, *args)
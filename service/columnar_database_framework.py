@@ -0,0 +1,571 @@
+import collections
+import datetime
+import numpy
+import time
+import uuid
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Type
+
+import pymongo
+from pymongo import client_session
+from pymongo import collection
+from pymongo import database
+from pymongo import errors
+
+from service import config
+from service import database_framework
+
+ColumnarImportsCollection = 'columnar_imports'
+ColumnarChunksCollection = 'columnar_chunks'
+ColumnarLocksCollection = 'columnar_locks'
+ColumnarLockPollInterval = 0.01
+ColumnarCitizenSize = 64
+ColumnarChunkMaxSize = 8 * 1024 * 1024
+CitizenFields = ['citizen_id', 'town', 'street', 'building', 'apartment', 'name', 'birth_date', 'gender', 'relatives']
+StringFields = ['street', 'building', 'name']
+Genders = ['male', 'female']
+GendersCodes = {gender: code for code, gender in enumerate(Genders)}
+ColumnsDtypes = {
+    'citizen_id': '<i8',
+    'town': '<i4',
+    'apartment': '<i8',
+    'birth_date': '<i4',
+    'gender': 'i1',
+    'relatives_offsets': '<i8',
+    'relatives': '<i8',
+    database_framework.CitizenVersionField: '<i8',
+}
+ImportColumnsProjection = {
+    '_id': 0, 'citizen_id': 1, 'town': 1, 'birth_date': 1, 'relatives_offsets': 1, 'relatives': 1,
+}
+
+Chunk = Dict[str, Any]
+TownsCodes = Dict[str, int]
+
+
+class ColumnarDataBase(database_framework.DataBase):
+    def __init__(self) -> None:
+        super().__init__()
+        self._columnar_chunks_indexed = False
+
+    @property
+    def imports(self) -> database_framework.Imports:
+        columnar_imports = self.db[ColumnarImportsCollection].find({'ready': True}, projection={'_id': 1})
+        return sorted(set(super().imports) | {columnar_import['_id'] for columnar_import in columnar_imports})
+
+    def is_columnar_import(self, import_id: int) -> bool:
+        if self.known_imports.is_columnar(import_id):
+            return True
+        if not self._columnar_import_ready(import_id):
+            return False
+        self.known_imports.add(import_id, columnar=True)
+        return True
+
+    def import_exists(self, import_id: int) -> bool:
+        if super().import_exists(import_id):
+            return True
+        return self.is_columnar_import(import_id)
+
+    def publish_staging_import(
+            self,
+            staging_import: database_framework.StagingImport,
+            birthdays_presents: Optional[database_framework.BirthdaysPresents] = None,
+            towns_birth_dates: Optional[database_framework.TownsBirthDates] = None,
+    ) -> database_framework.NewImportId:
+        staging_import_ = self.db[staging_import]
+        if towns_birth_dates is None:
+            towns_dictionary = list(dict.fromkeys(
+                citizen['town'] for citizen in staging_import_.find({}, projection={'_id': 0, 'town': 1})
+            ))
+        else:
+            towns_dictionary = [town for town, _ in towns_birth_dates]
+        new_import_id = self._claim_import_id(towns_dictionary)
+        published = False
+        try:
+            citizens = staging_import_.find(
+                {}, projection={'_id': 0, database_framework.CitizenVersionField: 0},
+            ).sort('citizen_id', pymongo.ASCENDING)
+            towns_codes = {town: code for code, town in enumerate(towns_dictionary)}
+            chunks = self._get_chunks_collection()
+            for chunk_citizens in self._iter_chunks_citizens(citizens):
+                chunks.insert_one(self._encode_chunk(new_import_id, chunk_citizens, towns_codes))
+            self.create_import_version(new_import_id)
+            self.db[ColumnarImportsCollection].update_one({'_id': new_import_id}, {'$set': {'ready': True}})
+            published = True
+        finally:
+            if not published:
+                self.db[ColumnarChunksCollection].delete_many({'import_id': new_import_id})
+                self.db[database_framework.ImportVersionsCollection].delete_one({'_id': new_import_id})
+                self.db[ColumnarImportsCollection].delete_one({'_id': new_import_id})
+        self.drop_staging_import(staging_import)
+        self.known_imports.add(new_import_id, columnar=True)
+        return new_import_id
+
+    def drop_import(self, import_id: int) -> None:
+        self.db[ColumnarImportsCollection].delete_one({'_id': import_id})
+        self.db[ColumnarChunksCollection].delete_many({'import_id': import_id})
+        self.known_imports.discard(import_id)
+        super().drop_import(import_id)
+
+    def get_citizen_with_version(
+            self,
+            import_id: int,
+            citizen_id: int,
+            session: Optional[client_session.ClientSession] = None,
+    ) -> Optional[Tuple[database_framework.Citizen, database_framework.CitizenVersion]]:
+        if not self.is_columnar_import(import_id):
+            return super().get_citizen_with_version(import_id, citizen_id, session)
+        towns_dictionary = self._get_towns_dictionary(self.db, import_id, session)
+        chunk = self.db[ColumnarChunksCollection].find_one(
+            {
+                'import_id': import_id,
+                'first_citizen_id': {'$lte': citizen_id},
+                'last_citizen_id': {'$gte': citizen_id},
+            },
+            session=session,
+        )
+        if towns_dictionary is None or chunk is None:
+            return None
+        start = int(numpy.searchsorted(self._decode_column(chunk, 'citizen_id'), citizen_id))
+        citizens = self._decode_chunk(
+            chunk, towns_dictionary, CitizenFields + [database_framework.CitizenVersionField], start, start + 1,
+        )
+        if not citizens or citizens[0]['citizen_id'] != citizen_id:
+            return None
+        citizen = citizens[0]
+        version = citizen.pop(database_framework.CitizenVersionField)
+        return self.format_citizen_birth_date(citizen), version
+
+    def iter_import_citizens(
+            self,
+            import_id: int,
+            limit: Optional[int] = None,
+            after_citizen_id: Optional[int] = None,
+            fields: Optional[List[str]] = None,
+    ) -> Iterator[database_framework.Citizen]:
+        if not self.is_columnar_import(import_id):
+            yield from super().iter_import_citizens(import_id, limit, after_citizen_id, fields)
+            return
+        towns_dictionary = self._get_towns_dictionary(self.read_db, import_id)
+        if towns_dictionary is None:
+            return
+        query = {'import_id': import_id}
+        if after_citizen_id is not None:
+            query['last_citizen_id'] = {'$gt': after_citizen_id}
+        chunks = self.read_db[ColumnarChunksCollection].find(query, projection=self._get_chunk_projection(fields))
+        for chunk in chunks.sort('first_citizen_id', pymongo.ASCENDING):
+            start = 0
+            if after_citizen_id is not None:
+                citizen_ids = self._decode_column(chunk, 'citizen_id')
+                start = int(numpy.searchsorted(citizen_ids, after_citizen_id, side='right'))
+            citizens = self._decode_chunk(chunk, towns_dictionary, fields, start, start + limit if limit else None)
+            for citizen in citizens:
+                yield self.format_citizen_birth_date(citizen)
+            if limit:
+                limit -= len(citizens)
+                if limit <= 0:
+                    return
+
+    def get_import_columns(self, import_id: int) -> Optional[database_framework.ImportColumns]:
+        if not self.is_columnar_import(import_id):
+            return None
+        towns_dictionary = self._get_towns_dictionary(self.read_db, import_id)
+        if towns_dictionary is None:
+            return None
+        chunks = self.read_db[ColumnarChunksCollection].find(
+            {'import_id': import_id}, projection=ImportColumnsProjection,
+        ).sort('first_citizen_id', pymongo.ASCENDING)
+        citizen_ids = [numpy.empty(0, dtype=ColumnsDtypes['citizen_id'])]
+        towns = [numpy.empty(0, dtype=ColumnsDtypes['town'])]
+        birth_dates = [numpy.empty(0, dtype=ColumnsDtypes['birth_date'])]
+        relatives_offsets = []
+        relatives = [numpy.empty(0, dtype=ColumnsDtypes['relatives'])]
+        relatives_count = 0
+        for chunk in chunks:
+            citizen_ids.append(self._decode_column(chunk, 'citizen_id'))
+            towns.append(self._decode_column(chunk, 'town'))
+            birth_dates.append(self._decode_column(chunk, 'birth_date'))
+            chunk_relatives_offsets = self._decode_column(chunk, 'relatives_offsets')
+            relatives_offsets.append(chunk_relatives_offsets[:-1] + relatives_count)
+            relatives.append(self._decode_column(chunk, 'relatives'))
+            relatives_count += int(chunk_relatives_offsets[-1])
+        relatives_offsets.append(numpy.array([relatives_count], dtype=ColumnsDtypes['relatives_offsets']))
+        return database_framework.ImportColumns(
+            citizen_ids=numpy.concatenate(citizen_ids),
+            towns=numpy.concatenate(towns),
+            towns_dictionary=towns_dictionary,
+            birth_dates=numpy.concatenate(birth_dates),
+            relatives_offsets=numpy.concatenate(relatives_offsets),
+            relatives=numpy.concatenate(relatives),
+        )
+
+    def get_citizens_with_relatives_dict(self, import_id: int) -> database_framework.CitizensDict:
+        if not self.is_columnar_import(import_id):
+            return super().get_citizens_with_relatives_dict(import_id)
+        citizens = [citizen for citizen in self._iter_citizens(self.db, import_id) if citizen['relatives']]
+        return {citizen['citizen_id']: citizen for citizen in sorted(citizens, key=lambda c: len(c['relatives']))}
+
+    def get_towns_citizens_birth_dates(self, import_id: int) -> database_framework.TownsCitizensBirthDates:
+        if not self.is_columnar_import(import_id):
+            return super().get_towns_citizens_birth_dates(import_id)
+        towns = []
+        birth_dates = []
+        for citizen in self._iter_citizens(self.read_db, import_id, ['town', 'birth_date']):
+            towns.append(citizen['town'])
+            birth_dates.append(citizen['birth_date'])
+        return towns, birth_dates
+
+    def get_towns_birth_dates(self, import_id: int) -> Optional[database_framework.TownsBirthDates]:
+        if self.is_columnar_import(import_id):
+            return None
+        return super().get_towns_birth_dates(import_id)
+
+    def get_citizens_birth_months_with_versions(
+            self,
+            import_id: int,
+            citizen_ids: List[int],
+            session: Optional[client_session.ClientSession] = None,
+    ) -> Tuple[database_framework.CitizensBirthMonths, database_framework.CitizensVersions]:
+        if not self.is_columnar_import(import_id):
+            return super().get_citizens_birth_months_with_versions(import_id, citizen_ids, session)
+        citizen_ids = set(citizen_ids)
+        fields = ['birth_date', database_framework.CitizenVersionField]
+        citizens_birth_months = {}
+        citizens_versions = {}
+        for chunk in self._find_chunks(import_id, citizen_ids, self._get_chunk_projection(fields), session):
+            for citizen in self._decode_chunk(chunk, [], fields):
+                if citizen['citizen_id'] in citizen_ids:
+                    citizens_birth_months[citizen['citizen_id']] = citizen['birth_date'].month
+                    citizens_versions[citizen['citizen_id']] = citizen[database_framework.CitizenVersionField]
+        return citizens_birth_months, citizens_versions
+
+    def get_citizens_relatives_with_birth_months(
+            self,
+            import_id: int,
+    ) -> database_framework.CitizensRelativesWithBirthMonths:
+        if not self.is_columnar_import(import_id):
+            return super().get_citizens_relatives_with_birth_months(import_id)
+        citizen_ids = []
+        citizens_relatives = []
+        citizens_birth_months = []
+        for citizen in self._iter_citizens(self.db, import_id, ['birth_date', 'relatives']):
+            if citizen['relatives']:
+                citizen_ids.append(citizen['citizen_id'])
+                citizens_relatives.append(citizen['relatives'])
+                citizens_birth_months.append(citizen['birth_date'].month)
+        return citizen_ids, citizens_relatives, citizens_birth_months
+
+    def get_birthdays_presents(self, import_id: int) -> Optional[database_framework.BirthdaysPresents]:
+        if self.is_columnar_import(import_id):
+            return None
+        return super().get_birthdays_presents(import_id)
+
+    def get_birthdays_presents_by_aggregation(self, import_id: int) -> database_framework.BirthdaysPresents:
+        if not self.is_columnar_import(import_id):
+            return super().get_birthdays_presents_by_aggregation(import_id)
+        _, citizens_relatives, citizens_birth_months = self.get_citizens_relatives_with_birth_months(import_id)
+        birthdays_presents = collections.defaultdict(collections.Counter)
+        for citizen_relatives, birth_month in zip(citizens_relatives, citizens_birth_months):
+            birthdays_presents[birth_month].update(citizen_relatives)
+        return {month: dict(citizens_presents) for month, citizens_presents in birthdays_presents.items()}
+
+    def update_citizen_with_relatives(
+            self,
+            import_id: int,
+            citizen_id: int,
+            version: database_framework.CitizenVersion,
+            citizen: database_framework.Citizen,
+            added_relatives: List[int],
+            removed_relatives: List[int],
+            birthdays_presents_delta: Optional[database_framework.BirthdaysPresents] = None,
+            moved_town_birth_date: Optional[
+                Tuple[database_framework.TownBirthDate, database_framework.TownBirthDate]
+            ] = None,
+            relatives_versions: Optional[database_framework.CitizensVersions] = None,
+            session: Optional[client_session.ClientSession] = None,
+    ) -> bool:
+        if not self.is_columnar_import(import_id):
+            return super().update_citizen_with_relatives(
+                import_id, citizen_id, version, citizen, added_relatives, removed_relatives,
+                birthdays_presents_delta, moved_town_birth_date, relatives_versions, session,
+            )
+        lock_token = self._acquire_import_lock(import_id)
+        if lock_token is None:
+            return False
+        try:
+            return self._update_columnar_citizen(
+                import_id, citizen_id, version, citizen, added_relatives, removed_relatives, session,
+            )
+        finally:
+            self.db[ColumnarLocksCollection].delete_one({'_id': import_id, 'token': lock_token})
+
+    def _update_columnar_citizen(
+            self,
+            import_id: int,
+            citizen_id: int,
+            version: database_framework.CitizenVersion,
+            citizen: database_framework.Citizen,
+            added_relatives: List[int],
+            removed_relatives: List[int],
+            session: Optional[client_session.ClientSession] = None,
+    ) -> bool:
+        columnar_import = self.db[ColumnarImportsCollection].find_one({'_id': import_id}, session=session)
+        if columnar_import is None:
+            return False
+        towns_dictionary = columnar_import['towns']
+        chunks = list(self._find_chunks(import_id, {citizen_id, *added_relatives, *removed_relatives}, session=session))
+        chunks_citizens = [
+            self._decode_chunk(chunk, towns_dictionary, CitizenFields + [database_framework.CitizenVersionField])
+            for chunk in chunks
+        ]
+        citizens = {
+            chunk_citizen['citizen_id']: chunk_citizen
+            for chunk_citizens in chunks_citizens
+            for chunk_citizen in chunk_citizens
+        }
+        patched_citizen = citizens.get(citizen_id)
+        if patched_citizen is None or patched_citizen[database_framework.CitizenVersionField] != (version or 0):
+            return False
+        patched_citizen.update(citizen)
+        patched_citizen[database_framework.CitizenVersionField] += 1
+        for relative_id in added_relatives:
+            relative = citizens[relative_id]
+            if citizen_id not in relative['relatives']:
+                relative['relatives'].append(citizen_id)
+            relative[database_framework.CitizenVersionField] += 1
+        for relative_id in removed_relatives:
+            relative = citizens[relative_id]
+            relative['relatives'] = [
+                relative_relative_id
+                for relative_relative_id in relative['relatives']
+                if relative_relative_id != citizen_id
+            ]
+            relative[database_framework.CitizenVersionField] += 1
+        if patched_citizen['town'] not in towns_dictionary:
+            towns_dictionary.append(patched_citizen['town'])
+            self.db[ColumnarImportsCollection].update_one(
+                {'_id': import_id}, {'$set': {'towns': towns_dictionary}}, session=session,
+            )
+        towns_codes = {town: code for code, town in enumerate(towns_dictionary)}
+        chunks_ = self.db[ColumnarChunksCollection]
+        for chunk, chunk_citizens in zip(chunks, chunks_citizens):
+            first_chunk_citizens, *other_chunks_citizens = self._iter_chunks_citizens(chunk_citizens)
+            chunks_.replace_one(
+                {'_id': chunk['_id']},
+                self._encode_chunk(import_id, first_chunk_citizens, towns_codes),
+                session=session,
+            )
+            for other_chunk_citizens in other_chunks_citizens:
+                chunks_.insert_one(self._encode_chunk(import_id, other_chunk_citizens, towns_codes), session=session)
+        self._increment_import_version(import_id, session=session)
+        return True
+
+    def _acquire_import_lock(self, import_id: int) -> Optional[str]:
+        locks = self.db[ColumnarLocksCollection]
+        lock_token = uuid.uuid4().hex
+        deadline = time.monotonic() + config.COLUMNAR_LOCK_TIMEOUT
+        while True:
+            now = datetime.datetime.utcnow()
+            locks.delete_one({'_id': import_id, 'expires_at': {'$lt': now}})
+            try:
+                locks.insert_one({
+                    '_id': import_id,
+                    'token': lock_token,
+                    'expires_at': now + datetime.timedelta(seconds=config.COLUMNAR_LOCK_TTL),
+                })
+                return lock_token
+            except errors.DuplicateKeyError:
+                if time.monotonic() >= deadline:
+                    return None
+                time.sleep(ColumnarLockPollInterval)
+
+    def _columnar_import_ready(self, import_id: int) -> bool:
+        columnar_imports = self.db[ColumnarImportsCollection]
+        return columnar_imports.find_one(self.get_ready_import_query(import_id), projection={'_id': 1}) is not None
+
+    def _claim_import_id(self, towns_dictionary: List[str]) -> database_framework.NewImportId:
+        columnar_imports = self.db[ColumnarImportsCollection]
+        while True:
+            new_import_id = self.allocate_import_id()
+            try:
+                columnar_imports.insert_one({'_id': new_import_id, 'ready': False, 'towns': towns_dictionary})
+            except errors.DuplicateKeyError:
+                continue
+            if self.db[f'{new_import_id}'].find_one({}, projection={'_id': 1}) is None:
+                return new_import_id
+            columnar_imports.delete_one({'_id': new_import_id})
+
+    def _get_chunks_collection(self) -> collection.Collection:
+        chunks = self.db[ColumnarChunksCollection]
+        if not self._columnar_chunks_indexed:
+            chunks.create_index(
+                [('import_id', pymongo.ASCENDING), ('first_citizen_id', pymongo.ASCENDING)],
+                name='import_id_first_citizen_id',
+                unique=True,
+            )
+            self._columnar_chunks_indexed = True
+        return chunks
+
+    def _find_chunks(
+            self,
+            import_id: int,
+            citizen_ids: Set[int],
+            projection: Optional[Dict[str, int]] = None,
+            session: Optional[client_session.ClientSession] = None,
+    ) -> Iterable[Chunk]:
+        chunks = self.db[ColumnarChunksCollection]
+        citizen_ids = sorted(citizen_ids)
+        chunks_ids = []
+        for chunk_bounds in chunks.find(
+                {'import_id': import_id},
+                projection={'first_citizen_id': 1, 'last_citizen_id': 1},
+                session=session,
+        ):
+            first_index = numpy.searchsorted(citizen_ids, chunk_bounds['first_citizen_id'])
+            if first_index < len(citizen_ids) and citizen_ids[first_index] <= chunk_bounds['last_citizen_id']:
+                chunks_ids.append(chunk_bounds['_id'])
+        if not chunks_ids:
+            return []
+        return chunks.find({'_id': {'$in': chunks_ids}}, projection=projection, session=session)
+
+    def _iter_citizens(
+            self,
+            db: database.Database,
+            import_id: int,
+            fields: Optional[List[str]] = None,
+    ) -> Iterator[database_framework.Citizen]:
+        towns_dictionary = self._get_towns_dictionary(db, import_id)
+        if towns_dictionary is None:
+            return
+        chunks = db[ColumnarChunksCollection].find(
+            {'import_id': import_id}, projection=self._get_chunk_projection(fields),
+        )
+        for chunk in chunks.sort('first_citizen_id', pymongo.ASCENDING):
+            yield from self._decode_chunk(chunk, towns_dictionary, fields)
+
+    @staticmethod
+    def get_ready_import_query(import_id: int) -> Dict[str, Any]:
+        return {'_id': import_id, 'ready': True}
+
+    @staticmethod
+    def _get_towns_dictionary(
+            db: database.Database,
+            import_id: int,
+            session: Optional[client_session.ClientSession] = None,
+    ) -> Optional[List[str]]:
+        columnar_import = db[ColumnarImportsCollection].find_one(
+            {'_id': import_id}, projection={'towns': 1}, session=session,
+        )
+        if columnar_import is None:
+            return None
+        return columnar_import['towns']
+
+    @staticmethod
+    def _get_chunk_projection(fields: Optional[List[str]] = None) -> Optional[Dict[str, int]]:
+        if not fields:
+            return None
+        projection = {'_id': 0, 'citizen_id': 1, **{field: 1 for field in fields}}
+        if 'relatives' in fields:
+            projection['relatives_offsets'] = 1
+        return projection
+
+    @staticmethod
+    def _iter_chunks_citizens(citizens: Iterable[database_framework.Citizen]) -> Iterator[database_framework.Citizens]:
+        chunk_citizens = []
+        chunk_size = 0
+        for citizen in citizens:
+            chunk_citizens.append(citizen)
+            chunk_size += (
+                    ColumnarCitizenSize
+                    + 8 * len(citizen['relatives'])
+                    + 4 * sum(len(citizen[field]) for field in StringFields)
+            )
+            if len(chunk_citizens) >= config.COLUMNAR_CHUNK_SIZE or chunk_size >= ColumnarChunkMaxSize:
+                yield chunk_citizens
+                chunk_citizens = []
+                chunk_size = 0
+        if chunk_citizens:
+            yield chunk_citizens
+
+    @classmethod
+    def _encode_chunk(cls, import_id: int, citizens: database_framework.Citizens, towns_codes: TownsCodes) -> Chunk:
+        relatives_counts = [len(citizen['relatives']) for citizen in citizens]
+        chunk = {
+            'import_id': import_id,
+            'first_citizen_id': citizens[0]['citizen_id'],
+            'last_citizen_id': citizens[-1]['citizen_id'],
+            'citizen_id': cls._encode_column('citizen_id', [citizen['citizen_id'] for citizen in citizens]),
+            'town': cls._encode_column('town', [towns_codes[citizen['town']] for citizen in citizens]),
+            'apartment': cls._encode_column('apartment', [citizen['apartment'] for citizen in citizens]),
+            'birth_date': cls._encode_column('birth_date', [citizen['birth_date'].toordinal() for citizen in citizens]),
+            'gender': cls._encode_column('gender', [GendersCodes[citizen['gender']] for citizen in citizens]),
+            'relatives_offsets': cls._encode_column('relatives_offsets', [0] + numpy.cumsum(relatives_counts).tolist()),
+            'relatives': cls._encode_column(
+                'relatives', [relative_id for citizen in citizens for relative_id in citizen['relatives']],
+            ),
+            database_framework.CitizenVersionField: cls._encode_column(
+                database_framework.CitizenVersionField,
+                [citizen.get(database_framework.CitizenVersionField) or 0 for citizen in citizens],
+            ),
+        }
+        for field in StringFields:
+            chunk[field] = [citizen[field] for citizen in citizens]
+        return chunk
+
+    @classmethod
+    def _decode_chunk(
+            cls,
+            chunk: Chunk,
+            towns_dictionary: List[str],
+            fields: Optional[List[str]] = None,
+            start: int = 0,
+            stop: Optional[int] = None,
+    ) -> database_framework.Citizens:
+        citizen_ids = cls._decode_column(chunk, 'citizen_id')
+        stop = len(citizen_ids) if stop is None else min(stop, len(citizen_ids))
+        if start >= stop:
+            return []
+        fields = [field for field in fields or CitizenFields if field != 'citizen_id']
+        columns = [citizen_ids[start:stop].tolist()]
+        for field in fields:
+            columns.append(cls._decode_field(chunk, field, towns_dictionary, start, stop))
+        fields = ['citizen_id'] + fields
+        return [dict(zip(fields, values)) for values in zip(*columns)]
+
+    @classmethod
+    def _decode_field(cls, chunk: Chunk, field: str, towns_dictionary: List[str], start: int, stop: int) -> List[Any]:
+        if field in StringFields:
+            return chunk[field][start:stop]
+        if field == 'relatives':
+            relatives_offsets = cls._decode_column(chunk, 'relatives_offsets')[start:stop + 1]
+            relatives = cls._decode_column(chunk, 'relatives')[relatives_offsets[0]:relatives_offsets[-1]].tolist()
+            relatives_bounds = (relatives_offsets - relatives_offsets[0]).tolist()
+            return [relatives[begin:end] for begin, end in zip(relatives_bounds, relatives_bounds[1:])]
+        values = cls._decode_column(chunk, field)[start:stop].tolist()
+        if field == 'town':
+            return [towns_dictionary[town_code] for town_code in values]
+        if field == 'birth_date':
+            return [datetime.datetime.fromordinal(birth_date) for birth_date in values]
+        if field == 'gender':
+            return [Genders[gender_code] for gender_code in values]
+        return values
+
+    @staticmethod
+    def _encode_column(column: str, values: List[int]) -> bytes:
+        return numpy.array(values, dtype=ColumnsDtypes[column]).tobytes()
+
+    @staticmethod
+    def _decode_column(chunk: Chunk, column: str) -> numpy.ndarray:
+        return numpy.frombuffer(chunk[column], dtype=ColumnsDtypes[column])
+
+
+StorageBackends = {
+    'documents': database_framework.DataBase,
+    'columnar': ColumnarDataBase,
+}
+
+
+def get_storage_backend(name: Optional[str] = None) -> Type[database_framework.DataBase]:
+    name = name or config.STORAGE_BACKEND
+    if name not in StorageBackends:
+        raise ValueError(f'Unknown storage backend {name!r}')
+    return StorageBackends[name]
@@ -0,0 +1,74 @@
+import json
+import os
+
+ENV_PREFIX = 'YANDEXBACKEND_'
+
+
+def _load_config_file() -> dict:
+    config_path = os.environ.get(f'{ENV_PREFIX}CONFIG')
+    if not config_path:
+        return {}
+    with open(config_path, encoding='utf-8') as config_file:
+        return json.load(config_file)
+
+
+_CONFIG_FILE = _load_config_file()
+
+
+def _get_value(name: str, default: object) -> str:
+    value = os.environ.get(f'{ENV_PREFIX}{name}')
+    if value is None:
+        value = _CONFIG_FILE.get(name, default)
+    return str(value)
+
+
+def _get_str(name: str, default: str) -> str:
+    return _get_value(name, default)
+
+
+def _get_bool(name: str, default: bool) -> bool:
+    return _get_value(name, default).lower() in ('1', 'true', 'yes')
+
+
+def _get_float(name: str, default: float) -> float:
+    return float(_get_value(name, default))
+
+
+def _get_int(name: str, default: int) -> int:
+    return int(_get_value(name, default))
+
+
+VALIDATION_PROCESSES = _get_int('VALIDATION_PROCESSES', 5)
+VALIDATION_CHUNK_SIZE = _get_int('VALIDATION_CHUNK_SIZE', 1000)
+VALIDATION_INLINE_THRESHOLD = _get_int('VALIDATION_INLINE_THRESHOLD', 1000)
+CITIZEN_VALIDATOR = _get_str('CITIZEN_VALIDATOR', 'fast')
+INSERT_BATCH_SIZE = _get_int('INSERT_BATCH_SIZE', 1000)
+INSERT_THREADS = _get_int('INSERT_THREADS', 2)
+IMPORT_ID_BLOCK_SIZE = _get_int('IMPORT_ID_BLOCK_SIZE', 1)
+IMPORTS_SIGNAL_TTL = _get_float('IMPORTS_SIGNAL_TTL', 0.0)
+IMPORT_EXTRA_INDEXES = _get_bool('IMPORT_EXTRA_INDEXES', False)
+PATCH_RETRIES = _get_int('PATCH_RETRIES', 10)
+PATCH_TRANSACTIONS = _get_bool('PATCH_TRANSACTIONS', False)
+BIRTHDAYS_ENGINE = _get_str('BIRTHDAYS_ENGINE', 'numpy')
+TOWNS_AGE_STATS_CACHE_SIZE = _get_int('TOWNS_AGE_STATS_CACHE_SIZE', 128)
+CITIZENS_STREAM_BATCH_SIZE = _get_int('CITIZENS_STREAM_BATCH_SIZE', 1000)
+JSON_BACKEND = _get_str('JSON_BACKEND', 'auto')
+IMPORT_STREAM_THRESHOLD = _get_int('IMPORT_STREAM_THRESHOLD', 8 * 1024 * 1024)
+RESPONSE_CACHE_SIZE = _get_int('RESPONSE_CACHE_SIZE', 64 * 1024 * 1024)
+ASYNC_EXECUTOR_THREADS = _get_int('ASYNC_EXECUTOR_THREADS', 4)
+MAX_IMPORTS_IN_FLIGHT = _get_int('MAX_IMPORTS_IN_FLIGHT', 2)
+MONGO_URI = _get_str('MONGO_URI', 'mongodb://localhost:27017')
+MONGO_DATABASE = _get_str('MONGO_DATABASE', 'yandexbackend')
+MONGO_MAX_POOL_SIZE = _get_int('MONGO_MAX_POOL_SIZE', 100)
+MONGO_MIN_POOL_SIZE = _get_int('MONGO_MIN_POOL_SIZE', 0)
+MONGO_CONNECT_TIMEOUT_MS = _get_int('MONGO_CONNECT_TIMEOUT_MS', 20000)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = _get_int('MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000)
+MONGO_SOCKET_TIMEOUT_MS = _get_int('MONGO_SOCKET_TIMEOUT_MS', 0)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = _get_int('MONGO_WAIT_QUEUE_TIMEOUT_MS', 0)
+MONGO_WRITE_CONCERN = _get_str('MONGO_WRITE_CONCERN', '')
+MONGO_GET_READ_PREFERENCE = _get_str('MONGO_GET_READ_PREFERENCE', 'primary')
+MONGO_MAX_STALENESS_SECONDS = _get_int('MONGO_MAX_STALENESS_SECONDS', -1)
+STORAGE_BACKEND = _get_str('STORAGE_BACKEND', 'documents')
+COLUMNAR_CHUNK_SIZE = _get_int('COLUMNAR_CHUNK_SIZE', 10000)
+COLUMNAR_LOCK_TTL = _get_float('COLUMNAR_LOCK_TTL', 30.0)
+COLUMNAR_LOCK_TIMEOUT = _get_float('COLUMNAR_LOCK_TIMEOUT', 10.0)
@@ -0,0 +1,144 @@
+import collections
+import os
+import threading
+from typing import Any, Dict, NewType, Optional
+
+import pymongo
+from pymongo import database
+from pymongo import monitoring
+from pymongo import read_preferences
+
+from service import config
+
+PoolMetricsSnapshot = NewType('PoolMetricsSnapshot', Dict[str, int])
+
+ReadPreferences = {
+    'primary': read_preferences.Primary,
+    'primaryPreferred': read_preferences.PrimaryPreferred,
+    'secondary': read_preferences.Secondary,
+    'secondaryPreferred': read_preferences.SecondaryPreferred,
+    'nearest': read_preferences.Nearest,
+}
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self) -> None:
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    def snapshot(self) -> PoolMetricsSnapshot:
+        with self.lock:
+            snapshot = dict(self.counters)
+        snapshot['connections_open'] = snapshot.get('connections_created', 0) - snapshot.get('connections_closed', 0)
+        snapshot['connections_in_use'] = snapshot.get('checked_out', 0) - snapshot.get('checked_in', 0)
+        return snapshot
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        self._count('pools_created')
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        self._count('pools_cleared')
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        self._count('pools_closed')
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        self._count('connections_created')
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        self._count('connections_closed')
+
+    def connection_check_out_started(self, event: monitoring.ConnectionCheckOutStartedEvent) -> None:
+        pass
+
+    def connection_check_out_failed(self, event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        self._count('check_out_failed')
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        self._count('checked_out')
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        self._count('checked_in')
+
+    def _count(self, counter: str) -> None:
+        with self.lock:
+            self.counters[counter] += 1
+
+
+class DataBaseClient:
+    _client: Optional[pymongo.MongoClient] = None
+    _client_pid: Optional[int] = None
+    _pool_metrics: Optional[PoolMetrics] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_client(cls) -> pymongo.MongoClient:
+        client = cls._client
+        if client is not None and cls._client_pid == os.getpid():
+            return client
+        with cls._lock:
+            if cls._client is None or cls._client_pid != os.getpid():
+                cls._pool_metrics = PoolMetrics()
+                cls._client = pymongo.MongoClient(
+                    config.MONGO_URI, event_listeners=[cls._pool_metrics], **cls.get_client_options(),
+                )
+                cls._client_pid = os.getpid()
+            return cls._client
+
+    @classmethod
+    def get_database(cls) -> database.Database:
+        return cls.get_client().get_database(config.MONGO_DATABASE, read_preference=read_preferences.Primary())
+
+    @classmethod
+    def get_read_database(cls) -> database.Database:
+        return cls.get_client().get_database(config.MONGO_DATABASE, read_preference=cls.get_read_preference())
+
+    @staticmethod
+    def get_read_preference() -> read_preferences._ServerMode:
+        mode = config.MONGO_GET_READ_PREFERENCE
+        if mode not in ReadPreferences:
+            raise ValueError(f'Unknown read preference {mode!r}')
+        if mode == 'primary':
+            return read_preferences.Primary()
+        return ReadPreferences[mode](max_staleness=config.MONGO_MAX_STALENESS_SECONDS)
+
+    @staticmethod
+    def is_read_database_primary() -> bool:
+        return config.MONGO_GET_READ_PREFERENCE == 'primary'
+
+    @staticmethod
+    def get_client_options() -> Dict[str, Any]:
+        options = {
+            'maxPoolSize': config.MONGO_MAX_POOL_SIZE,
+            'minPoolSize': config.MONGO_MIN_POOL_SIZE,
+            'connectTimeoutMS': config.MONGO_CONNECT_TIMEOUT_MS,
+            'serverSelectionTimeoutMS': config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        }
+        if config.MONGO_SOCKET_TIMEOUT_MS > 0:
+            options['socketTimeoutMS'] = config.MONGO_SOCKET_TIMEOUT_MS
+        if config.MONGO_WAIT_QUEUE_TIMEOUT_MS > 0:
+            options['waitQueueTimeoutMS'] = config.MONGO_WAIT_QUEUE_TIMEOUT_MS
+        if config.MONGO_WRITE_CONCERN:
+            write_concern = config.MONGO_WRITE_CONCERN
+            options['w'] = int(write_concern) if write_concern.isdigit() else write_concern
+        return options
+
+    @classmethod
+    def get_pool_metrics(cls) -> PoolMetricsSnapshot:
+        with cls._lock:
+            pool_metrics = cls._pool_metrics if cls._client_pid == os.getpid() else None
+        snapshot = (pool_metrics or PoolMetrics()).snapshot()
+        snapshot['pid'] = os.getpid()
+        return snapshot
+
+    @classmethod
+    def close(cls) -> None:
+        with cls._lock:
+            if cls._client is not None and cls._client_pid == os.getpid():
+                cls._client.close()
+            cls._client = None
+            cls._client_pid = None
+            cls._pool_metrics = None
@@ -1,53 +1,298 @@
 import collections
 import datetime
-from typing import Any, Dict, List, NewType
+import numpy
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, NewType, Optional, Set, Tuple, TypeVar
 
+from bson import objectid
 import pymongo
+from pymongo import client_session
+from pymongo import collection
+from pymongo import database
+from pymongo import errors
+
+from service import config
+from service import database_client
 
 Imports = NewType('Imports', List[int])
 NewImportId = NewType('NewImportId', int)
+StagingImport = NewType('StagingImport', str)
 Citizen = Dict[str, Any]
 Citizens = NewType('Citizens', List[Citizen])
+CitizenVersion = NewType('CitizenVersion', Optional[int])
+ImportVersion = NewType('ImportVersion', Tuple[str, int])
 CitizensDict = NewType('CitizensDict', Dict[int, Citizen])
-CitizenRelatives = NewType('CitizenRelatives', List[int])
-TownsCitizensAgeStats = NewType('TownsCitizensAgeStats', Dict[str, List[int]])
+TownsBirthDates = NewType('TownsBirthDates', List[Tuple[str, Dict[int, int]]])
+TownBirthDate = NewType('TownBirthDate', Tuple[str, int])
+TownsCitizensBirthDates = NewType('TownsCitizensBirthDates', Tuple[List[str], List[datetime.datetime]])
+ImportIndexesStatus = NewType('ImportIndexesStatus', Dict[str, Any])
+BirthdaysPresents = NewType('BirthdaysPresents', Dict[int, Dict[int, int]])
+CitizensBirthMonths = NewType('CitizensBirthMonths', Dict[int, int])
+CitizensVersions = NewType('CitizensVersions', Dict[int, CitizenVersion])
+CitizensRelativesWithBirthMonths = NewType(
+    'CitizensRelativesWithBirthMonths', Tuple[List[int], List[List[int]], List[int]],
+)
+ImportAggregates = NewType('ImportAggregates', List[Tuple[str, List[Dict[str, Any]]]])
+PatchResult = TypeVar('PatchResult')
+
+
+class PatchConflict(Exception):
+    pass
+
+
+class KnownImports:
+    def __init__(self) -> None:
+        self._imports: Set[int] = set()
+        self._columnar_imports: Set[int] = set()
+        self._token: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def contains(self, import_id: int) -> bool:
+        with self._lock:
+            return import_id in self._imports
+
+    def is_columnar(self, import_id: int) -> bool:
+        with self._lock:
+            return import_id in self._columnar_imports
+
+    def add(self, import_id: int, columnar: bool = False) -> None:
+        with self._lock:
+            self._imports.add(import_id)
+            if columnar:
+                self._columnar_imports.add(import_id)
+
+    def discard(self, import_id: int) -> None:
+        with self._lock:
+            self._imports.discard(import_id)
+            self._columnar_imports.discard(import_id)
+
+    def is_signal_expired(self) -> bool:
+        return time.monotonic() - self._checked_at >= config.IMPORTS_SIGNAL_TTL
+
+    def update_signal(self, signal: Dict[str, Any]) -> None:
+        with self._lock:
+            if signal['token'] != self._token:
+                self._imports = set()
+                self._columnar_imports = set()
+                self._token = signal['token']
+            self._checked_at = time.monotonic()
+
+
+class ImportColumns(NamedTuple):
+    citizen_ids: numpy.ndarray
+    towns: numpy.ndarray
+    towns_dictionary: List[str]
+    birth_dates: numpy.ndarray
+    relatives_offsets: numpy.ndarray
+    relatives: numpy.ndarray
+
+
+CitizensIndexes = [
+    pymongo.IndexModel([('citizen_id', pymongo.ASCENDING)], name='citizen_id', unique=True),
+]
+CitizensExtraIndexes = [
+    pymongo.IndexModel([('town', pymongo.ASCENDING)], name='town'),
+    pymongo.IndexModel([('birth_date', pymongo.ASCENDING)], name='birth_date'),
+]
 
 BirthDateFmt = '%d.%m.%Y'
+StagingImportPrefix = 'staging_'
+CountersCollection = 'counters'
+ImportIdCounter = 'import_id'
+SignalsCollection = 'signals'
+ImportsSignal = 'imports'
+CitizenVersionField = 'version'
+BirthdaysCollection = 'birthdays_presents'
+BirthMonths = range(1, 13)
+ImportVersionsCollection = 'import_versions'
+TownsBirthDatesCollection = 'towns_birth_dates'
+NewTownPosition = 2 ** 62
+DuplicateKeyErrorCode = 11000
 
 
 class DataBase:
     def __init__(self) -> None:
-        self.client = pymongo.MongoClient('localhost', 27017)
-        self.db = self.client['yandexbackend']
+        self._import_ids: Iterator[int] = iter(())
+        self._import_ids_pid: Optional[int] = None
+        self._import_ids_lock = threading.Lock()
+        self._import_id_counter_seeded = False
+        self._aggregates_indexed = False
+        self.known_imports = KnownImports()
 
-    def __del__(self) -> None:
-        self.close()
+    @property
+    def client(self) -> pymongo.MongoClient:
+        return database_client.DataBaseClient.get_client()
+
+    @property
+    def db(self) -> database.Database:
+        return database_client.DataBaseClient.get_database()
+
+    @property
+    def read_db(self) -> database.Database:
+        return database_client.DataBaseClient.get_read_database()
 
     @property
     def imports(self) -> Imports:
-        return sorted(int(import_name) for import_name in self.db.list_collection_names())
+        return sorted(int(import_name) for import_name in self.db.list_collection_names() if import_name.isdigit())
+
+    def ensure_import_indexes(self, import_id: int) -> ImportIndexesStatus:
+        import_ = self.db[f'{import_id}']
+        try:
+            import_.create_indexes(self._get_citizens_indexes())
+        except errors.OperationFailure as e:
+            return self.get_import_indexes_status(import_id, error=str(e))
+        return self.get_import_indexes_status(import_id)
+
+    def get_import_indexes_status(self, import_id: int, error: Optional[str] = None) -> ImportIndexesStatus:
+        indexes = self.db[f'{import_id}'].index_information()
+        expected_indexes = [index.document['name'] for index in self._get_citizens_indexes()]
+        return {
+            'import_id': import_id,
+            'indexes': sorted(index_name for index_name in indexes if index_name != '_id_'),
+            'missing_indexes': [index_name for index_name in expected_indexes if index_name not in indexes],
+            'error': error,
+        }
+
+    def import_exists(self, import_id: int) -> bool:
+        self._check_imports_signal()
+        if self.known_imports.contains(import_id):
+            return True
+        if self.db[f'{import_id}'].find_one({}, projection={'_id': 1}) is None:
+            return False
+        self.known_imports.add(import_id)
+        return True
+
+    def is_columnar_import(self, import_id: int) -> bool:
+        return False
 
     def close(self) -> None:
-        self.client.close()
+        database_client.DataBaseClient.close()
+
+    def get_pool_metrics(self) -> database_client.PoolMetricsSnapshot:
+        return database_client.DataBaseClient.get_pool_metrics()
 
     def insert_citizens_to_new_import(self, citizens: Citizens) -> NewImportId:
-        imports = self.imports
-        new_import_id = imports[-1] + 1 if imports else 1
-        new_import = self.db[f'{new_import_id}']
-        new_import.insert_many(citizens)
-        return new_import_id
+        staging_import = self.create_staging_import()
+        self.insert_citizens_to_staging_import(staging_import, citizens)
+        return self.publish_staging_import(staging_import)
 
-    def get_citizen(self, import_id: int, citizen_id: int) -> Citizen:
-        import_ = self.db[f'{import_id}']
-        citizens = list(import_.find({'citizen_id': citizen_id}))
-        citizens = self._prepare_citizens(citizens)
-        return citizens[0]
+    def create_staging_import(self) -> StagingImport:
+        staging_import = f'{StagingImportPrefix}{uuid.uuid4().hex}'
+        self.db.create_collection(staging_import)
+        self.db[staging_import].create_indexes(self._get_citizens_indexes())
+        return staging_import
+
+    def insert_citizens_to_staging_import(self, staging_import: StagingImport, citizens: Citizens) -> bool:
+        staging_import_ = self.db[staging_import]
+        batch_size = config.INSERT_BATCH_SIZE
+        for i in range(0, len(citizens), batch_size):
+            try:
+                staging_import_.insert_many(citizens[i:i + batch_size], ordered=False)
+            except errors.BulkWriteError:
+                return False
+        return True
+
+    def publish_staging_import(
+            self,
+            staging_import: StagingImport,
+            birthdays_presents: Optional[BirthdaysPresents] = None,
+            towns_birth_dates: Optional[TownsBirthDates] = None,
+    ) -> NewImportId:
+        staging_import_ = self.db[staging_import]
+        while True:
+            new_import_id = self.allocate_import_id()
+            aggregates = self._get_import_aggregates(new_import_id, birthdays_presents, towns_birth_dates)
+            published = False
+            try:
+                self._insert_import_aggregates(aggregates)
+                staging_import_.rename(f'{new_import_id}')
+                published = True
+            except errors.OperationFailure as e:
+                if not self._is_import_id_taken(new_import_id, e):
+                    raise
+                continue
+            finally:
+                if not published:
+                    self._delete_import_aggregates(aggregates)
+            self.create_import_version(new_import_id)
+            self.known_imports.add(new_import_id)
+            return new_import_id
+
+    def allocate_import_id(self) -> NewImportId:
+        with self._import_ids_lock:
+            if self._import_ids_pid != os.getpid():
+                self._import_ids = iter(())
+                self._import_ids_pid = os.getpid()
+            new_import_id = next(self._import_ids, None)
+            if new_import_id is None:
+                self._import_ids = self._allocate_import_ids_block(config.IMPORT_ID_BLOCK_SIZE)
+                new_import_id = next(self._import_ids)
+            return new_import_id
+
+    def drop_staging_import(self, staging_import: StagingImport) -> None:
+        self.db.drop_collection(staging_import)
+
+    def drop_import(self, import_id: int) -> None:
+        self.db.drop_collection(f'{import_id}')
+        self.db[BirthdaysCollection].delete_many({'import_id': import_id})
+        self.db[ImportVersionsCollection].delete_one({'_id': import_id})
+        self.db[TownsBirthDatesCollection].delete_many({'import_id': import_id})
+        self.db[SignalsCollection].update_one(
+            {'_id': ImportsSignal},
+            {'$set': {'token': uuid.uuid4().hex}},
+            upsert=True,
+        )
+
+    def create_import_version(self, import_id: int) -> bool:
+        try:
+            result = self.db[ImportVersionsCollection].update_one(
+                {'_id': import_id},
+                {'$setOnInsert': {'token': uuid.uuid4().hex, 'version': 0}},
+                upsert=True,
+            )
+        except errors.DuplicateKeyError:
+            return False
+        return result.upserted_id is not None
 
-    def get_all_import_citizens(self, import_id: int) -> Citizens:
+    def get_import_version(self, import_id: int) -> Optional[ImportVersion]:
+        if not database_client.DataBaseClient.is_read_database_primary():
+            return None
+        return self.deserialize_import_version(self.db[ImportVersionsCollection].find_one({'_id': import_id}))
+
+    def get_citizen_with_version(
+            self,
+            import_id: int,
+            citizen_id: int,
+            session: Optional[client_session.ClientSession] = None,
+    ) -> Optional[Tuple[Citizen, CitizenVersion]]:
         import_ = self.db[f'{import_id}']
-        citizens = list(import_.find({}))
-        citizens = self._prepare_citizens(citizens)
-        return sorted(citizens, key=lambda c: c['citizen_id'])
+        citizen = import_.find_one({'citizen_id': citizen_id}, session=session)
+        if not citizen:
+            return None
+        version = citizen.pop(CitizenVersionField, None)
+        return self._prepare_citizens([citizen])[0], version
+
+    def iter_import_citizens(
+            self,
+            import_id: int,
+            limit: Optional[int] = None,
+            after_citizen_id: Optional[int] = None,
+            fields: Optional[List[str]] = None,
+    ) -> Iterator[Citizen]:
+        import_ = self.read_db[f'{import_id}']
+        query, projection = self.get_citizens_query(after_citizen_id, fields)
+        citizens = import_.find(query, projection=projection).sort('citizen_id', pymongo.ASCENDING)
+        if limit:
+            citizens = citizens.limit(limit)
+        for citizen in citizens:
+            yield self.format_citizen_birth_date(citizen)
+
+    def get_import_columns(self, import_id: int) -> Optional[ImportColumns]:
+        return None
 
     def get_citizens_with_relatives_dict(self, import_id: int) -> CitizensDict:
         import_ = self.db[f'{import_id}']
@@ -59,58 +304,377 @@ class DataBase:
             citizens_with_relatives_dict[citizen['citizen_id']] = citizen
         return citizens_with_relatives_dict
 
-    def get_towns_citizens_age_stats(self, import_id: int) -> TownsCitizensAgeStats:
+    def get_towns_citizens_birth_dates(self, import_id: int) -> TownsCitizensBirthDates:
+        import_ = self.read_db[f'{import_id}']
+        towns = []
+        birth_dates = []
+        for citizen in import_.find({}, projection={'_id': 0, 'town': 1, 'birth_date': 1}):
+            towns.append(citizen['town'])
+            birth_dates.append(citizen['birth_date'])
+        return towns, birth_dates
+
+    def get_towns_birth_dates(self, import_id: int) -> Optional[TownsBirthDates]:
+        towns = self.read_db[TownsBirthDatesCollection].find({'import_id': import_id}).sort(
+            [('position', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
+        )
+        return self.deserialize_towns_birth_dates(towns)
+
+    def set_towns_birth_dates(self, import_id: int, towns_birth_dates: TownsBirthDates) -> None:
+        self.db[TownsBirthDatesCollection].delete_many({'import_id': import_id})
+        self._insert_import_aggregates(self._get_import_aggregates(import_id, towns_birth_dates=towns_birth_dates))
+
+    def get_citizens_birth_months_with_versions(
+            self,
+            import_id: int,
+            citizen_ids: List[int],
+            session: Optional[client_session.ClientSession] = None,
+    ) -> Tuple[CitizensBirthMonths, CitizensVersions]:
+        import_ = self.db[f'{import_id}']
+        citizens = import_.find(
+            {'citizen_id': {'$in': citizen_ids}},
+            projection={'citizen_id': 1, 'birth_date': 1, CitizenVersionField: 1},
+            session=session,
+        )
+        citizens_birth_months = {}
+        citizens_versions = {}
+        for citizen in citizens:
+            citizens_birth_months[citizen['citizen_id']] = citizen['birth_date'].month
+            citizens_versions[citizen['citizen_id']] = citizen.get(CitizenVersionField)
+        return citizens_birth_months, citizens_versions
+
+    def get_citizens_relatives_with_birth_months(self, import_id: int) -> CitizensRelativesWithBirthMonths:
         import_ = self.db[f'{import_id}']
-        current_date = datetime.datetime.utcnow().date()
-        towns_citizens_age_stats = collections.defaultdict(list)
-        citizens = import_.find({})
+        citizens = import_.find(
+            {'relatives': {'$not': {'$size': 0}}},
+            projection={'_id': 0, 'citizen_id': 1, 'relatives': 1, 'birth_date': 1},
+        )
+        citizen_ids = []
+        citizens_relatives = []
+        citizens_birth_months = []
         for citizen in citizens:
-            citizen_age = self._calculate_citizen_age(current_date, citizen['birth_date'].date())
-            citizen_town = citizen['town']
-            towns_citizens_age_stats[citizen_town].append(citizen_age)
-        return towns_citizens_age_stats
+            citizen_ids.append(citizen['citizen_id'])
+            citizens_relatives.append(citizen['relatives'])
+            citizens_birth_months.append(citizen['birth_date'].month)
+        return citizen_ids, citizens_relatives, citizens_birth_months
+
+    def get_birthdays_presents(self, import_id: int) -> Optional[BirthdaysPresents]:
+        return self.deserialize_birthdays_presents(self.read_db[BirthdaysCollection].find({'import_id': import_id}))
 
-    def check_if_citizen_in_import(self, import_id: int, citizen_id: int) -> bool:
+    def get_birthdays_presents_by_aggregation(self, import_id: int) -> BirthdaysPresents:
         import_ = self.db[f'{import_id}']
-        citizen = import_.find_one({'citizen_id': citizen_id})
-        return True if citizen else False
+        presents = import_.aggregate([
+            {'$match': {'relatives': {'$not': {'$size': 0}}}},
+            {'$project': {'_id': 0, 'month': {'$month': '$birth_date'}, 'relatives': 1}},
+            {'$unwind': '$relatives'},
+            {'$group': {'_id': {'month': '$month', 'citizen_id': '$relatives'}, 'presents': {'$sum': 1}}},
+        ])
+        birthdays_presents = collections.defaultdict(dict)
+        for citizen_presents in presents:
+            birthdays_presents[citizen_presents['_id']['month']][citizen_presents['_id']['citizen_id']] = (
+                citizen_presents['presents']
+            )
+        return dict(birthdays_presents)
 
-    def update_citizen(self, import_id: int, citizen_id: int, citizen: Citizen) -> None:
+    def set_birthdays_presents(self, import_id: int, birthdays_presents: BirthdaysPresents) -> None:
+        self.db[BirthdaysCollection].delete_many({'import_id': import_id})
+        self._insert_import_aggregates(self._get_import_aggregates(import_id, birthdays_presents))
+
+    def update_citizen_with_relatives(
+            self,
+            import_id: int,
+            citizen_id: int,
+            version: CitizenVersion,
+            citizen: Citizen,
+            added_relatives: List[int],
+            removed_relatives: List[int],
+            birthdays_presents_delta: Optional[BirthdaysPresents] = None,
+            moved_town_birth_date: Optional[Tuple[TownBirthDate, TownBirthDate]] = None,
+            relatives_versions: Optional[CitizensVersions] = None,
+            session: Optional[client_session.ClientSession] = None,
+    ) -> bool:
         import_ = self.db[f'{import_id}']
-        import_.update_one({'citizen_id': citizen_id}, {'$set': citizen})
-
-    def remove_citizen_from_old_relatives(self, import_id: int, citizen_id: int) -> None:
-        citizen_relatives = self._get_citizen_relatives(import_id, citizen_id)
-        for related_citizen in citizen_relatives:
-            related_citizen_relatives = related_citizen['relatives']
-            related_citizen_relatives.remove(citizen_id)
-            self.update_citizen(import_id, related_citizen['citizen_id'], {'relatives': related_citizen_relatives})
-
-    def add_citizen_to_new_relatives(self, import_id: int, citizen_id: int) -> None:
-        citizen_relatives = self._get_citizen_relatives(import_id, citizen_id)
-        for related_citizen in citizen_relatives:
-            related_citizen_relatives = related_citizen['relatives']
-            related_citizen_relatives.append(citizen_id)
-            self.update_citizen(import_id, related_citizen['citizen_id'], {'relatives': related_citizen_relatives})
+        relatives_updates = self._get_relatives_updates(citizen_id, added_relatives, removed_relatives)
+        updated_relatives = [[], []]
+        if relatives_versions is not None:
+            updated_relatives = self._update_relatives_with_versions(
+                import_, relatives_updates, relatives_versions, session,
+            )
+            if updated_relatives != [added_relatives, removed_relatives]:
+                self._undo_relatives_updates(import_, citizen_id, updated_relatives, session)
+                raise PatchConflict(citizen_id)
+        result = import_.update_one(
+            {'citizen_id': citizen_id, CitizenVersionField: version},
+            {'$set': citizen, '$inc': {CitizenVersionField: 1}},
+            session=session,
+        )
+        if not result.matched_count:
+            self._undo_relatives_updates(import_, citizen_id, updated_relatives, session)
+            return False
+        if relatives_versions is None:
+            self._update_relatives(import_, relatives_updates, session)
+        birthdays_requests = [
+            pymongo.UpdateOne(
+                {'import_id': import_id, 'month': month},
+                {'$inc': {f'presents.{citizen_id}': presents for citizen_id, presents in citizens_presents.items()}},
+            )
+            for month, citizens_presents in (birthdays_presents_delta or {}).items()
+            if citizens_presents
+        ]
+        if birthdays_requests:
+            self.db[BirthdaysCollection].bulk_write(birthdays_requests, ordered=False, session=session)
+        if moved_town_birth_date:
+            self._move_town_birth_date(import_id, *moved_town_birth_date, session=session)
+        self._increment_import_version(import_id, session=session)
+        return True
+
+    def run_patch(self, patch: Callable[[Optional[client_session.ClientSession]], PatchResult]) -> PatchResult:
+        if not config.PATCH_TRANSACTIONS:
+            return patch(None)
+        with self.client.start_session() as session:
+            return session.with_transaction(patch)
+
+    def _allocate_import_ids_block(self, block_size: int) -> Iterator[int]:
+        counters = self.db[CountersCollection]
+        if not self._import_id_counter_seeded:
+            imports = self.imports
+            counters.update_one(
+                {'_id': ImportIdCounter},
+                {'$max': {'value': imports[-1] if imports else 0}},
+                upsert=True,
+            )
+            self._import_id_counter_seeded = True
+        counter = counters.find_one_and_update(
+            {'_id': ImportIdCounter},
+            {'$inc': {'value': block_size}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        last_import_id = counter['value']
+        return iter(range(last_import_id - block_size + 1, last_import_id + 1))
+
+    def _check_imports_signal(self) -> None:
+        if not self.known_imports.is_signal_expired():
+            return
+        signals = self.db[SignalsCollection]
+        signal = signals.find_one({'_id': ImportsSignal})
+        if signal is None:
+            signal = signals.find_one_and_update(
+                *self.get_imports_signal_upsert(), upsert=True, return_document=pymongo.ReturnDocument.AFTER,
+            )
+        self.known_imports.update_signal(signal)
+
+    def _increment_import_version(
+            self,
+            import_id: int,
+            session: Optional[client_session.ClientSession] = None,
+    ) -> None:
+        self.db[ImportVersionsCollection].update_one(
+            {'_id': import_id},
+            {'$inc': {'version': 1}, '$setOnInsert': {'token': uuid.uuid4().hex}},
+            upsert=True,
+            session=session,
+        )
+
+    def _move_town_birth_date(
+            self,
+            import_id: int,
+            old_town_birth_date: TownBirthDate,
+            new_town_birth_date: TownBirthDate,
+            session: Optional[client_session.ClientSession] = None,
+    ) -> None:
+        towns_birth_dates = self.db[TownsBirthDatesCollection]
+        old_town, old_birth_date = old_town_birth_date
+        result = towns_birth_dates.update_one(
+            {'import_id': import_id, 'town': old_town},
+            {'$inc': {f'birth_dates.{old_birth_date}': -1}},
+            session=session,
+        )
+        if not result.matched_count:
+            return
+        new_town, new_birth_date = new_town_birth_date
+        towns_birth_dates.update_one(
+            {'import_id': import_id, 'town': new_town},
+            {'$inc': {f'birth_dates.{new_birth_date}': 1}, '$setOnInsert': {'position': NewTownPosition}},
+            upsert=True,
+            session=session,
+        )
+
+    def _insert_import_aggregates(self, aggregates: ImportAggregates) -> None:
+        if not self._aggregates_indexed:
+            self.db[BirthdaysCollection].create_index(
+                [('import_id', pymongo.ASCENDING), ('month', pymongo.ASCENDING)], name='import_id_month', unique=True,
+            )
+            self.db[TownsBirthDatesCollection].create_index(
+                [('import_id', pymongo.ASCENDING), ('town', pymongo.ASCENDING)], name='import_id_town', unique=True,
+            )
+            self._aggregates_indexed = True
+        for collection_name, documents in aggregates:
+            self.db[collection_name].insert_many(documents, ordered=False)
+
+    def _delete_import_aggregates(self, aggregates: ImportAggregates) -> None:
+        for collection_name, documents in aggregates:
+            self.db[collection_name].delete_many({'_id': {'$in': [document['_id'] for document in documents]}})
+
+    def _undo_relatives_updates(
+            self,
+            import_: collection.Collection,
+            citizen_id: int,
+            updated_relatives: List[List[int]],
+            session: Optional[client_session.ClientSession] = None,
+    ) -> None:
+        if session is not None:
+            return
+        updated_added_relatives, updated_removed_relatives = updated_relatives
+        self._update_relatives(
+            import_, self._get_relatives_updates(citizen_id, updated_removed_relatives, updated_added_relatives),
+        )
+
+    def _is_import_id_taken(self, import_id: int, error: errors.OperationFailure) -> bool:
+        if isinstance(error, errors.BulkWriteError):
+            write_errors = error.details.get('writeErrors')
+            return bool(write_errors) and all(
+                write_error['code'] == DuplicateKeyErrorCode for write_error in write_errors
+            )
+        return f'{import_id}' in self.db.list_collection_names()
+
+    @staticmethod
+    def _update_relatives(
+            import_: collection.Collection,
+            relatives_updates: List[Tuple[List[int], Dict[str, Any]]],
+            session: Optional[client_session.ClientSession] = None,
+    ) -> None:
+        requests = [
+            pymongo.UpdateMany({'citizen_id': {'$in': relatives}}, relative_update)
+            for relatives, relative_update in relatives_updates
+            if relatives
+        ]
+        if requests:
+            import_.bulk_write(requests, ordered=False, session=session)
+
+    @staticmethod
+    def _update_relatives_with_versions(
+            import_: collection.Collection,
+            relatives_updates: List[Tuple[List[int], Dict[str, Any]]],
+            relatives_versions: CitizensVersions,
+            session: Optional[client_session.ClientSession] = None,
+    ) -> List[List[int]]:
+        updated_relatives = [[] for _ in relatives_updates]
+        for (relatives, relative_update), updated_group in zip(relatives_updates, updated_relatives):
+            for relative_id in relatives:
+                result = import_.update_one(
+                    {'citizen_id': relative_id, CitizenVersionField: relatives_versions.get(relative_id)},
+                    relative_update,
+                    session=session,
+                )
+                if not result.matched_count:
+                    return updated_relatives
+                updated_group.append(relative_id)
+        return updated_relatives
+
+    @staticmethod
+    def _get_relatives_updates(
+            citizen_id: int,
+            added_relatives: List[int],
+            removed_relatives: List[int],
+    ) -> List[Tuple[List[int], Dict[str, Any]]]:
+        return [
+            (added_relatives, {'$addToSet': {'relatives': citizen_id}, '$inc': {CitizenVersionField: 1}}),
+            (removed_relatives, {'$pull': {'relatives': citizen_id}, '$inc': {CitizenVersionField: 1}}),
+        ]
+
+    @staticmethod
+    def _get_import_aggregates(
+            import_id: int,
+            birthdays_presents: Optional[BirthdaysPresents] = None,
+            towns_birth_dates: Optional[TownsBirthDates] = None,
+    ) -> ImportAggregates:
+        aggregates = []
+        if birthdays_presents is not None:
+            aggregates.append((BirthdaysCollection, [
+                {
+                    '_id': objectid.ObjectId(),
+                    'import_id': import_id,
+                    'month': month,
+                    'presents': {
+                        f'{citizen_id}': presents
+                        for citizen_id, presents in birthdays_presents.get(month, {}).items()
+                    },
+                }
+                for month in BirthMonths
+            ]))
+        if towns_birth_dates:
+            aggregates.append((TownsBirthDatesCollection, [
+                {
+                    '_id': objectid.ObjectId(),
+                    'import_id': import_id,
+                    'town': town,
+                    'position': position,
+                    'birth_dates': {f'{birth_date}': count for birth_date, count in birth_dates.items()},
+                }
+                for position, (town, birth_dates) in enumerate(towns_birth_dates)
+            ]))
+        return aggregates
+
+    @staticmethod
+    def deserialize_birthdays_presents(birthdays: Iterable[Dict[str, Any]]) -> Optional[BirthdaysPresents]:
+        birthdays = list(birthdays)
+        if len(birthdays) != len(BirthMonths):
+            return None
+        return {
+            month_presents['month']: {
+                int(citizen_id): presents for citizen_id, presents in month_presents['presents'].items()
+            }
+            for month_presents in birthdays
+            if month_presents['presents']
+        }
+
+    @staticmethod
+    def get_imports_signal_upsert() -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        return {'_id': ImportsSignal}, {'$setOnInsert': {'token': uuid.uuid4().hex}}
+
+    @staticmethod
+    def deserialize_import_version(import_version: Optional[Dict[str, Any]]) -> Optional[ImportVersion]:
+        if import_version is None:
+            return None
+        return import_version['token'], import_version['version']
+
+    @staticmethod
+    def deserialize_towns_birth_dates(towns: Iterable[Dict[str, Any]]) -> Optional[TownsBirthDates]:
+        towns_birth_dates = [
+            (town['town'], {int(birth_date): count for birth_date, count in town['birth_dates'].items()})
+            for town in towns
+        ]
+        return towns_birth_dates or None
+
+    @staticmethod
+    def get_citizens_query(
+            after_citizen_id: Optional[int] = None,
+            fields: Optional[List[str]] = None,
+    ) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        query = {} if after_citizen_id is None else {'citizen_id': {'$gt': after_citizen_id}}
+        if fields:
+            projection = {'_id': 0, 'citizen_id': 1, **{field: 1 for field in fields}}
+        else:
+            projection = {'_id': 0, CitizenVersionField: 0}
+        return query, projection
+
+    @staticmethod
+    def format_citizen_birth_date(citizen: Citizen) -> Citizen:
+        if 'birth_date' in citizen:
+            citizen['birth_date'] = citizen['birth_date'].strftime(BirthDateFmt)
+        return citizen
+
+    @staticmethod
+    def _get_citizens_indexes() -> List[pymongo.IndexModel]:
+        if config.IMPORT_EXTRA_INDEXES:
+            return CitizensIndexes + CitizensExtraIndexes
+        return CitizensIndexes
 
     @staticmethod
     def _prepare_citizens(citizens: Citizens, convert_datetime_to_str: bool = True) -> Citizens:
         for citizen in citizens:
             citizen.pop('_id')
+            citizen.pop(CitizenVersionField, None)
             if convert_datetime_to_str:
                 citizen['birth_date'] = citizen['birth_date'].strftime(BirthDateFmt)
         return citizens
-
-    def _get_citizen_relatives(self, import_id: int, citizen_id: int) -> CitizenRelatives:
-        import_ = self.db[f'{import_id}']
-        citizen = self.get_citizen(import_id, citizen_id)
-        citizen_relatives = citizen['relatives']
-        citizen_relatives = [import_.find_one({'citizen_id': related_id}) for related_id in citizen_relatives]
-        return citizen_relatives
-
-    @staticmethod
-    def _calculate_citizen_age(current_date: datetime.date, citizen_birth_date: datetime.date) -> int:
-        citizen_birth_date_passed = (
-                (current_date.month, current_date.day) < (citizen_birth_date.month, citizen_birth_date.day)
-        )
-        return current_date.year - citizen_birth_date.year - citizen_birth_date_passed
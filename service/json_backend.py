@@ -0,0 +1,103 @@
+import json
+from typing import Any, Callable, Optional, Type, Union
+
+from service import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONBackend:
+    NAME = 'json'
+
+    @staticmethod
+    def dumps(
+            obj: Any,
+            default: Optional[Callable[[Any], Any]] = None,
+            sort_keys: bool = False,
+            indent: Optional[int] = None,
+            ensure_ascii: bool = True,
+    ) -> str:
+        separators = (',', ':') if indent is None else None
+        return json.dumps(
+            obj, default=default, sort_keys=sort_keys, indent=indent, ensure_ascii=ensure_ascii, separators=separators,
+        )
+
+    @staticmethod
+    def loads(s: Union[str, bytes]) -> Any:
+        return json.loads(s)
+
+
+class UJSONBackend(JSONBackend):
+    NAME = 'ujson'
+
+    @staticmethod
+    def dumps(
+            obj: Any,
+            default: Optional[Callable[[Any], Any]] = None,
+            sort_keys: bool = False,
+            indent: Optional[int] = None,
+            ensure_ascii: bool = True,
+    ) -> str:
+        return ujson.dumps(
+            obj,
+            default=default,
+            sort_keys=sort_keys,
+            indent=indent or 0,
+            ensure_ascii=ensure_ascii,
+            escape_forward_slashes=False,
+        )
+
+    @staticmethod
+    def loads(s: Union[str, bytes]) -> Any:
+        return ujson.loads(s)
+
+
+class ORJSONBackend(JSONBackend):
+    NAME = 'orjson'
+
+    @staticmethod
+    def dumps(
+            obj: Any,
+            default: Optional[Callable[[Any], Any]] = None,
+            sort_keys: bool = False,
+            indent: Optional[int] = None,
+            ensure_ascii: bool = True,
+    ) -> str:
+        option = orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=default, option=option).decode('utf-8')
+
+    @staticmethod
+    def loads(s: Union[str, bytes]) -> Any:
+        return orjson.loads(s)
+
+
+BACKENDS = {
+    ORJSONBackend.NAME: ORJSONBackend if orjson else None,
+    UJSONBackend.NAME: UJSONBackend if ujson else None,
+    JSONBackend.NAME: JSONBackend,
+}
+
+
+def get_backend(name: str) -> Type[JSONBackend]:
+    if name == 'auto':
+        return next(backend for backend in BACKENDS.values() if backend)
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown JSON backend {name!r}')
+    if not BACKENDS[name]:
+        raise ValueError(f'JSON backend {name!r} is not installed')
+    return BACKENDS[name]
+
+
+BACKEND = get_backend(config.JSON_BACKEND)
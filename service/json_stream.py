@@ -0,0 +1,94 @@
+import codecs
+import json
+import re
+from typing import Any, BinaryIO, Iterator
+
+READ_CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER_DELIMITERS = frozenset(' \t\n\r,]}')
+TRUNCATED_TOKEN_SIZE = 16
+UNTERMINATED_STRING_ERROR = 'Unterminated string'
+
+
+class JSONStreamReader:
+    def __init__(self, stream: BinaryIO, read_chunk_size: int = READ_CHUNK_SIZE) -> None:
+        self.stream = stream
+        self.read_chunk_size = read_chunk_size
+        self.json_decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def peek(self) -> str:
+        self._skip_whitespace()
+        return self.buffer[self.position] if self.position < len(self.buffer) else ''
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f'Expecting {char!r} at position {self.position}')
+        self.position += 1
+
+    def decode_value(self) -> Any:
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError as e:
+                if not self._is_truncated(e) or not self._read(grow=True):
+                    raise
+                continue
+            if not self._is_value_complete(value, end) and self._read(grow=True):
+                continue
+            self.position = end
+            return value
+
+    def _is_value_complete(self, value: Any, end: int) -> bool:
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return True
+        return end < len(self.buffer) and self.buffer[end] in NUMBER_DELIMITERS
+
+    def _is_truncated(self, error: json.JSONDecodeError) -> bool:
+        if error.msg.startswith(UNTERMINATED_STRING_ERROR):
+            return True
+        return len(self.buffer) - error.pos <= TRUNCATED_TOKEN_SIZE
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer) or not self._read():
+                return
+
+    def _read(self, grow: bool = False) -> bool:
+        if self.eof:
+            return False
+        read_size = self.read_chunk_size
+        if grow:
+            read_size = max(read_size, len(self.buffer) - self.position)
+        data = self.stream.read(read_size)
+        self.eof = not data
+        self.buffer = self.buffer[self.position:] + self.text_decoder.decode(data, final=self.eof)
+        self.position = 0
+        return True
+
+
+def iter_array_items(stream: BinaryIO, key: str, read_chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+    reader = JSONStreamReader(stream, read_chunk_size)
+    reader.expect('{')
+    if reader.peek() != '"' or reader.decode_value() != key:
+        raise ValueError(f'Expecting the only key {key!r}')
+    reader.expect(':')
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.expect(']')
+    else:
+        while True:
+            yield reader.decode_value()
+            if reader.peek() == ',':
+                reader.expect(',')
+            else:
+                reader.expect(']')
+                break
+    reader.expect('}')
+    if reader.peek():
+        raise ValueError(f'Extra data at position {reader.position}')
@@ -0,0 +1,79 @@
+import argparse
+import json
+from typing import Any, Dict, List, Optional
+
+from service import columnar_database_framework
+from service import database_framework
+from service import service_framework
+
+
+def get_document_imports(database: database_framework.DataBase) -> database_framework.Imports:
+    return [import_id for import_id in database.imports if not database.is_columnar_import(import_id)]
+
+
+def backfill_indexes(database: database_framework.DataBase) -> List[database_framework.ImportIndexesStatus]:
+    return [database.ensure_import_indexes(import_id) for import_id in get_document_imports(database)]
+
+
+def indexes_status(database: database_framework.DataBase) -> List[database_framework.ImportIndexesStatus]:
+    return [database.get_import_indexes_status(import_id) for import_id in get_document_imports(database)]
+
+
+def backfill_birthdays(database: database_framework.DataBase) -> List[Dict[str, Any]]:
+    result = []
+    for import_id in get_document_imports(database):
+        backfilled = database.get_birthdays_presents(import_id) is None
+        if backfilled:
+            database.set_birthdays_presents(
+                import_id, service_framework.CitizensBirthdays.calculate_import_presents(database, import_id),
+            )
+        result.append({'import_id': import_id, 'backfilled': backfilled})
+    return result
+
+
+def backfill_towns_birth_dates(database: database_framework.DataBase) -> List[Dict[str, Any]]:
+    result = []
+    for import_id in get_document_imports(database):
+        backfilled = database.get_towns_birth_dates(import_id) is None
+        if backfilled:
+            towns, birth_dates = database.get_towns_citizens_birth_dates(import_id)
+            database.set_towns_birth_dates(
+                import_id,
+                service_framework.TownsAgeStats.calculate_towns_birth_dates(
+                    towns, [birth_date.toordinal() for birth_date in birth_dates],
+                ),
+            )
+        result.append({'import_id': import_id, 'backfilled': backfilled})
+    return result
+
+
+def backfill_import_versions(database: database_framework.DataBase) -> List[Dict[str, Any]]:
+    return [
+        {'import_id': import_id, 'backfilled': database.create_import_version(import_id)}
+        for import_id in database.imports
+    ]
+
+
+COMMANDS = {
+    'backfill-birthdays': backfill_birthdays,
+    'backfill-import-versions': backfill_import_versions,
+    'backfill-indexes': backfill_indexes,
+    'backfill-towns-birth-dates': backfill_towns_birth_dates,
+    'indexes-status': indexes_status,
+}
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Yandex Backend School service management commands')
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parsed_args = parser.parse_args(args)
+    database = columnar_database_framework.get_storage_backend()()
+    try:
+        result = COMMANDS[parsed_args.command](database)
+    finally:
+        database.close()
+    print(json.dumps(result, ensure_ascii=False, indent=4))
+
+
+if __name__ == '__main__':
+    main()
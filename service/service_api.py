@@ -1,16 +1,106 @@
+import datetime
+import itertools
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional, Tuple
+
 import flask
 from flask import wrappers
 
+from service import config
+from service import json_backend
 from service import service_framework
 
+
+class JSONEncoder(flask.json.JSONEncoder):
+    def encode(self, o: Any) -> str:
+        return json_backend.BACKEND.dumps(
+            o, default=self.default, sort_keys=self.sort_keys, indent=self.indent, ensure_ascii=self.ensure_ascii,
+        )
+
+
+class JSONDecoder(flask.json.JSONDecoder):
+    def decode(self, s: str, *args: Any) -> Any:
+        return json_backend.BACKEND.loads(s)
+
+
 app = flask.Flask(__name__)
+app.json_encoder = JSONEncoder
+app.json_decoder = JSONDecoder
 service = service_framework.Service()
+response_cache = service_framework.LRUCache(config.RESPONSE_CACHE_SIZE, sizeof=len)
+
+
+def iter_data_json_array(items: Iterable[Any]) -> Iterator[str]:
+    items = iter(items)
+    separator = ''
+    yield '{"data":['
+    while True:
+        batch = list(itertools.islice(items, config.CITIZENS_STREAM_BATCH_SIZE))
+        if not batch:
+            break
+        yield separator + ','.join(flask.json.dumps(item, separators=(',', ':')) for item in batch)
+        separator = ','
+    yield ']}\n'
+
+
+def iter_cached_body(chunks: Iterable[str], cache_key: Hashable) -> Iterator[bytes]:
+    body = []
+    body_size = 0
+    for chunk in chunks:
+        chunk = chunk.encode('utf-8')
+        if body is not None:
+            body_size += len(chunk)
+            if body_size <= response_cache.max_size:
+                body.append(chunk)
+            else:
+                body = None
+        yield chunk
+    if body is not None:
+        response_cache.put(cache_key, b''.join(body))
+
+
+def make_cached_response(
+        import_id: int,
+        cache_key: Tuple[Hashable, ...],
+        iter_body: Callable[[], Optional[Iterable[str]]],
+) -> wrappers.Response:
+    import_version = service.get_import_version(import_id)
+    if import_version is None:
+        chunks = iter_body()
+        if chunks is None:
+            return flask.make_response('Bad Request', 400)
+        return flask.Response(flask.stream_with_context(chunks), 200, mimetype='application/json')
+    cache_key = (import_id,) + import_version + cache_key
+    etag = '-'.join(str(key) for key in cache_key)
+    if flask.request.if_none_match.contains_weak(etag):
+        response = flask.Response(status=304)
+        response.set_etag(etag)
+        return response
+    body = response_cache.get(cache_key)
+    if body is None:
+        chunks = iter_body()
+        if chunks is None:
+            return flask.make_response('Bad Request', 400)
+        body = flask.stream_with_context(iter_cached_body(chunks, cache_key))
+    response = flask.Response(body, 200, mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+
+def iter_data_json(data: Any) -> Optional[Iterator[str]]:
+    if not data:
+        return None
+    return iter([flask.json.dumps({'data': data}, separators=(',', ':')) + '\n'])
 
 
 @app.route('/imports', methods=['POST'])
 def import_citizens() -> wrappers.Response:
-    request_json = flask.request.json
-    new_import_id = service.import_citizens(request_json)
+    if not flask.request.is_json:
+        return flask.make_response('Bad Request', 400)
+    content_length = flask.request.content_length
+    if content_length is not None and content_length <= config.IMPORT_STREAM_THRESHOLD:
+        new_import_id = service.import_citizens(flask.request.get_json(silent=True))
+    else:
+        new_import_id = service.import_citizens_from_stream(flask.request.stream)
     if new_import_id:
         resp_json = {'data': {'import_id': new_import_id}}
         return flask.make_response(flask.jsonify(resp_json), 201)
@@ -29,26 +119,33 @@ def patch_import_citizen(import_id: int, citizen_id: int) -> wrappers.Response:
 
 @app.route('/imports/<int:import_id>/citizens', methods=['GET'])
 def get_import_citizens(import_id: int) -> wrappers.Response:
-    citizens = service.get_import_citizens(import_id)
-    if citizens:
-        resp_json = {'data': citizens}
-        return flask.make_response(flask.jsonify(resp_json), 200)
-    return flask.make_response('Bad Request', 400)
+    query = flask.request.args.to_dict()
+
+    def iter_body() -> Optional[Iterator[str]]:
+        citizens = service.iter_import_citizens(import_id, query)
+        return iter_data_json_array(citizens) if citizens is not None else None
+
+    return make_cached_response(import_id, ('citizens',) + tuple(sorted(query.items())), iter_body)
 
 
 @app.route('/imports/<int:import_id>/citizens/birthdays', methods=['GET'])
 def get_import_citizens_birthdays(import_id: int) -> wrappers.Response:
-    import_citizens_birthdays = service.get_import_citizens_birthdays(import_id)
-    if import_citizens_birthdays:
-        resp_json = {'data': import_citizens_birthdays}
-        return flask.make_response(flask.jsonify(resp_json), 200)
-    return flask.make_response('Bad Request', 400)
+    return make_cached_response(
+        import_id,
+        ('birthdays',),
+        lambda: iter_data_json(service.get_import_citizens_birthdays(import_id)),
+    )
 
 
 @app.route('/imports/<int:import_id>/towns/stat/percentile/age', methods=['GET'])
 def get_towns_percentile_age_stats(import_id: int) -> wrappers.Response:
-    towns_percentile_age_stats = service.get_towns_percentile_age_stats(import_id)
-    if towns_percentile_age_stats:
-        resp_json = {'data': towns_percentile_age_stats}
-        return flask.make_response(flask.jsonify(resp_json), 200)
-    return flask.make_response('Bad Request', 400)
+    return make_cached_response(
+        import_id,
+        ('percentile', datetime.datetime.utcnow().date().isoformat()),
+        lambda: iter_data_json(service.get_towns_percentile_age_stats(import_id)),
+    )
+
+
+@app.route('/metrics/pool', methods=['GET'])
+def get_pool_metrics() -> wrappers.Response:
+    return flask.make_response(flask.jsonify({'data': service.get_pool_metrics()}), 200)
@@ -1,17 +1,30 @@
+import atexit
 import collections
+import contextlib
 import copy
 import datetime
 import enum
-import multiprocessing
+import itertools
 import numpy
+import os
 import re
-from typing import Any, Dict, List, NewType, Optional, Tuple, Union
+import threading
+from collections import abc
+from concurrent import futures
+from concurrent.futures import process
+from typing import (
+    Any, BinaryIO, Callable, Dict, Hashable, Iterable, Iterator, List, NewType, Optional, Tuple, Union,
+)
 
 import cerberus
+from pymongo import client_session
 
+from service import columnar_database_framework
+from service import config
+from service import database_client
 from service import database_framework
+from service import json_stream
 
-Counter = NewType('Counter', Dict[int, int])
 Citizen = NewType('CitizenDict', Dict[str, Any])
 Citizens = NewType('CitizensList', List[Citizen])
 ValidatedCitizen = NewType('ValidatedCitizen', Dict[str, Union[int, str, List[int]]])
@@ -20,6 +33,10 @@ NewImportId = NewType('NewImportId', int)
 PatchedCitizen = NewType('PatchedCitizen', Citizen)
 ImportCitizensBirthdays = NewType('ImportCitizensBirthdays', Dict[str, List[Dict[str, int]]])
 TownsPercentileAgeStats = NewType('TownsPercentileAgeStats', List[Dict[str, Union[str, int]]])
+ValidationSchema = NewType('ValidationSchema', Dict[str, Dict[str, Any]])
+ValueValidator = NewType('ValueValidator', Callable[[Any], Any])
+
+STRING_PATTERN = re.compile(r'[^\W_]')
 
 
 class CitizenAttr(enum.Enum):
@@ -34,14 +51,25 @@ class CitizenAttr(enum.Enum):
     RELATIVES = 'relatives'
 
 
+MAX_INTEGER = 2 ** 63 - 1
+CITIZENS_QUERY_SCHEMA = {
+    'limit': {'type': 'integer', 'min': 1, 'max': MAX_INTEGER, 'coerce': int},
+    'after_citizen_id': {'type': 'integer', 'min': 0, 'max': MAX_INTEGER, 'coerce': int},
+    'fields': {
+        'type': 'list',
+        'minlength': 1,
+        'allowed': [attr.value for attr in CitizenAttr],
+        'coerce': lambda v: v.split(','),
+    },
+}
+
+
 class Validator(cerberus.Validator):
     def _check_with_validate_string(self, field: str, value: Any):
         if value is None:
             self._error(field, 'Could not be NoneType')
-        else:
-            pattern = re.compile(r'[^\W_]')
-            if not pattern.match(value):
-                self._error(field, 'Must contain at least one letter or digit')
+        elif not STRING_PATTERN.match(value):
+            self._error(field, 'Must contain at least one letter or digit')
 
     @staticmethod
     def _normalize_coerce_str_to_date(value: Any) -> Optional[datetime.datetime]:
@@ -53,65 +81,603 @@ class Validator(cerberus.Validator):
             return date
 
 
+class FastValidator:
+    SUPPORTED_RULES = frozenset(
+        ('allowed', 'check_with', 'coerce', 'max', 'maxlength', 'min', 'minlength', 'nullable', 'required', 'schema',
+         'type')
+    )
+    TYPES = {
+        'datetime': ((datetime.datetime,), ()),
+        'integer': ((int,), ()),
+        'list': ((abc.Sequence,), (str,)),
+        'string': ((str,), ()),
+    }
+    CHECKS = {
+        'validate_string': lambda value: value is not None and STRING_PATTERN.match(value) is not None,
+    }
+    INVALID = object()
+
+    def __init__(self, schema: ValidationSchema, require_all: bool = False) -> None:
+        self.required_fields = frozenset(
+            field for field, rules in schema.items() if rules.get('required', require_all)
+        )
+        self.fields_validators = {field: self._compile_rules(rules) for field, rules in schema.items()}
+
+    def validated(self, document: Any) -> Optional[Dict[str, Any]]:
+        if not isinstance(document, abc.Mapping) or not self.required_fields.issubset(document):
+            return None
+        validated_document = dict()
+        for field, value in document.items():
+            field_validator = self.fields_validators.get(field)
+            if field_validator is None:
+                return None
+            value = field_validator(value)
+            if value is self.INVALID:
+                return None
+            validated_document[field] = value
+        return validated_document
+
+    def _compile_rules(self, rules: Dict[str, Any]) -> ValueValidator:
+        unsupported_rules = set(rules) - self.SUPPORTED_RULES
+        if unsupported_rules:
+            raise ValueError(f'Unsupported validation rules: {sorted(unsupported_rules)}')
+        coerce = rules.get('coerce')
+        if isinstance(coerce, str):
+            coerce = getattr(Validator, f'_normalize_coerce_{coerce}')
+        nullable = rules.get('nullable', False)
+        types, excluded_types = self._compile_types(rules.get('type'))
+        min_value, max_value = rules.get('min'), rules.get('max')
+        min_length, max_length = rules.get('minlength'), rules.get('maxlength')
+        allowed = rules.get('allowed')
+        check = self.CHECKS[rules['check_with']] if 'check_with' in rules else None
+        items_validator = self._compile_rules(rules['schema']) if 'schema' in rules else None
+        invalid = self.INVALID
+
+        def validate_value(value: Any) -> Any:
+            if coerce is not None:
+                try:
+                    value = coerce(value)
+                except Exception:
+                    return invalid
+            if value is None:
+                return None if nullable else invalid
+            if types and (not isinstance(value, types) or isinstance(value, excluded_types)):
+                return invalid
+            if min_value is not None and value < min_value:
+                return invalid
+            if max_value is not None and value > max_value:
+                return invalid
+            if min_length is not None and len(value) < min_length:
+                return invalid
+            if max_length is not None and len(value) > max_length:
+                return invalid
+            if allowed is not None:
+                if isinstance(value, abc.Iterable) and not isinstance(value, str):
+                    if any(item not in allowed for item in value):
+                        return invalid
+                elif value not in allowed:
+                    return invalid
+            if check is not None and not check(value):
+                return invalid
+            if items_validator is not None:
+                items = [items_validator(item) for item in value]
+                if any(item is invalid for item in items):
+                    return invalid
+                value = items if isinstance(value, list) else type(value)(items)
+            return value
+
+        return validate_value
+
+    @classmethod
+    def _compile_types(cls, type_names: Union[None, str, List[str]]) -> Tuple[tuple, tuple]:
+        if type_names is None:
+            return (), ()
+        if isinstance(type_names, str):
+            type_names = [type_names]
+        types, excluded_types = list(), list()
+        for type_name in type_names:
+            included, excluded = cls.TYPES[type_name]
+            types.extend(included)
+            excluded_types.extend(excluded)
+        return tuple(types), tuple(excluded_types)
+
+
 class CitizenValidator:
     CITIZEN_VALIDATION_SCHEMA = {
-        'citizen_id': {'type': 'integer', 'min': 0, 'coerce': lambda v: None if isinstance(v, bool) else v},
+        'citizen_id': {
+            'type': 'integer', 'min': 0, 'max': MAX_INTEGER, 'coerce': lambda v: None if isinstance(v, bool) else v,
+        },
         'town': {'type': 'string', 'minlength': 1, 'maxlength': 256, 'check_with': 'validate_string'},
         'street': {'type': 'string', 'minlength': 1, 'maxlength': 256, 'check_with': 'validate_string'},
         'building': {'type': 'string', 'minlength': 1, 'maxlength': 256, 'check_with': 'validate_string'},
-        'apartment': {'type': 'integer', 'min': 0, 'coerce': lambda v: None if isinstance(v, bool) else v},
+        'apartment': {
+            'type': 'integer', 'min': 0, 'max': MAX_INTEGER, 'coerce': lambda v: None if isinstance(v, bool) else v,
+        },
         'name': {'type': 'string', 'minlength': 1, 'maxlength': 256},
         'birth_date': {'type': 'datetime', 'max': datetime.datetime.utcnow(), 'coerce': 'str_to_date'},
         'gender': {'type': 'string', 'allowed': ['male', 'female']},
-        'relatives': {'type': 'list', 'schema': {'type': 'integer'}},
+        'relatives': {'type': 'list', 'schema': {'type': 'integer', 'max': MAX_INTEGER}},
     }
-    VALIDATOR = Validator(CITIZEN_VALIDATION_SCHEMA, require_all=True)
+    REFERENCE_VALIDATOR = Validator(CITIZEN_VALIDATION_SCHEMA, require_all=True)
+    FAST_VALIDATOR = FastValidator(CITIZEN_VALIDATION_SCHEMA, require_all=True)
+    VALIDATOR = REFERENCE_VALIDATOR if config.CITIZEN_VALIDATOR == 'cerberus' else FAST_VALIDATOR
 
     @classmethod
-    def validate_citizen(cls, citizen: Dict[str, Any]) -> Optional[Tuple[ValidatedCitizen, Counter, Counter]]:
+    def validate_citizen(cls, citizen: Dict[str, Any]) -> Optional[ValidatedCitizen]:
         validated_citizen = cls.VALIDATOR.validated(citizen)
         if not validated_citizen:
             return None
-        relatives = validated_citizen['relatives']
-        if validated_citizen['citizen_id'] in relatives:
+        if validated_citizen['citizen_id'] in validated_citizen['relatives']:
+            return None
+        return validated_citizen
+
+    @classmethod
+    def validate_citizens(cls, citizens: Citizens) -> Optional[ValidatedCitizens]:
+        validated_citizens = list()
+        for citizen in citizens:
+            validated_citizen = cls.validate_citizen(citizen)
+            if not validated_citizen:
+                return None
+            validated_citizens.append(validated_citizen)
+        return validated_citizens
+
+
+class ComputeExecutor:
+    _executor: Optional[futures.ProcessPoolExecutor] = None
+    _executor_pid: Optional[int] = None
+    _imports_semaphore: Optional[threading.BoundedSemaphore] = None
+    _imports_semaphore_pid: Optional[int] = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_executor(cls) -> Optional[futures.ProcessPoolExecutor]:
+        if config.VALIDATION_PROCESSES <= 0:
             return None
+        with cls._lock:
+            if cls._executor is None or cls._executor_pid != os.getpid():
+                cls._executor = futures.ProcessPoolExecutor(config.VALIDATION_PROCESSES)
+                cls._executor_pid = os.getpid()
+            return cls._executor
+
+    @classmethod
+    def submit(cls, function: Callable[..., Any], *args: Any, size: Optional[int] = None) -> futures.Future:
+        executor = None
+        if size is None or size >= config.VALIDATION_INLINE_THRESHOLD:
+            executor = cls.get_executor()
+        if executor is not None:
+            try:
+                return executor.submit(function, *args)
+            except process.BrokenProcessPool:
+                cls.shutdown()
+        future = futures.Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @classmethod
+    def map(cls, function: Callable[[Any], Any], items: Iterable[Any]) -> Iterator[Any]:
+        executor = cls.get_executor()
+        if executor is None:
+            yield from map(function, items)
+            return
+        max_items_in_flight = 2 * config.VALIDATION_PROCESSES
+        items_futures = collections.deque()
+        try:
+            for item in items:
+                items_futures.append(executor.submit(function, item))
+                if len(items_futures) >= max_items_in_flight:
+                    yield items_futures.popleft().result()
+                while items_futures and items_futures[0].done():
+                    yield items_futures.popleft().result()
+            while items_futures:
+                yield items_futures.popleft().result()
+        finally:
+            for item_future in items_futures:
+                item_future.cancel()
+
+    @classmethod
+    @contextlib.contextmanager
+    def import_slot(cls) -> Iterator[None]:
+        if config.MAX_IMPORTS_IN_FLIGHT <= 0:
+            yield
+            return
+        with cls._lock:
+            if cls._imports_semaphore is None or cls._imports_semaphore_pid != os.getpid():
+                cls._imports_semaphore = threading.BoundedSemaphore(config.MAX_IMPORTS_IN_FLIGHT)
+                cls._imports_semaphore_pid = os.getpid()
+            imports_semaphore = cls._imports_semaphore
+        with imports_semaphore:
+            yield
+
+    @classmethod
+    def shutdown(cls) -> None:
+        with cls._lock:
+            if cls._executor is not None and cls._executor_pid == os.getpid():
+                cls._executor.shutdown()
+            cls._executor = None
+            cls._executor_pid = None
+
+
+atexit.register(ComputeExecutor.shutdown)
+
+
+class CitizensValidator:
+    @classmethod
+    def validate_import_citizens(cls, citizens: Iterable[Any]) -> Optional[ValidatedCitizens]:
+        validated_citizens = list()
+        for validated_chunk in cls.iter_validated_citizens_chunks(citizens):
+            if validated_chunk is None:
+                return None
+            validated_citizens.extend(validated_chunk)
+        if not validated_citizens:
+            return None
+        citizen_ids = [citizen['citizen_id'] for citizen in validated_citizens]
+        citizens_relatives = [citizen['relatives'] for citizen in validated_citizens]
+        if not cls.check_citizens_relatives(citizen_ids, citizens_relatives):
+            return None
+        return validated_citizens
+
+    @classmethod
+    def iter_validated_citizens_chunks(cls, citizens: Iterable[Any]) -> Iterator[Optional[ValidatedCitizens]]:
+        chunks = cls._iter_chunks(citizens, config.VALIDATION_CHUNK_SIZE)
+        first_chunk = next(chunks, [])
+        second_chunk = next(chunks, None)
+        if second_chunk is None and len(first_chunk) < config.VALIDATION_INLINE_THRESHOLD:
+            yield CitizenValidator.validate_citizens(first_chunk)
+            return
+        chunks = itertools.chain([first_chunk] if second_chunk is None else [first_chunk, second_chunk], chunks)
+        for validated_chunk in ComputeExecutor.map(CitizenValidator.validate_citizens, chunks):
+            yield validated_chunk
+            if validated_chunk is None:
+                return
+
+    @classmethod
+    def check_citizens_relatives(cls, citizen_ids: List[int], citizens_relatives: List[List[int]]) -> bool:
+        relatives_counts = [len(citizen_relatives) for citizen_relatives in citizens_relatives]
+        relatives = list(itertools.chain.from_iterable(citizens_relatives))
+        try:
+            citizen_ids_array = numpy.array(citizen_ids, dtype=numpy.int64)
+            relatives_array = numpy.array(relatives, dtype=numpy.int64)
+        except OverflowError:
+            return cls._check_citizens_relatives_without_numpy(citizen_ids, relatives_counts, relatives)
+        sorted_citizen_ids = numpy.sort(citizen_ids_array)
+        if numpy.any(sorted_citizen_ids[1:] == sorted_citizen_ids[:-1]):
+            return False
+        citizens_array = numpy.repeat(citizen_ids_array, relatives_counts)
+        edges_order = numpy.lexsort((relatives_array, citizens_array))
+        edges_citizens = citizens_array[edges_order]
+        edges_relatives = relatives_array[edges_order]
+        duplicated_edges = (edges_citizens[1:] == edges_citizens[:-1]) & (edges_relatives[1:] == edges_relatives[:-1])
+        if numpy.any(duplicated_edges):
+            return False
+        reversed_edges_order = numpy.lexsort((citizens_array, relatives_array))
         return (
-            validated_citizen,
-            {validated_citizen['citizen_id']: len(relatives)} if relatives else {},
-            {related_id: 1 for related_id in relatives},
+                numpy.array_equal(edges_citizens, relatives_array[reversed_edges_order])
+                and numpy.array_equal(edges_relatives, citizens_array[reversed_edges_order])
         )
 
+    @staticmethod
+    def _check_citizens_relatives_without_numpy(
+            citizen_ids: List[int],
+            relatives_counts: List[int],
+            relatives: List[int],
+    ) -> bool:
+        if len(set(citizen_ids)) != len(citizen_ids):
+            return False
+        citizens = itertools.chain.from_iterable(
+            itertools.repeat(citizen_id, relatives_count)
+            for citizen_id, relatives_count in zip(citizen_ids, relatives_counts)
+        )
+        edges = list(zip(citizens, relatives))
+        edges_set = set(edges)
+        if len(edges_set) != len(edges):
+            return False
+        return all((relative_id, citizen_id) in edges_set for citizen_id, relative_id in edges)
+
+    @staticmethod
+    def _iter_chunks(items: Iterable[Any], chunk_size: int) -> Iterator[List[Any]]:
+        items = iter(items)
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+class CitizensBirthdays:
+    PRESENTS_KEY_SHIFT = 59
+
+    @classmethod
+    def calculate_import_presents(
+            cls,
+            database: database_framework.DataBase,
+            import_id: int,
+            engine: Optional[str] = None,
+    ) -> database_framework.BirthdaysPresents:
+        engine = engine or config.BIRTHDAYS_ENGINE
+        if engine == 'aggregation':
+            return database.get_birthdays_presents_by_aggregation(import_id)
+        if engine == 'numpy':
+            return cls.calculate_presents_with_numpy(*database.get_citizens_relatives_with_birth_months(import_id))
+        if engine == 'python':
+            citizens = database.get_citizens_with_relatives_dict(import_id).values()
+            return cls.calculate_presents(
+                [citizen['citizen_id'] for citizen in citizens],
+                [citizen['relatives'] for citizen in citizens],
+                [citizen['birth_date'].month for citizen in citizens],
+            )
+        raise ValueError(f'Unknown birthdays engine {engine!r}')
+
+    @staticmethod
+    def calculate_presents(
+            citizen_ids: List[int],
+            citizens_relatives: List[List[int]],
+            citizens_birth_months: List[int],
+    ) -> database_framework.BirthdaysPresents:
+        birth_months = dict(zip(citizen_ids, citizens_birth_months))
+        presents = collections.Counter()
+        for citizen_id, citizen_relatives in zip(citizen_ids, citizens_relatives):
+            for relative_id in citizen_relatives:
+                presents[birth_months[relative_id], citizen_id] += 1
+        return CitizensBirthdays._group_presents(presents)
+
+    @classmethod
+    def calculate_presents_with_numpy(
+            cls,
+            citizen_ids: List[int],
+            citizens_relatives: List[List[int]],
+            citizens_birth_months: List[int],
+    ) -> database_framework.BirthdaysPresents:
+        relatives_counts = numpy.fromiter(
+            map(len, citizens_relatives), dtype=numpy.int64, count=len(citizens_relatives),
+        )
+        try:
+            relative_ids = numpy.fromiter(
+                itertools.chain.from_iterable(citizens_relatives), dtype=numpy.int64, count=int(relatives_counts.sum()),
+            )
+        except OverflowError:
+            return cls.calculate_presents(citizen_ids, citizens_relatives, citizens_birth_months)
+        if relative_ids.size and relative_ids.max() >= 1 << cls.PRESENTS_KEY_SHIFT:
+            return cls.calculate_presents(citizen_ids, citizens_relatives, citizens_birth_months)
+        months = numpy.repeat(numpy.array(citizens_birth_months, dtype=numpy.int64), relatives_counts)
+        return cls._count_presents(months, relative_ids)
+
+    @classmethod
+    def calculate_presents_from_columns(
+            cls,
+            import_columns: database_framework.ImportColumns,
+    ) -> database_framework.BirthdaysPresents:
+        relative_ids = import_columns.relatives.astype(numpy.int64)
+        birth_months = cls.calculate_birth_months(import_columns.birth_dates)
+        if relative_ids.size and relative_ids.max() >= 1 << cls.PRESENTS_KEY_SHIFT:
+            relatives_bounds = import_columns.relatives_offsets.tolist()
+            relative_ids = relative_ids.tolist()
+            return cls.calculate_presents(
+                import_columns.citizen_ids.tolist(),
+                [relative_ids[start:end] for start, end in zip(relatives_bounds, relatives_bounds[1:])],
+                birth_months.tolist(),
+            )
+        months = numpy.repeat(birth_months, numpy.diff(import_columns.relatives_offsets))
+        return cls._count_presents(months, relative_ids)
+
+    @staticmethod
+    def calculate_birth_months(birth_dates: numpy.ndarray) -> numpy.ndarray:
+        birth_dates = (birth_dates.astype(numpy.int64) - TownsAgeStats.EPOCH_ORDINAL).astype('datetime64[D]')
+        return birth_dates.astype('datetime64[M]').astype(numpy.int64) % 12 + 1
+
+    @classmethod
+    def _count_presents(
+            cls,
+            months: numpy.ndarray,
+            relative_ids: numpy.ndarray,
+    ) -> database_framework.BirthdaysPresents:
+        presents_keys, presents = numpy.unique(
+            (months << cls.PRESENTS_KEY_SHIFT) | relative_ids, return_counts=True,
+        )
+        months = presents_keys >> cls.PRESENTS_KEY_SHIFT
+        relative_ids = presents_keys & ((1 << cls.PRESENTS_KEY_SHIFT) - 1)
+        months_bounds = numpy.searchsorted(months, numpy.arange(1, 14)).tolist()
+        birthdays_presents = {}
+        for month, start, end in zip(range(1, 13), months_bounds, months_bounds[1:]):
+            if start < end:
+                birthdays_presents[month] = dict(zip(relative_ids[start:end].tolist(), presents[start:end].tolist()))
+        return birthdays_presents
+
+    @staticmethod
+    def calculate_presents_delta(
+            citizen_id: int,
+            old_birth_month: int,
+            new_birth_month: int,
+            old_relatives: Iterable[int],
+            new_relatives: Iterable[int],
+            relatives_birth_months: database_framework.CitizensBirthMonths,
+    ) -> database_framework.BirthdaysPresents:
+        old_relatives = set(old_relatives)
+        new_relatives = set(new_relatives)
+        presents = collections.Counter()
+        for relative_id in old_relatives - new_relatives:
+            presents[relatives_birth_months[relative_id], citizen_id] -= 1
+            presents[old_birth_month, relative_id] -= 1
+        for relative_id in new_relatives - old_relatives:
+            presents[relatives_birth_months[relative_id], citizen_id] += 1
+            presents[new_birth_month, relative_id] += 1
+        if old_birth_month != new_birth_month:
+            for relative_id in old_relatives & new_relatives:
+                presents[old_birth_month, relative_id] -= 1
+                presents[new_birth_month, relative_id] += 1
+        return CitizensBirthdays._group_presents(presents)
+
+    @staticmethod
+    def format_birthdays(birthdays_presents: database_framework.BirthdaysPresents) -> ImportCitizensBirthdays:
+        birthdays = {str(month): [] for month in range(1, 13)}
+        for month, citizens_presents in birthdays_presents.items():
+            birthdays[str(month)] = [
+                {'citizen_id': citizen_id, 'presents': presents}
+                for citizen_id, presents in sorted(citizens_presents.items())
+                if presents > 0
+            ]
+        return birthdays
+
+    @staticmethod
+    def _group_presents(presents: Dict[Tuple[int, int], int]) -> database_framework.BirthdaysPresents:
+        birthdays_presents = collections.defaultdict(dict)
+        for (month, citizen_id), citizen_presents in presents.items():
+            if citizen_presents:
+                birthdays_presents[month][citizen_id] = citizen_presents
+        return dict(birthdays_presents)
+
+
+class LRUCache:
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int] = lambda value: 1) -> None:
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.items: collections.OrderedDict = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        value_size = self.sizeof(value)
+        if value_size > self.max_size:
+            return
+        with self.lock:
+            if key in self.items:
+                self.size -= self.sizeof(self.items.pop(key))
+            self.items[key] = value
+            self.size += value_size
+            while self.size > self.max_size:
+                self.size -= self.sizeof(self.items.popitem(last=False)[1])
+
+
+class TownsAgeStats:
+    PERCENTILES = [50, 75, 99]
+    EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+    @staticmethod
+    def calculate_ages(birth_dates: List[datetime.datetime], current_date: datetime.date) -> numpy.ndarray:
+        birth_dates = numpy.array(birth_dates, dtype='datetime64[D]')
+        birth_months = birth_dates.astype('datetime64[M]')
+        birth_years = birth_dates.astype('datetime64[Y]').astype(numpy.int64) + 1970
+        birth_month_days = (
+                (birth_months.astype(numpy.int64) % 12 + 1) * 32 + (birth_dates - birth_months).astype(numpy.int64) + 1
+        )
+        return current_date.year - birth_years - (current_date.month * 32 + current_date.day < birth_month_days)
+
+    @classmethod
+    def calculate_percentile_age_stats(cls, towns: List[str], ages: numpy.ndarray) -> TownsPercentileAgeStats:
+        if not towns:
+            return []
+        towns_names, towns_first_indexes, towns_codes = numpy.unique(towns, return_index=True, return_inverse=True)
+        towns_ages = ages[numpy.argsort(towns_codes, kind='stable')]
+        towns_bounds = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(towns_codes))]).tolist()
+        towns_percentile_age_stats = list()
+        for town_code in numpy.argsort(towns_first_indexes).tolist():
+            percentiles_ages = numpy.percentile(
+                towns_ages[towns_bounds[town_code]:towns_bounds[town_code + 1]], cls.PERCENTILES,
+            )
+            town_percentile_age_stats = {'town': str(towns_names[town_code])}
+            for percentile, percentile_age in zip(cls.PERCENTILES, percentiles_ages):
+                town_percentile_age_stats[f'p{percentile}'] = round(percentile_age, 2)
+            towns_percentile_age_stats.append(town_percentile_age_stats)
+        return towns_percentile_age_stats
+
+    @classmethod
+    def calculate_citizens_percentile_age_stats(
+            cls,
+            towns: List[str],
+            birth_dates: List[datetime.datetime],
+            current_date: datetime.date,
+    ) -> TownsPercentileAgeStats:
+        return cls.calculate_percentile_age_stats(towns, cls.calculate_ages(birth_dates, current_date))
+
+    @staticmethod
+    def calculate_towns_birth_dates(towns: List[str], birth_dates: List[int]) -> database_framework.TownsBirthDates:
+        towns_birth_dates = collections.defaultdict(collections.Counter)
+        for town, birth_date in zip(towns, birth_dates):
+            towns_birth_dates[town][birth_date] += 1
+        return [(town, dict(town_birth_dates)) for town, town_birth_dates in towns_birth_dates.items()]
+
+    @classmethod
+    def calculate_towns_birth_dates_percentile_age_stats(
+            cls,
+            towns_birth_dates: database_framework.TownsBirthDates,
+            current_date: datetime.date,
+    ) -> TownsPercentileAgeStats:
+        towns_percentile_age_stats = list()
+        for town, town_birth_dates in towns_birth_dates:
+            town_percentile_age_stats = cls._calculate_town_percentile_age_stats(
+                town,
+                numpy.fromiter(town_birth_dates.keys(), dtype=numpy.int64, count=len(town_birth_dates)),
+                numpy.fromiter(town_birth_dates.values(), dtype=numpy.int64, count=len(town_birth_dates)),
+                current_date,
+            )
+            if town_percentile_age_stats is not None:
+                towns_percentile_age_stats.append(town_percentile_age_stats)
+        return towns_percentile_age_stats
 
-class CitizensValidator:
     @classmethod
-    def validate_import_citizens(cls, citizens: Citizens) -> Optional[ValidatedCitizens]:
-        validated_citizens_list = list()
-        citizen_relatives = collections.Counter()
-        related_citizens = collections.Counter()
-        pool = multiprocessing.Pool(5)
-        validated_citizens = [
-            pool.apply_async(CitizenValidator.validate_citizen, args=(citizen,)) for citizen in citizens
-        ]
-        for res in validated_citizens:
-            result = res.get()
-            if not result:
-                break
-            validated_citizen, citizen_relatives_count, related_citizens_counts = result
-            validated_citizens_list.append(validated_citizen)
-            citizen_relatives.update(citizen_relatives_count)
-            related_citizens.update(related_citizens_counts)
-        pool.close()
-        pool.join()
-        if len(validated_citizens) != len(citizens):
-            return None
-        if not citizen_relatives == related_citizens:
-            return None
-        return validated_citizens_list
+    def calculate_columns_percentile_age_stats(
+            cls,
+            import_columns: database_framework.ImportColumns,
+            current_date: datetime.date,
+    ) -> TownsPercentileAgeStats:
+        towns = import_columns.towns.astype(numpy.int64)
+        birth_dates = import_columns.birth_dates.astype(numpy.int64)
+        order = numpy.argsort(towns, kind='stable')
+        towns_bounds = numpy.searchsorted(towns[order], numpy.arange(len(import_columns.towns_dictionary) + 1))
+        birth_dates = birth_dates[order]
+        towns_percentile_age_stats = list()
+        for town, start, end in zip(import_columns.towns_dictionary, towns_bounds.tolist(), towns_bounds[1:].tolist()):
+            if start == end:
+                continue
+            town_birth_dates, counts = numpy.unique(birth_dates[start:end], return_counts=True)
+            towns_percentile_age_stats.append(
+                cls._calculate_town_percentile_age_stats(town, town_birth_dates, counts, current_date)
+            )
+        return towns_percentile_age_stats
+
+    @classmethod
+    def _calculate_town_percentile_age_stats(
+            cls,
+            town: str,
+            birth_dates: numpy.ndarray,
+            counts: numpy.ndarray,
+            current_date: datetime.date,
+    ) -> Optional[Dict[str, Union[str, int]]]:
+        order = numpy.argsort(-birth_dates)
+        order = order[counts[order] > 0]
+        if not order.size:
+            return None
+        ages = cls.calculate_ages((birth_dates[order] - cls.EPOCH_ORDINAL).astype('datetime64[D]'), current_date)
+        town_percentile_age_stats = {'town': town}
+        for percentile, percentile_age in zip(cls.PERCENTILES, cls.calculate_percentiles(ages, counts[order])):
+            town_percentile_age_stats[f'p{percentile}'] = round(percentile_age, 2)
+        return town_percentile_age_stats
+
+    @classmethod
+    def calculate_percentiles(cls, ages: numpy.ndarray, counts: numpy.ndarray) -> numpy.ndarray:
+        cumulative_counts = numpy.cumsum(counts)
+        indexes = (cumulative_counts[-1] - 1) * (numpy.array(cls.PERCENTILES) / 100)
+        lower_indexes = numpy.floor(indexes).astype(numpy.int64)
+        upper_indexes = numpy.minimum(lower_indexes + 1, cumulative_counts[-1] - 1)
+        lower_ages = ages[numpy.searchsorted(cumulative_counts, lower_indexes, side='right')]
+        upper_ages = ages[numpy.searchsorted(cumulative_counts, upper_indexes, side='right')]
+        return lower_ages + (upper_ages - lower_ages) * (indexes - lower_indexes)
 
 
 class Service:
     def __init__(self) -> None:
-        self.database = database_framework.DataBase()
+        self.database = columnar_database_framework.get_storage_backend()()
+        self.insert_executor = futures.ThreadPoolExecutor(config.INSERT_THREADS)
+        self.towns_age_stats_cache = LRUCache(config.TOWNS_AGE_STATS_CACHE_SIZE)
 
     def import_citizens(self, request_json: Any) -> Optional[NewImportId]:
         if not isinstance(request_json, dict):
@@ -120,90 +686,218 @@ class Service:
         validator = cerberus.Validator(schema, require_all=True)
         if not validator.validate(request_json):
             return None
-        citizens = request_json['citizens']
-        validated_citizens = CitizensValidator.validate_import_citizens(citizens)
-        if not validated_citizens:
+        return self._import_citizens(request_json['citizens'])
+
+    def import_citizens_from_stream(self, stream: BinaryIO) -> Optional[NewImportId]:
+        citizens = json_stream.iter_array_items(stream, 'citizens')
+        try:
+            return self._import_citizens(citizens)
+        except ValueError:
             return None
-        new_import_id = self.database.insert_citizens_to_new_import(validated_citizens)
-        return new_import_id
+
+    def _import_citizens(self, citizens: Iterable[Any]) -> Optional[NewImportId]:
+        staging_import = None
+        published = False
+        inserts = collections.deque()
+        citizen_ids = list()
+        citizens_relatives = list()
+        citizens_birth_months = list()
+        citizens_towns = list()
+        citizens_birth_dates = list()
+        calculations = list()
+        with ComputeExecutor.import_slot():
+            try:
+                for validated_chunk in CitizensValidator.iter_validated_citizens_chunks(citizens):
+                    if not validated_chunk:
+                        return None
+                    if staging_import is None:
+                        staging_import = self.database.create_staging_import()
+                    inserts.append(
+                        self.insert_executor.submit(
+                            self.database.insert_citizens_to_staging_import, staging_import, validated_chunk,
+                        )
+                    )
+                    while len(inserts) > config.INSERT_THREADS:
+                        if not inserts.popleft().result():
+                            return None
+                    citizen_ids.extend(citizen['citizen_id'] for citizen in validated_chunk)
+                    citizens_relatives.extend(citizen['relatives'] for citizen in validated_chunk)
+                    citizens_birth_months.extend(citizen['birth_date'].month for citizen in validated_chunk)
+                    citizens_towns.extend(citizen['town'] for citizen in validated_chunk)
+                    citizens_birth_dates.extend(citizen['birth_date'].toordinal() for citizen in validated_chunk)
+                if staging_import is None:
+                    return None
+                size = len(citizen_ids)
+                calculations = [
+                    ComputeExecutor.submit(
+                        CitizensValidator.check_citizens_relatives, citizen_ids, citizens_relatives, size=size,
+                    ),
+                    ComputeExecutor.submit(
+                        CitizensBirthdays.calculate_presents_with_numpy,
+                        citizen_ids, citizens_relatives, citizens_birth_months,
+                        size=size,
+                    ),
+                    ComputeExecutor.submit(
+                        TownsAgeStats.calculate_towns_birth_dates, citizens_towns, citizens_birth_dates, size=size,
+                    ),
+                ]
+                relatives_checked, birthdays_presents, towns_birth_dates = calculations
+                if not relatives_checked.result():
+                    return None
+                while inserts:
+                    if not inserts.popleft().result():
+                        return None
+                new_import_id = self.database.publish_staging_import(
+                    staging_import, birthdays_presents.result(), towns_birth_dates.result(),
+                )
+                published = True
+                return new_import_id
+            finally:
+                for calculation in calculations:
+                    calculation.cancel()
+                if not published:
+                    for insert in inserts:
+                        insert.cancel()
+                    futures.wait(inserts)
+                    if staging_import is not None:
+                        self.database.drop_staging_import(staging_import)
 
     def patch_import_citizen(self, import_id: int, citizen_id: int, request_json: Any) -> Optional[PatchedCitizen]:
-        if import_id not in self.database.imports:
-            return None
-        if not self.database.check_if_citizen_in_import(import_id, citizen_id):
+        if not self.database.import_exists(import_id):
             return None
         if not request_json or not isinstance(request_json, dict):
             return None
         if 'citizen_id' in request_json:
             return None
-        citizen = self.database.get_citizen(import_id, citizen_id)
+        for _ in range(config.PATCH_RETRIES):
+            try:
+                return self.database.run_patch(
+                    lambda session: self._patch_import_citizen(import_id, citizen_id, request_json, session)
+                )
+            except database_framework.PatchConflict:
+                continue
+        return None
+
+    def _patch_import_citizen(
+            self,
+            import_id: int,
+            citizen_id: int,
+            request_json: Dict[str, Any],
+            session: Optional[client_session.ClientSession] = None,
+    ) -> Optional[PatchedCitizen]:
+        versioned_citizen = self.database.get_citizen_with_version(import_id, citizen_id, session)
+        if not versioned_citizen:
+            return None
+        citizen, version = versioned_citizen
         patched_citizen = copy.deepcopy(citizen)
         patched_citizen.update(request_json)
-        validation_result = CitizenValidator.validate_citizen(patched_citizen)
-        if not validation_result:
-            return None
-        patched_citizen, *a = validation_result
-        patched_citizen_relatives = patched_citizen['relatives']
-        if not all(
-                self.database.check_if_citizen_in_import(import_id, relative_id)
-                for relative_id in patched_citizen_relatives
-        ):
-            return None
-        if any(relative_id == citizen_id for relative_id in patched_citizen_relatives):
+        patched_citizen = CitizenValidator.validate_citizen(patched_citizen)
+        if not patched_citizen:
             return None
-        old_relatives = citizen['relatives']
+        old_relatives = set(citizen['relatives'])
         new_relatives = patched_citizen['relatives']
-        if old_relatives != new_relatives:
-            self.database.remove_citizen_from_old_relatives(import_id, citizen_id)
-            self.database.update_citizen(import_id, citizen_id, patched_citizen)
-            self.database.add_citizen_to_new_relatives(import_id, citizen_id)
-        else:
-            self.database.update_citizen(import_id, citizen_id, patched_citizen)
-        return self.database.get_citizen(import_id, citizen_id)
+        new_relatives_set = set(new_relatives)
+        if len(new_relatives_set) != len(new_relatives):
+            return None
+        added_relatives = [relative_id for relative_id in new_relatives if relative_id not in old_relatives]
+        removed_relatives = [relative_id for relative_id in old_relatives if relative_id not in new_relatives_set]
+        relatives_birth_months, relatives_versions = self.database.get_citizens_birth_months_with_versions(
+            import_id, added_relatives + removed_relatives, session,
+        )
+        if any(relative_id not in relatives_birth_months for relative_id in added_relatives):
+            return None
+        old_birth_date = datetime.datetime.strptime(citizen['birth_date'], database_framework.BirthDateFmt)
+        birthdays_presents_delta = CitizensBirthdays.calculate_presents_delta(
+            citizen_id,
+            old_birth_date.month,
+            patched_citizen['birth_date'].month,
+            old_relatives,
+            new_relatives,
+            relatives_birth_months,
+        )
+        old_town_birth_date = (citizen['town'], old_birth_date.toordinal())
+        new_town_birth_date = (patched_citizen['town'], patched_citizen['birth_date'].toordinal())
+        moved_town_birth_date = (
+            (old_town_birth_date, new_town_birth_date) if old_town_birth_date != new_town_birth_date else None
+        )
+        if not self.database.update_citizen_with_relatives(
+                import_id, citizen_id, version, patched_citizen, added_relatives, removed_relatives,
+                birthdays_presents_delta, moved_town_birth_date, relatives_versions, session,
+        ):
+            raise database_framework.PatchConflict(citizen_id)
+        patched_citizen['birth_date'] = patched_citizen['birth_date'].strftime(database_framework.BirthDateFmt)
+        return patched_citizen
 
-    def get_import_citizens(self, import_id: int) -> Optional[Citizens]:
-        if import_id not in self.database.imports:
+    def get_pool_metrics(self) -> database_client.PoolMetricsSnapshot:
+        return self.database.get_pool_metrics()
+
+    def get_import_version(self, import_id: int) -> Optional[database_framework.ImportVersion]:
+        if not self.database.import_exists(import_id):
             return None
-        return self.database.get_all_import_citizens(import_id)
+        return self.database.get_import_version(import_id)
+
+    def iter_import_citizens(
+            self,
+            import_id: int,
+            query: Optional[Dict[str, str]] = None,
+    ) -> Optional[Iterator[Citizen]]:
+        if not self.database.import_exists(import_id):
+            return None
+        citizens_query = self.validate_citizens_query(query)
+        if citizens_query is None:
+            return None
+        return self.database.iter_import_citizens(import_id, **citizens_query)
 
     def get_import_citizens_birthdays(self, import_id: int) -> Optional[ImportCitizensBirthdays]:
-        if import_id not in self.database.imports:
+        if not self.database.import_exists(import_id):
             return None
-        presents = {month: collections.defaultdict(int) for month in range(1, 13)}
-        birthdays = {str(month): [] for month in range(1, 13)}
-        citizens_with_relatives_dict = self.database.get_citizens_with_relatives_dict(import_id)
-        citizen_ids = list(citizens_with_relatives_dict.keys())
-        for citizen_id in citizen_ids:
-            citizen = citizens_with_relatives_dict.get(citizen_id)
-            if not citizen:
-                continue
-            citizen_relatives = citizen['relatives']
-            for related_citizen_id in citizen_relatives:
-                related_citizen = citizens_with_relatives_dict[related_citizen_id]
-                related_citizen_relatives = related_citizen['relatives']
-                presents[related_citizen['birth_date'].month][citizen_id] += 1
-                presents[citizen['birth_date'].month][related_citizen_id] += 1
-                related_citizen_relatives.remove(citizen_id)
-                if not related_citizen_relatives:
-                    citizens_with_relatives_dict.pop(related_citizen_id)
-        for month, citizen_presents in presents.items():
-            for citizen_id, presents in citizen_presents.items():
-                birthdays[str(month)].append({'citizen_id': citizen_id, 'presents': presents})
-            birthdays[str(month)] = sorted(birthdays[str(month)], key=lambda c: c['citizen_id'])
-        return birthdays
+        birthdays_presents = self.database.get_birthdays_presents(import_id)
+        if birthdays_presents is None:
+            import_columns = self.database.get_import_columns(import_id)
+            if import_columns is None:
+                birthdays_presents = CitizensBirthdays.calculate_import_presents(self.database, import_id)
+            else:
+                birthdays_presents = ComputeExecutor.submit(
+                    CitizensBirthdays.calculate_presents_from_columns, import_columns,
+                    size=len(import_columns.citizen_ids),
+                ).result()
+        return CitizensBirthdays.format_birthdays(birthdays_presents)
 
     def get_towns_percentile_age_stats(self, import_id: int) -> TownsPercentileAgeStats:
-        if import_id not in self.database.imports:
+        if not self.database.import_exists(import_id):
             return None
-        towns_percentile_age_stats = list()
-        percentiles = [50, 75, 99]
-        towns_citizen_ages_stats = self.database.get_towns_citizens_age_stats(import_id)
-        for town, ages in towns_citizen_ages_stats.items():
-            town_percentile_age_stats = {'town': town}
-            ages_array = numpy.array(ages)
-            for percentile in percentiles:
-                town_percentile_age_stats.update(
-                    {f'p{percentile}': round(numpy.percentile(ages_array, percentile, interpolation='linear'), 2)}
-                )
-            towns_percentile_age_stats.append(town_percentile_age_stats)
+        current_date = datetime.datetime.utcnow().date()
+        import_version = self.database.get_import_version(import_id)
+        cache_key = (import_id, current_date, import_version)
+        towns_percentile_age_stats = (
+            self.towns_age_stats_cache.get(cache_key) if import_version is not None else None
+        )
+        if towns_percentile_age_stats is None:
+            towns_birth_dates = self.database.get_towns_birth_dates(import_id)
+            import_columns = self.database.get_import_columns(import_id) if towns_birth_dates is None else None
+            if towns_birth_dates is not None:
+                towns_percentile_age_stats = ComputeExecutor.submit(
+                    TownsAgeStats.calculate_towns_birth_dates_percentile_age_stats, towns_birth_dates, current_date,
+                    size=sum(len(town_birth_dates) for _, town_birth_dates in towns_birth_dates),
+                ).result()
+            elif import_columns is not None:
+                towns_percentile_age_stats = ComputeExecutor.submit(
+                    TownsAgeStats.calculate_columns_percentile_age_stats, import_columns, current_date,
+                    size=len(import_columns.citizen_ids),
+                ).result()
+            else:
+                towns, birth_dates = self.database.get_towns_citizens_birth_dates(import_id)
+                towns_percentile_age_stats = ComputeExecutor.submit(
+                    TownsAgeStats.calculate_citizens_percentile_age_stats, towns, birth_dates, current_date,
+                    size=len(towns),
+                ).result()
+            if import_version is not None:
+                self.towns_age_stats_cache.put(cache_key, towns_percentile_age_stats)
         return towns_percentile_age_stats
+
+    @staticmethod
+    def validate_citizens_query(query: Optional[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+        validator = Validator(CITIZENS_QUERY_SCHEMA)
+        if not validator.validate(query or {}):
+            return None
+        return validator.document
@@ -0,0 +1,164 @@
+import asyncio
+import copy
+import threading
+from typing import AsyncIterator, Iterator, List
+
+import pytest
+from _pytest import monkeypatch
+
+from service import columnar_database_framework
+from service import config
+from tests import test_service
+
+testclient = pytest.importorskip('starlette.testclient')
+asgi_api = pytest.importorskip('service.asgi_api')
+
+
+@pytest.fixture(scope='module')
+def client() -> Iterator[testclient.TestClient]:
+    database = columnar_database_framework.get_storage_backend()()
+    with testclient.TestClient(asgi_api.app) as client:
+        yield client
+    test_service.drop_test_imports(database)
+    database.close()
+
+
+@pytest.fixture()
+def import_id(client: testclient.TestClient) -> int:
+    r = client.post('/imports', json=test_service.CORRECT_CITIZENS_DATA)
+    assert r.status_code == 201
+    return r.json()['data']['import_id']
+
+
+async def iter_chunks(chunks: List[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+def test_async_chunks_reader_reads_across_chunks():
+    async def read_all() -> List[bytes]:
+        loop = asyncio.get_event_loop()
+        reader = asgi_api.async_service_framework.AsyncChunksReader(iter_chunks([b'ab', b'', b'cde', b'f']), loop)
+        return [await loop.run_in_executor(None, reader.read, size) for size in (3, 1, 5, 1)]
+
+    assert asyncio.new_event_loop().run_until_complete(read_all()) == [b'abc', b'd', b'ef', b'']
+
+
+def test_waiting_imports_do_not_occupy_executor(monkeypatch: monkeypatch.MonkeyPatch):
+    service = asgi_api.service
+    imports_released = threading.Event()
+    monkeypatch.setattr(service.service, 'import_citizens', lambda request_json: imports_released.wait())
+
+    async def import_and_patch() -> bool:
+        imports = [
+            asyncio.ensure_future(service.import_citizens(b'{}'))
+            for _ in range(config.ASYNC_EXECUTOR_THREADS + config.MAX_IMPORTS_IN_FLIGHT)
+        ]
+        try:
+            return await asyncio.wait_for(service._run_in_executor(lambda: True), timeout=5)
+        finally:
+            imports_released.set()
+            await asyncio.gather(*imports)
+
+    assert asyncio.new_event_loop().run_until_complete(import_and_patch())
+
+
+def test_import_citizens(client: testclient.TestClient):
+    r = client.post('/imports', json=test_service.CORRECT_CITIZENS_DATA)
+    assert r.status_code == 201
+    import_id = r.json()['data']['import_id']
+    r = client.get(f'/imports/{import_id}/citizens')
+    assert r.status_code == 200
+    assert r.json() == {'data': test_service.CORRECT_CITIZENS_DATA['citizens']}
+
+
+def test_import_citizens_from_stream(client: testclient.TestClient, monkeypatch: monkeypatch.MonkeyPatch):
+    monkeypatch.setattr(config, 'IMPORT_STREAM_THRESHOLD', 0)
+    r = client.post('/imports', json=test_service.CORRECT_CITIZENS_DATA)
+    assert r.status_code == 201
+    import_id = r.json()['data']['import_id']
+    r = client.get(f'/imports/{import_id}/citizens')
+    assert r.status_code == 200
+    assert r.json() == {'data': test_service.CORRECT_CITIZENS_DATA['citizens']}
+
+
+@pytest.mark.parametrize('stream_threshold', [0, 10 ** 9])
+def test_import_incorrect_citizens(
+        client: testclient.TestClient,
+        monkeypatch: monkeypatch.MonkeyPatch,
+        stream_threshold: int,
+):
+    monkeypatch.setattr(config, 'IMPORT_STREAM_THRESHOLD', stream_threshold)
+    test_data = copy.deepcopy(test_service.CORRECT_CITIZENS_DATA)
+    test_data['citizens'][0]['relatives'] = []
+    r = client.post('/imports', json=test_data)
+    assert r.status_code == 400
+    r = client.post('/imports', data={'citizens': '[]'})
+    assert r.status_code == 400
+
+
+def test_patch_import_citizen(client: testclient.TestClient, import_id: int):
+    r = client.patch(f'/imports/{import_id}/citizens/3', json={'name': 'Иванова Мария Леонидовна', 'relatives': [1]})
+    assert r.status_code == 200
+    expected_citizen = copy.deepcopy(test_service.CORRECT_CITIZENS_DATA['citizens'][2])
+    expected_citizen['name'] = 'Иванова Мария Леонидовна'
+    expected_citizen['relatives'] = [1]
+    assert r.json() == {'data': expected_citizen}
+
+
+def test_patch_import_citizen_incorrect(client: testclient.TestClient, import_id: int):
+    r = client.patch(f'/imports/{import_id}/citizens/3', json={'citizen_id': 4})
+    assert r.status_code == 400
+    r = client.patch(f'/imports/{import_id}/citizens/4', json={'name': 'Иванов Иван'})
+    assert r.status_code == 400
+    r = client.patch(f'/imports/{import_id}/citizens/3', data={'name': 'Иванов Иван'})
+    assert r.status_code == 400
+
+
+def test_get_import_citizens_birthdays(client: testclient.TestClient, import_id: int):
+    r = client.get(f'/imports/{import_id}/citizens/birthdays')
+    assert r.status_code == 200
+    data = r.json()['data']
+    assert data['4'] == [{'citizen_id': 1, 'presents': 1}]
+    assert data['12'] == [{'citizen_id': 2, 'presents': 1}]
+    assert data['1'] == []
+
+
+def test_get_towns_percentile_age_stats(client: testclient.TestClient, import_id: int):
+    r = client.get(f'/imports/{import_id}/towns/stat/percentile/age')
+    assert r.status_code == 200
+    assert sorted(stats['town'] for stats in r.json()['data']) == ['Керчь', 'Москва']
+
+
+@pytest.mark.parametrize('path', ['citizens', 'citizens/birthdays', 'towns/stat/percentile/age'])
+def test_get_with_etag(client: testclient.TestClient, import_id: int, path: str):
+    r = client.get(f'/imports/{import_id}/{path}')
+    assert r.status_code == 200
+    etag = r.headers['ETag']
+    assert etag
+    r = client.get(f'/imports/{import_id}/{path}', headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.headers['ETag'] == etag
+    r = client.patch(f'/imports/{import_id}/citizens/3', json={'town': 'Москва'})
+    assert r.status_code == 200
+    r = client.get(f'/imports/{import_id}/{path}', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+
+
+@pytest.mark.parametrize('path', ['citizens', 'citizens/birthdays', 'towns/stat/percentile/age'])
+def test_get_nonexistent_import(client: testclient.TestClient, path: str):
+    r = client.get(f'/imports/{10 ** 9}/{path}')
+    assert r.status_code == 400
+
+
+def test_get_import_citizens_with_incorrect_query(client: testclient.TestClient, import_id: int):
+    r = client.get(f'/imports/{import_id}/citizens', params={'town': 'Москва', 'gender': 'unknown'})
+    assert r.status_code == 400
+
+
+def test_get_pool_metrics(client: testclient.TestClient):
+    r = client.get('/metrics/pool')
+    assert r.status_code == 200
+    assert set(r.json()['data']) == {'async', 'sync'}
+    assert all('pid' in pool_metrics for pool_metrics in r.json()['data'].values())
@@ -0,0 +1,182 @@
+import json
+import os
+from typing import Any, Dict, List
+
+import pytest
+from pymongo import read_preferences
+
+from service import config
+from service import database_client
+
+
+class RecordingMongoClient:
+    instances: List['RecordingMongoClient'] = []
+
+    def __init__(self, uri: str, **options: Any) -> None:
+        self.uri = uri
+        self.options = options
+        self.closed = False
+        self.databases_options: Dict[str, Dict[str, Any]] = {}
+        self.instances.append(self)
+
+    def get_database(self, name: str, **options: Any) -> str:
+        self.databases_options[name] = options
+        return name
+
+    def close(self) -> None:
+        self.closed = True
+
+
+@pytest.fixture
+def recording_client(monkeypatch: Any) -> None:
+    database_client.DataBaseClient.close()
+    RecordingMongoClient.instances = []
+    monkeypatch.setattr(database_client.pymongo, 'MongoClient', RecordingMongoClient)
+    yield
+    database_client.DataBaseClient.close()
+
+
+class TestDataBaseClient:
+    @pytest.mark.parametrize(
+        'settings, expected_options',
+        [
+            (
+                {},
+                {
+                    'maxPoolSize': 100,
+                    'minPoolSize': 0,
+                    'connectTimeoutMS': 20000,
+                    'serverSelectionTimeoutMS': 30000,
+                },
+            ),
+            (
+                {
+                    'MONGO_MAX_POOL_SIZE': 10,
+                    'MONGO_SOCKET_TIMEOUT_MS': 5000,
+                    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 1000,
+                    'MONGO_WRITE_CONCERN': 'majority',
+                },
+                {
+                    'maxPoolSize': 10,
+                    'minPoolSize': 0,
+                    'connectTimeoutMS': 20000,
+                    'serverSelectionTimeoutMS': 30000,
+                    'socketTimeoutMS': 5000,
+                    'waitQueueTimeoutMS': 1000,
+                    'w': 'majority',
+                },
+            ),
+            ({'MONGO_WRITE_CONCERN': '2'}, {'w': 2}),
+        ],
+    )
+    def test_get_client_options(
+            self,
+            monkeypatch: Any,
+            settings: Dict[str, Any],
+            expected_options: Dict[str, Any],
+    ) -> None:
+        for name, value in settings.items():
+            monkeypatch.setattr(config, name, value)
+
+        options = database_client.DataBaseClient.get_client_options()
+
+        assert {name: options.get(name) for name in expected_options} == expected_options
+
+    @pytest.mark.parametrize(
+        'mode, max_staleness, expected_document',
+        [
+            ('primary', 90, {'mode': 'primary'}),
+            ('secondaryPreferred', -1, {'mode': 'secondaryPreferred'}),
+            ('secondaryPreferred', 90, {'mode': 'secondaryPreferred', 'maxStalenessSeconds': 90}),
+            ('nearest', 120, {'mode': 'nearest', 'maxStalenessSeconds': 120}),
+        ],
+    )
+    def test_get_read_preference(
+            self,
+            monkeypatch: Any,
+            mode: str,
+            max_staleness: int,
+            expected_document: Dict[str, Any],
+    ) -> None:
+        monkeypatch.setattr(config, 'MONGO_GET_READ_PREFERENCE', mode)
+        monkeypatch.setattr(config, 'MONGO_MAX_STALENESS_SECONDS', max_staleness)
+
+        assert database_client.DataBaseClient.get_read_preference().document == expected_document
+
+    def test_database_reads_from_primary(self, monkeypatch: Any, recording_client: None) -> None:
+        monkeypatch.setattr(config, 'MONGO_GET_READ_PREFERENCE', 'secondaryPreferred')
+        client = database_client.DataBaseClient.get_client()
+
+        database_client.DataBaseClient.get_database()
+
+        assert 'readPreference' not in client.options
+        assert client.databases_options[config.MONGO_DATABASE]['read_preference'] == read_preferences.Primary()
+
+        database_client.DataBaseClient.get_read_database()
+
+        assert client.databases_options[config.MONGO_DATABASE]['read_preference'].mongos_mode == 'secondaryPreferred'
+
+    def test_get_unknown_read_preference(self, monkeypatch: Any) -> None:
+        monkeypatch.setattr(config, 'MONGO_GET_READ_PREFERENCE', 'secondaries')
+
+        with pytest.raises(ValueError):
+            database_client.DataBaseClient.get_read_preference()
+
+    def test_client_is_shared_per_process(self, monkeypatch: Any, recording_client: None) -> None:
+        client = database_client.DataBaseClient.get_client()
+
+        assert database_client.DataBaseClient.get_client() is client
+        assert database_client.DataBaseClient.get_database() == config.MONGO_DATABASE
+        assert client.databases_options[config.MONGO_DATABASE]['read_preference'] == read_preferences.Primary()
+        assert len(RecordingMongoClient.instances) == 1
+        assert client.uri == config.MONGO_URI
+        assert isinstance(client.options['event_listeners'][0], database_client.PoolMetrics)
+
+        pid = os.getpid()
+        monkeypatch.setattr(database_client.os, 'getpid', lambda: pid + 1)
+        forked_client = database_client.DataBaseClient.get_client()
+
+        assert forked_client is not client
+        assert not client.closed
+        assert database_client.DataBaseClient.get_client() is forked_client
+
+        database_client.DataBaseClient.close()
+
+        assert forked_client.closed
+
+    def test_pool_metrics(self, recording_client: None) -> None:
+        client = database_client.DataBaseClient.get_client()
+        pool_metrics = client.options['event_listeners'][0]
+        pool_metrics.pool_created(None)
+        for _ in range(3):
+            pool_metrics.connection_created(None)
+            pool_metrics.connection_checked_out(None)
+        pool_metrics.connection_checked_in(None)
+        pool_metrics.connection_closed(None)
+        pool_metrics.connection_check_out_failed(None)
+
+        assert database_client.DataBaseClient.get_pool_metrics() == {
+            'pools_created': 1,
+            'connections_created': 3,
+            'connections_closed': 1,
+            'checked_out': 3,
+            'checked_in': 1,
+            'check_out_failed': 1,
+            'connections_open': 2,
+            'connections_in_use': 2,
+            'pid': os.getpid(),
+        }
+
+
+class TestConfig:
+    def test_config_file(self, monkeypatch: Any, tmp_path: Any) -> None:
+        config_path = tmp_path / 'config.json'
+        config_path.write_text(json.dumps({'MONGO_MAX_POOL_SIZE': 10, 'PATCH_TRANSACTIONS': True}))
+        monkeypatch.setenv(f'{config.ENV_PREFIX}CONFIG', str(config_path))
+        monkeypatch.setenv(f'{config.ENV_PREFIX}MONGO_URI', 'mongodb://db:27017')
+        monkeypatch.setattr(config, '_CONFIG_FILE', config._load_config_file())
+
+        assert config._get_int('MONGO_MAX_POOL_SIZE', 100) == 10
+        assert config._get_bool('PATCH_TRANSACTIONS', False) is True
+        assert config._get_str('MONGO_URI', 'mongodb://localhost:27017') == 'mongodb://db:27017'
+        assert config._get_float('IMPORTS_SIGNAL_TTL', 0.5) == 0.5
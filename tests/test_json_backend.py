@@ -0,0 +1,49 @@
+import json
+import numpy
+from typing import Type
+
+import pytest
+
+from service import json_backend
+
+DATA = {
+    'data': [
+        {
+            'citizen_id': 1,
+            'town': 'Москва',
+            'building': '16к7/стр5',
+            'apartment': 7,
+            'relatives': [2, 3],
+            'birth_date': '26.12.1986',
+        },
+        {'town': 'Керчь', 'p50': numpy.float64(33.5), 'p75': 12.25, 'p99': None},
+        True,
+    ],
+}
+INSTALLED_BACKENDS = [backend for backend in json_backend.BACKENDS.values() if backend]
+
+
+@pytest.mark.parametrize('backend', INSTALLED_BACKENDS, ids=[backend.NAME for backend in INSTALLED_BACKENDS])
+class TestJSONBackend:
+    def test_dumps(self, backend: Type[json_backend.JSONBackend]) -> None:
+        assert json.loads(backend.dumps(DATA, sort_keys=True)) == json.loads(json.dumps(DATA, default=float))
+
+    def test_dumps_sorts_keys(self, backend: Type[json_backend.JSONBackend]) -> None:
+        assert backend.dumps({'b': 1, 'a': 2}, sort_keys=True) == '{"a":2,"b":1}'
+
+    def test_loads(self, backend: Type[json_backend.JSONBackend]) -> None:
+        data = json.dumps(DATA, default=float, ensure_ascii=False)
+
+        assert backend.loads(data) == json.loads(data)
+        assert backend.loads(data.encode('utf-8')) == json.loads(data)
+
+    def test_loads_invalid_json(self, backend: Type[json_backend.JSONBackend]) -> None:
+        with pytest.raises(ValueError):
+            backend.loads('{"citizens": [}')
+
+
+def test_get_backend() -> None:
+    assert json_backend.get_backend('json') is json_backend.JSONBackend
+    assert json_backend.get_backend('auto') is INSTALLED_BACKENDS[0]
+    with pytest.raises(ValueError):
+        json_backend.get_backend('simplejson')
@@ -0,0 +1,118 @@
+import io
+import json
+from typing import Any
+
+import pytest
+
+from service import json_stream
+
+CITIZENS_DATA = {
+    'citizens': [
+        {
+            'citizen_id': 1234567,
+            'town': 'Москва',
+            'street': 'Льва Толстого',
+            'building': '16к7стр5',
+            'apartment': 7,
+            'name': 'Иванов Иван Иванович',
+            'birth_date': '26.12.1986',
+            'gender': 'male',
+            'relatives': [2, 30],
+        },
+        1.5e10,
+        -42,
+        'строка с "кавычками"',
+        [],
+        {},
+        None,
+        True,
+    ]
+}
+
+
+def iter_citizens(data: bytes, read_chunk_size: int = json_stream.READ_CHUNK_SIZE) -> list:
+    return list(json_stream.iter_array_items(io.BytesIO(data), 'citizens', read_chunk_size))
+
+
+class TestIterArrayItems:
+    @pytest.mark.parametrize('read_chunk_size', [1, 2, 3, 7, 64, json_stream.READ_CHUNK_SIZE])
+    @pytest.mark.parametrize('indent', [None, 4], ids=['compact', 'indented'])
+    def test_items_are_equal_to_json_loads(self, read_chunk_size: int, indent: Any) -> None:
+        data = json.dumps(CITIZENS_DATA, ensure_ascii=False, indent=indent).encode('utf-8')
+
+        assert iter_citizens(data, read_chunk_size) == json.loads(data)['citizens']
+
+    @pytest.mark.parametrize('read_chunk_size', [1, 5])
+    def test_numbers_split_between_chunks(self, read_chunk_size: int) -> None:
+        assert iter_citizens(b'{"citizens":[12345,678.9e2,-1]}', read_chunk_size) == [12345, 67890.0, -1]
+
+    def test_empty_array(self) -> None:
+        assert iter_citizens(b' { "citizens" : [ ] } ') == []
+
+    @pytest.mark.parametrize(
+        'data',
+        [
+            b'',
+            b'[]',
+            b'{}',
+            b'1',
+            b'null',
+            b'{"citizens": {}}',
+            b'{"citizens": 1}',
+            b'{"citizens": null}',
+            b'{"external": []}',
+            b'{"citizens": [], "external": 1}',
+            b'{"citizens": [1, 2}',
+            b'{"citizens": [1 2]}',
+            b'{"citizens": [1,]}',
+            b'{"citizens": [{"citizen_id": 1]}',
+            b'{"citizens": [1]',
+            b'{"citizens": [1]} []',
+            b'{"citizens": ["\xff"]}',
+        ],
+        ids=[
+            'no data',
+            'list',
+            'empty object',
+            'number',
+            'null',
+            'object "citizens"',
+            'number "citizens"',
+            'null "citizens"',
+            'external key',
+            'external key after "citizens"',
+            'unclosed array',
+            'missing comma',
+            'trailing comma',
+            'broken item',
+            'unclosed object',
+            'extra data',
+            'invalid utf-8',
+        ],
+    )
+    def test_incorrect_data(self, data: bytes) -> None:
+        with pytest.raises(ValueError):
+            iter_citizens(data, read_chunk_size=4)
+
+    def test_incorrect_item_fails_without_reading_the_rest(self) -> None:
+        data = io.BytesIO(b'{"citizens": [{"citizen_id": x}, ' + b'1, ' * 1000000 + b'1]}')
+
+        with pytest.raises(ValueError):
+            list(json_stream.iter_array_items(data, 'citizens', read_chunk_size=64))
+
+        assert data.tell() <= 2 * 64
+
+    @pytest.mark.parametrize('read_chunk_size', [1, 64])
+    def test_long_item_is_read_in_growing_chunks(self, read_chunk_size: int) -> None:
+        data = json.dumps({'citizens': ['\u0436' * 100000, {'name': 'a' * 100000}]}).encode('utf-8')
+        reads = []
+
+        class CountingStream(io.BytesIO):
+            def read(self, size: int = -1) -> bytes:
+                reads.append(size)
+                return super().read(size)
+
+        assert list(json_stream.iter_array_items(CountingStream(data), 'citizens', read_chunk_size)) == json.loads(
+            data
+        )['citizens']
+        assert len(reads) < 100
@@ -1,15 +1,23 @@
 import collections
 import copy
 import datetime
+import io
+import json
 import numpy
-from typing import Any, Dict, Optional
+from concurrent import futures
+from typing import Any, Dict, List, Optional
 
 import pytest
 import requests
+from pymongo import errors
 from _pytest import config
 from _pytest import fixtures
 
+from service import columnar_database_framework
+from service import database_client
 from service import database_framework
+from service import json_backend
+from service import manage
 from service import service_framework
 
 CORRECT_CITIZENS_DATA = {
@@ -79,13 +87,43 @@ def calculate_citizen_age(current_date: datetime.date, citizen_birth_date: datet
     return current_date.year - citizen_birth_date.year - citizen_birth_date_passed
 
 
+def get_import_citizens(database: database_framework.DataBase, import_id: int) -> database_framework.Citizens:
+    return list(database.iter_import_citizens(import_id))
+
+
+def get_citizen(
+        database: database_framework.DataBase,
+        import_id: int,
+        citizen_id: int,
+) -> Optional[database_framework.Citizen]:
+    versioned_citizen = database.get_citizen_with_version(import_id, citizen_id)
+    if versioned_citizen is None:
+        return None
+    return versioned_citizen[0]
+
+
+def get_test_collections(database: database_framework.DataBase) -> List[str]:
+    return [
+        collection for collection in database.db.list_collection_names()
+        if collection.isdigit() or collection.startswith(database_framework.StagingImportPrefix)
+    ]
+
+
+def drop_test_imports(database: database_framework.DataBase) -> None:
+    columnar_database = columnar_database_framework.ColumnarDataBase()
+    for import_id in columnar_database.imports:
+        columnar_database.drop_import(import_id)
+    for collection in get_test_collections(database):
+        database.db.drop_collection(collection)
+    database.db[database_framework.CountersCollection].delete_one({'_id': database_framework.ImportIdCounter})
+
+
 @pytest.fixture()
 def database(request: fixtures.FixtureRequest) -> database_framework.DataBase:
-    database = database_framework.DataBase()
+    database = columnar_database_framework.get_storage_backend()()
 
     def database_teardown():
-        for collection in database.imports:
-            database.db.drop_collection(f'{collection}')
+        drop_test_imports(database)
         database.close()
     request.addfinalizer(database_teardown)
     return database
@@ -240,6 +278,8 @@ class TestImport:
             True,
             list(),
             dict(),
+            2 ** 63,
+            2 ** 64,
         ],
         ids=[
             'citizen with "citizen_id" negative',
@@ -248,6 +288,8 @@ class TestImport:
             'citizen with "citizen_id" boolean',
             'citizen with "citizen_id" list',
             'citizen with "citizen_id" dict',
+            'citizen with "citizen_id" out of 64-bit range',
+            'citizen with "citizen_id" out of unsigned 64-bit range',
         ]
     )
     def test_import_citizen_with_incorrect_id(
@@ -384,6 +426,8 @@ class TestImport:
             True,
             list(),
             dict(),
+            2 ** 63,
+            2 ** 64,
         ],
         ids=[
             'citizen with "apartment" negative',
@@ -392,6 +436,8 @@ class TestImport:
             'citizen with "apartment" boolean',
             'citizen with "apartment" list',
             'citizen with "apartment" dict',
+            'citizen with "apartment" out of 64-bit range',
+            'citizen with "apartment" out of unsigned 64-bit range',
         ]
     )
     def test_import_citizen_with_incorrect_apartment(
@@ -530,6 +576,7 @@ class TestImport:
             [None],
             [1],
             [2],
+            [2 ** 64],
         ],
         ids=[
             'citizen with "relatives" int',
@@ -544,6 +591,7 @@ class TestImport:
             'citizen with "relatives" list of nulls',
             'citizen with "relatives" to himself',
             'citizen with "relatives" to non-existing citizen',
+            'citizen with "relatives" out of unsigned 64-bit range',
         ]
     )
     def test_import_citizen_with_incorrect_relatives(
@@ -560,6 +608,25 @@ class TestImport:
         assert r.status_code == 400
         assert database.imports == []
 
+    @pytest.mark.parametrize(
+        'citizen_id',
+        [2 ** 63, 2 ** 64],
+        ids=['citizen_id out of 64-bit range', 'citizen_id out of unsigned 64-bit range'],
+    )
+    def test_import_citizen_with_too_large_id_is_rejected_on_both_paths(
+            self,
+            database: database_framework.DataBase,
+            citizen_id: int,
+    ) -> None:
+        data = copy.deepcopy(CORRECT_CITIZEN_DATA)
+        data['citizens'][0][service_framework.CitizenAttr.ID.value] = citizen_id
+        body = json.dumps(data).encode('utf-8')
+        service = service_framework.Service()
+
+        assert service.import_citizens(json_backend.BACKEND.loads(body)) is None
+        assert service.import_citizens_from_stream(io.BytesIO(body)) is None
+        assert database.imports == []
+
     def test_import_citizen_with_relative_to_citizen_who_not_in_relatives_with_him(
             self,
             service_address: str,
@@ -573,6 +640,32 @@ class TestImport:
         assert r.status_code == 400
         assert database.imports == []
 
+    def test_import_with_failed_validation_leaves_no_collections(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+    ) -> None:
+        data = generate_10000_citizens_with_1000_relations()
+        data['citizens'][-1]['relatives'] = [1]
+
+        r = requests.post(f'http://{service_address}/imports', json=data)
+
+        assert r.status_code == 400
+        assert get_test_collections(database) == []
+
+    def test_import_citizens_with_duplicated_id(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+    ) -> None:
+        data = copy.deepcopy(CORRECT_CITIZENS_DATA)
+        data['citizens'][2]['citizen_id'] = 1
+
+        r = requests.post(f'http://{service_address}/imports', json=data)
+
+        assert r.status_code == 400
+        assert database.imports == []
+
     @pytest.mark.parametrize(
         'citizens',
         [copy.deepcopy(CORRECT_CITIZEN_DATA), copy.deepcopy(CORRECT_CITIZENS_DATA)],
@@ -594,7 +687,7 @@ class TestImport:
 
         expected_data = sorted(citizens['citizens'], key=lambda citizen: citizen['citizen_id'])
 
-        assert database.get_all_import_citizens(1) == expected_data
+        assert get_import_citizens(database, 1) == expected_data
 
     def test_import_several_citizens(self, service_address: str, database: database_framework.DataBase, ) -> None:
         imports = list()
@@ -609,6 +702,26 @@ class TestImport:
             assert r.json() == expected_json
             assert database.imports == imports
 
+    def test_concurrent_imports_get_unique_ids(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+    ) -> None:
+        imports_count = 10
+
+        def post_import(_: int) -> requests.Response:
+            return requests.post(f'http://{service_address}/imports', json=CORRECT_CITIZENS_DATA)
+
+        with futures.ThreadPoolExecutor(imports_count) as executor:
+            responses = list(executor.map(post_import, range(imports_count)))
+
+        assert all(r.status_code == 201 for r in responses)
+
+        import_ids = sorted(r.json()['data']['import_id'] for r in responses)
+
+        assert import_ids == list(range(1, imports_count + 1))
+        assert database.imports == import_ids
+
     def test_import_request_time(self, service_address: str, database: database_framework.DataBase) -> None:
         request_time = datetime.datetime.utcnow()
         r = requests.post(f'http://{service_address}/imports', json=generate_10000_citizens_with_1000_relations())
@@ -619,6 +732,31 @@ class TestImport:
         assert eval_time <= 10.0
 
 
+class TestIndexes:
+    def test_import_has_citizen_id_index(self, service_address: str, database: database_framework.DataBase) -> None:
+        r = requests.post(f'http://{service_address}/imports', json=CORRECT_CITIZENS_DATA)
+
+        assert r.status_code == 201
+
+        indexes_status = database.get_import_indexes_status(1)
+
+        assert 'citizen_id' in indexes_status['indexes']
+        assert indexes_status['missing_indexes'] == []
+
+    def test_backfill_indexes(self, database: database_framework.DataBase) -> None:
+        citizens = prepare_citizens(copy.deepcopy(CORRECT_CITIZENS_DATA['citizens']))
+        database.db['1'].insert_many(citizens)
+
+        assert manage.indexes_status(database)[0]['missing_indexes'] == ['citizen_id']
+
+        backfill_result = manage.backfill_indexes(database)
+
+        assert backfill_result[0]['import_id'] == 1
+        assert backfill_result[0]['missing_indexes'] == []
+        assert backfill_result[0]['error'] is None
+        assert manage.indexes_status(database) == backfill_result
+
+
 class TestPatch:
     @pytest.mark.parametrize(
         'data',
@@ -660,7 +798,7 @@ class TestPatch:
             r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json=data)
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     def test_patch_citizen_id(self, service_address: str, database: database_framework.DataBase, ) -> None:
         citizens = copy.deepcopy(CORRECT_CITIZEN_DATA['citizens'])
@@ -669,7 +807,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'citizen_id': 2})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     @pytest.mark.parametrize(
         'attr',
@@ -697,7 +835,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={attr.value: None})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     def test_patch_external_attr(self, service_address: str, database: database_framework.DataBase, ) -> None:
         citizens = copy.deepcopy(CORRECT_CITIZEN_DATA['citizens'])
@@ -706,7 +844,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'external': 'external'})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     @pytest.mark.parametrize(
         'town',
@@ -738,7 +876,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'town': town})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     @pytest.mark.parametrize(
         'street',
@@ -775,7 +913,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'street': street})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     @pytest.mark.parametrize(
         'building',
@@ -812,7 +950,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'building': building})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     @pytest.mark.parametrize(
         'apartment',
@@ -840,7 +978,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'apartment': apartment})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     @pytest.mark.parametrize(
         'name',
@@ -870,7 +1008,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'name': name})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     @pytest.mark.parametrize(
         'birth_date',
@@ -907,7 +1045,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'birth_date': birth_date})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     @pytest.mark.parametrize(
         'gender',
@@ -942,7 +1080,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'gender': gender})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     @pytest.mark.parametrize(
         'relatives',
@@ -987,7 +1125,119 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'relatives': relatives})
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
+
+    def test_patch_duplicated_relatives(self, service_address: str, database: database_framework.DataBase) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+
+        r = requests.patch(f'http://{service_address}/imports/1/citizens/3', json={'relatives': [1, 1]})
+
+        assert r.status_code == 400
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
+
+    def test_patch_replaces_relatives(self, service_address: str, database: database_framework.DataBase) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+
+        r = requests.patch(f'http://{service_address}/imports/1/citizens/1', json={'relatives': [3]})
+
+        assert r.status_code == 200
+        assert r.json()['data']['relatives'] == [3]
+
+        expected_citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        expected_citizens[0]['relatives'] = [3]
+        expected_citizens[1]['relatives'] = []
+        expected_citizens[2]['relatives'] = [1]
+
+        assert get_import_citizens(database, 1) == sorted(expected_citizens, key=lambda c: c['citizen_id'])
+
+    def test_concurrent_patches_keep_relatives_symmetric(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+    ) -> None:
+        citizens_count = 10
+        patches_count = 40
+        citizens = []
+        for citizen_id in range(1, citizens_count + 1):
+            citizen = copy.deepcopy(CORRECT_CITIZEN_DATA['citizens'][0])
+            citizen['citizen_id'] = citizen_id
+            citizens.append(citizen)
+        database.insert_citizens_to_new_import(prepare_citizens(citizens))
+
+        def patch_citizen(i: int) -> requests.Response:
+            citizen_id = i % citizens_count + 1
+            relatives = [(citizen_id + step - 1) % citizens_count + 1 for step in range(1, i % 4 + 1)]
+            return requests.patch(
+                f'http://{service_address}/imports/1/citizens/{citizen_id}',
+                json={'relatives': relatives},
+            )
+
+        with futures.ThreadPoolExecutor(8) as executor:
+            responses = list(executor.map(patch_citizen, range(patches_count)))
+
+        assert all(r.status_code == 200 for r in responses)
+
+        import_citizens = get_import_citizens(database, 1)
+
+        assert service_framework.CitizensValidator.check_citizens_relatives(
+            [citizen['citizen_id'] for citizen in import_citizens],
+            [citizen['relatives'] for citizen in import_citizens],
+        )
+
+    def test_patch_with_stale_version_is_rejected(self, database: database_framework.DataBase) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+        citizen, version = database.get_citizen_with_version(1, 3)
+
+        assert database.update_citizen_with_relatives(1, 3, version, {'street': 'Пушкина'}, [], [])
+        assert not database.update_citizen_with_relatives(1, 3, version, {'street': 'Ленина'}, [], [])
+        assert get_citizen(database, 1, 3)['street'] == 'Пушкина'
+
+    def test_patch_with_stale_relative_keeps_birthdays_consistent(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+    ) -> None:
+        r = requests.post(f'http://{service_address}/imports', json=CORRECT_CITIZENS_DATA)
+
+        assert r.status_code == 201
+
+        citizen, version = database.get_citizen_with_version(1, 3)
+        relatives_birth_months, relatives_versions = database.get_citizens_birth_months_with_versions(1, [2])
+        r = requests.patch(f'http://{service_address}/imports/1/citizens/2', json={'birth_date': '01.05.1997'})
+
+        assert r.status_code == 200
+
+        patched_citizen = prepare_citizens([dict(citizen, relatives=[2])])[0]
+        birthdays_presents_delta = service_framework.CitizensBirthdays.calculate_presents_delta(
+            3, 11, 11, [], [2], relatives_birth_months,
+        )
+
+        with pytest.raises(database_framework.PatchConflict):
+            database.update_citizen_with_relatives(
+                1, 3, version, patched_citizen, [2], [], birthdays_presents_delta, None, relatives_versions,
+            )
+
+        assert get_citizen(database, 1, 2)['relatives'] == [1]
+        assert database.get_citizen_with_version(1, 3) == (citizen, version)
+        assert database.get_birthdays_presents(1) is not None
+
+        r = requests.patch(f'http://{service_address}/imports/1/citizens/3', json={'relatives': [2]})
+
+        assert r.status_code == 200
+        assert sorted(get_citizen(database, 1, 2)['relatives']) == [1, 3]
+
+        r = requests.get(f'http://{service_address}/imports/1/citizens/birthdays')
+        expected_birthdays = service_framework.CitizensBirthdays.format_birthdays(
+            service_framework.CitizensBirthdays.calculate_import_presents(database, 1, 'python')
+        )
+
+        assert database.get_birthdays_presents(1) is not None
+        assert r.json() == {'data': expected_birthdays}
+        assert expected_birthdays['4'] == []
+        assert expected_birthdays['5'] == [{'citizen_id': 1, 'presents': 1}, {'citizen_id': 3, 'presents': 1}]
 
     def test_patch_non_existing_citizen(self, service_address: str, database: database_framework.DataBase) -> None:
         citizens = copy.deepcopy(CORRECT_CITIZEN_DATA['citizens'])
@@ -999,7 +1249,7 @@ class TestPatch:
         r = requests.patch(f'http://{service_address}/imports/1/citizens/2', json=data)
 
         assert r.status_code == 400
-        assert sorted(citizens, key=lambda c: c['citizen_id']) == database.get_all_import_citizens(1)
+        assert sorted(citizens, key=lambda c: c['citizen_id']) == get_import_citizens(database, 1)
 
     def test_correct_citizens_patch(self, service_address: str, database: database_framework.DataBase) -> None:
         citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
@@ -1037,7 +1287,7 @@ class TestPatch:
         expected_citizens[2].update(expected_json['data'])
         expected_citizens[0]['relatives'].append(3)
 
-        assert database.get_all_import_citizens(1) == sorted(expected_citizens, key=lambda c: c['citizen_id'])
+        assert get_import_citizens(database, 1) == sorted(expected_citizens, key=lambda c: c['citizen_id'])
 
         data = {'relatives': []}
         r = requests.patch(f'http://{service_address}/imports/1/citizens/3', json=data)
@@ -1063,7 +1313,7 @@ class TestPatch:
         expected_citizens[2].update(expected_json['data'])
         expected_citizens[0]['relatives'].remove(3)
 
-        assert database.get_all_import_citizens(1) == sorted(expected_citizens, key=lambda c: c['citizen_id'])
+        assert get_import_citizens(database, 1) == sorted(expected_citizens, key=lambda c: c['citizen_id'])
 
     def test_patch_citizen_request_time(self, service_address: str, database: database_framework.DataBase) -> None:
         citizens = copy.deepcopy(generate_10000_citizens_with_1000_relations()['citizens'])
@@ -1105,6 +1355,115 @@ class TestGetCitizens:
 
         assert r.json() == expected_json
 
+    def test_get_dropped_import_citizens(self, service_address: str, database: database_framework.DataBase) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+
+        r = requests.get(f'http://{service_address}/imports/1/citizens')
+
+        assert r.status_code == 200
+
+        database.drop_import(1)
+        r = requests.get(f'http://{service_address}/imports/1/citizens')
+
+        assert r.status_code == 400
+
+    def test_dropped_import_is_forgotten_by_other_workers(self, database: database_framework.DataBase) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        import_id = database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+        other_database = columnar_database_framework.get_storage_backend()()
+
+        assert other_database.import_exists(import_id)
+
+        database.drop_import(import_id)
+
+        assert not other_database.import_exists(import_id)
+
+    def test_get_citizens_is_streamed_in_citizen_id_order(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+    ) -> None:
+        citizens = copy.deepcopy(generate_10000_citizens_with_1000_relations()['citizens'][:2500])
+        citizens.reverse()
+        r = requests.post(f'http://{service_address}/imports', json={'citizens': citizens})
+
+        assert r.status_code == 201
+
+        r = requests.get(f'http://{service_address}/imports/1/citizens', stream=True)
+
+        assert r.status_code == 200
+        assert 'Content-Length' not in r.headers
+        assert r.headers['Content-Type'] == 'application/json'
+        assert r.json() == {'data': sorted(citizens, key=lambda c: c['citizen_id'])}
+
+    def test_get_citizens_pages(self, service_address: str, database: database_framework.DataBase) -> None:
+        citizens = copy.deepcopy(generate_10000_citizens_with_1000_relations()['citizens'][:250])
+        database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+
+        pages = []
+        params = {'limit': 100}
+        while True:
+            r = requests.get(f'http://{service_address}/imports/1/citizens', params=params)
+
+            assert r.status_code == 200
+
+            page = r.json()['data']
+            if not page:
+                break
+            pages.append(page)
+            params['after_citizen_id'] = page[-1]['citizen_id']
+
+        assert [len(page) for page in pages] == [100, 100, 50]
+        assert [citizen for page in pages for citizen in page] == citizens
+
+    def test_get_citizens_fields(self, service_address: str, database: database_framework.DataBase) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+
+        r = requests.get(f'http://{service_address}/imports/1/citizens', params={'fields': 'name,birth_date'})
+
+        assert r.status_code == 200
+        assert r.json() == {
+            'data': [
+                {'citizen_id': c['citizen_id'], 'name': c['name'], 'birth_date': c['birth_date']} for c in citizens
+            ]
+        }
+
+        r = requests.get(
+            f'http://{service_address}/imports/1/citizens',
+            params={'fields': 'relatives', 'after_citizen_id': 1, 'limit': 1},
+        )
+
+        assert r.status_code == 200
+        assert r.json() == {'data': [{'citizen_id': 2, 'relatives': citizens[1]['relatives']}]}
+        assert r.headers['ETag'] != requests.get(f'http://{service_address}/imports/1/citizens').headers['ETag']
+
+    @pytest.mark.parametrize('params', [
+        {'limit': 0},
+        {'limit': -1},
+        {'limit': 'a'},
+        {'limit': '1.5'},
+        {'after_citizen_id': -1},
+        {'after_citizen_id': ''},
+        {'fields': ''},
+        {'fields': 'name,age'},
+        {'fields': '_id'},
+        {'offset': 10},
+    ])
+    def test_get_citizens_incorrect_query(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+            params: Dict[str, Any],
+    ) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+
+        r = requests.get(f'http://{service_address}/imports/1/citizens', params=params)
+
+        assert r.status_code == 400
+
     def test_get_citizens_request_time(self, service_address: str, database: database_framework.DataBase) -> None:
         citizens = copy.deepcopy(generate_10000_citizens_with_1000_relations()['citizens'])
         database.insert_citizens_to_new_import(prepare_citizens(citizens))
@@ -1149,6 +1508,96 @@ class TestGetBirthdays:
 
         assert r.json() == expected_json
 
+    def test_get_birthdays_after_patches(self, service_address: str, database: database_framework.DataBase) -> None:
+        r = requests.post(f'http://{service_address}/imports', json=CORRECT_CITIZENS_DATA)
+
+        assert r.status_code == 201
+
+        patches = [
+            (3, {'relatives': [1, 2]}),
+            (1, {'birth_date': '15.07.1990'}),
+            (2, {'relatives': [], 'birth_date': '03.03.2003'}),
+            (3, {'birth_date': '01.01.2000', 'relatives': [3, 1]}),
+            (3, {'relatives': [1]}),
+        ]
+        for citizen_id, data in patches:
+            r = requests.patch(f'http://{service_address}/imports/1/citizens/{citizen_id}', json=data)
+            assert r.status_code == (400 if citizen_id in data.get('relatives', []) else 200)
+
+        r = requests.get(f'http://{service_address}/imports/1/citizens/birthdays')
+
+        assert r.status_code == 200
+        assert database.get_birthdays_presents(1) is not None
+
+        expected_birthdays = service_framework.CitizensBirthdays.format_birthdays(
+            service_framework.CitizensBirthdays.calculate_import_presents(database, 1, 'python')
+        )
+
+        assert r.json() == {'data': expected_birthdays}
+        assert expected_birthdays['11'] == [{'citizen_id': 1, 'presents': 1}]
+        assert expected_birthdays['7'] == [{'citizen_id': 3, 'presents': 1}]
+
+    @pytest.mark.parametrize('engine', ['python', 'aggregation', 'numpy'])
+    def test_get_birthdays_with_engine(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+            engine: str,
+    ) -> None:
+        citizens = copy.deepcopy(generate_10000_citizens_with_1000_relations()['citizens'][:100])
+        for i, citizen in enumerate(citizens):
+            citizen['birth_date'] = f'{i % 28 + 1:02}.{i % 12 + 1:02}.1990'
+        citizens[0]['relatives'].extend([4, 6])
+        citizens[3]['relatives'].append(1)
+        citizens[5]['relatives'].append(1)
+        expected_birthdays_presents = service_framework.CitizensBirthdays.calculate_presents(
+            [citizen['citizen_id'] for citizen in citizens],
+            [citizen['relatives'] for citizen in citizens],
+            [int(citizen['birth_date'][3:5]) for citizen in citizens],
+        )
+        database.insert_citizens_to_new_import(prepare_citizens(citizens))
+
+        birthdays_presents = service_framework.CitizensBirthdays.calculate_import_presents(database, 1, engine)
+
+        assert birthdays_presents == expected_birthdays_presents
+        assert birthdays_presents[1][6] == 1
+
+    def test_backfill_birthdays(self, service_address: str, database: database_framework.DataBase) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        database.insert_citizens_to_new_import(prepare_citizens(citizens))
+
+        assert database.get_birthdays_presents(1) is None
+        assert manage.backfill_birthdays(database) == [{'import_id': 1, 'backfilled': True}]
+        assert database.get_birthdays_presents(1) == {4: {1: 1}, 12: {2: 1}}
+        assert manage.backfill_birthdays(database) == [{'import_id': 1, 'backfilled': False}]
+
+    def test_birthdays_presents_are_stored_by_month(self, database: database_framework.DataBase) -> None:
+        document_database = database_framework.DataBase()
+        staging_import = document_database.create_staging_import()
+        document_database.insert_citizens_to_staging_import(
+            staging_import, prepare_citizens(copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])),
+        )
+        import_id = document_database.publish_staging_import(staging_import, {4: {1: 1}, 12: {2: 1}})
+        birthdays = document_database.db[database_framework.BirthdaysCollection].find({'import_id': import_id})
+
+        assert sorted(month_presents['month'] for month_presents in birthdays) == list(database_framework.BirthMonths)
+        assert document_database.get_birthdays_presents(import_id) == {4: {1: 1}, 12: {2: 1}}
+
+        document_database.db[database_framework.BirthdaysCollection].delete_one({'import_id': import_id, 'month': 5})
+
+        assert document_database.get_birthdays_presents(import_id) is None
+
+    def test_failed_publish_leaves_no_aggregates(self, database: database_framework.DataBase) -> None:
+        document_database = database_framework.DataBase()
+        staging_import = document_database.create_staging_import()
+        document_database.drop_staging_import(staging_import)
+
+        with pytest.raises(errors.OperationFailure):
+            document_database.publish_staging_import(staging_import, {4: {1: 1}}, [('Москва', {725000: 1})])
+
+        assert document_database.db[database_framework.BirthdaysCollection].count_documents({}) == 0
+        assert document_database.db[database_framework.TownsBirthDatesCollection].count_documents({}) == 0
+
     def test_get_birthdays_request_time(self, service_address: str, database: database_framework.DataBase) -> None:
         citizens = copy.deepcopy(generate_10000_citizens_with_1000_relations()['citizens'])
         database.insert_citizens_to_new_import(prepare_citizens(citizens))
@@ -1201,6 +1650,67 @@ class TestGetTownsPercentileAgeStats:
 
         assert r.json() == expected_json
 
+    def test_get_towns_percentile_age_stats_after_patch(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+    ) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        database.insert_citizens_to_new_import(prepare_citizens(citizens))
+
+        r = requests.get(f'http://{service_address}/imports/1/towns/stat/percentile/age')
+
+        assert r.status_code == 200
+        assert [town_stats['town'] for town_stats in r.json()['data']] == ['Москва', 'Керчь']
+        assert database.get_import_version(1)[1] == 0
+
+        r = requests.patch(f'http://{service_address}/imports/1/citizens/3', json={'town': 'Москва'})
+
+        assert r.status_code == 200
+        assert database.get_import_version(1)[1] == 1
+
+        r = requests.get(f'http://{service_address}/imports/1/towns/stat/percentile/age')
+
+        assert r.status_code == 200
+        assert [town_stats['town'] for town_stats in r.json()['data']] == ['Москва']
+
+    def test_get_towns_percentile_age_stats_from_towns_birth_dates(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+    ) -> None:
+        r = requests.post(f'http://{service_address}/imports', json=CORRECT_CITIZENS_DATA)
+
+        assert r.status_code == 201
+        assert database.get_towns_birth_dates(1) is not None
+
+        for citizen_id, data in [(1, {'birth_date': '29.02.2000'}), (3, {'town': 'Москва'}), (2, {'town': 'Керчь'})]:
+            r = requests.patch(f'http://{service_address}/imports/1/citizens/{citizen_id}', json=data)
+            assert r.status_code == 200
+
+        r = requests.get(f'http://{service_address}/imports/1/towns/stat/percentile/age')
+
+        assert r.status_code == 200
+
+        towns, birth_dates = database.get_towns_citizens_birth_dates(1)
+        expected_towns_percentile_age_stats = service_framework.TownsAgeStats.calculate_percentile_age_stats(
+            towns, service_framework.TownsAgeStats.calculate_ages(birth_dates, datetime.datetime.utcnow().date()),
+        )
+
+        assert r.json() == {'data': expected_towns_percentile_age_stats}
+
+    def test_backfill_towns_birth_dates(self, database: database_framework.DataBase) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        database.insert_citizens_to_new_import(prepare_citizens(citizens))
+
+        assert database.get_towns_birth_dates(1) is None
+        assert manage.backfill_towns_birth_dates(database) == [{'import_id': 1, 'backfilled': True}]
+        assert database.get_towns_birth_dates(1) == [
+            ('Москва', {datetime.date(1986, 12, 26).toordinal(): 1, datetime.date(1997, 4, 1).toordinal(): 1}),
+            ('Керчь', {datetime.date(1986, 11, 23).toordinal(): 1}),
+        ]
+        assert manage.backfill_towns_birth_dates(database) == [{'import_id': 1, 'backfilled': False}]
+
     def test_get_towns_percentile_age_stats_request_time(
             self,
             service_address: str,
@@ -1216,3 +1726,255 @@ class TestGetTownsPercentileAgeStats:
 
         assert r.status_code == 200
         assert eval_time <= 10.0
+
+
+class TestResponseCache:
+    @pytest.mark.parametrize(
+        'path',
+        ['citizens', 'citizens/birthdays', 'towns/stat/percentile/age'],
+        ids=['citizens', 'birthdays', 'percentile'],
+    )
+    def test_get_with_if_none_match(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+            path: str,
+    ) -> None:
+        r = requests.post(f'http://{service_address}/imports', json=CORRECT_CITIZENS_DATA)
+
+        assert r.status_code == 201
+
+        r = requests.get(f'http://{service_address}/imports/1/{path}')
+
+        assert r.status_code == 200
+        assert r.headers['ETag']
+
+        etag = r.headers['ETag']
+        body = r.content
+        r = requests.get(f'http://{service_address}/imports/1/{path}', headers={'If-None-Match': etag})
+
+        assert r.status_code == 304
+        assert r.headers['ETag'] == etag
+        assert r.content == b''
+
+        r = requests.get(f'http://{service_address}/imports/1/{path}')
+
+        assert r.status_code == 200
+        assert r.headers['ETag'] == etag
+        assert r.content == body
+
+        r = requests.patch(
+            f'http://{service_address}/imports/1/citizens/3',
+            json={'town': 'Москва', 'birth_date': '01.04.2000', 'relatives': [1]},
+        )
+
+        assert r.status_code == 200
+
+        r = requests.get(f'http://{service_address}/imports/1/{path}', headers={'If-None-Match': etag})
+
+        assert r.status_code == 200
+        assert r.headers['ETag'] != etag
+        assert r.content != body
+
+    def test_get_dropped_import_with_if_none_match(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+    ) -> None:
+        r = requests.post(f'http://{service_address}/imports', json=CORRECT_CITIZENS_DATA)
+
+        assert r.status_code == 201
+
+        r = requests.get(f'http://{service_address}/imports/1/citizens')
+        database.drop_import(1)
+        r = requests.get(f'http://{service_address}/imports/1/citizens', headers={'If-None-Match': r.headers['ETag']})
+
+        assert r.status_code == 400
+
+    @pytest.mark.parametrize(
+        'path',
+        ['citizens', 'citizens/birthdays', 'towns/stat/percentile/age'],
+        ids=['citizens', 'birthdays', 'percentile'],
+    )
+    def test_get_import_without_version(
+            self,
+            service_address: str,
+            database: database_framework.DataBase,
+            path: str,
+    ) -> None:
+        r = requests.post(f'http://{service_address}/imports', json=CORRECT_CITIZENS_DATA)
+
+        assert r.status_code == 201
+        assert database.get_import_version(1) == (database.get_import_version(1)[0], 0)
+
+        database.db[database_framework.ImportVersionsCollection].delete_one({'_id': 1})
+        r = requests.get(f'http://{service_address}/imports/1/{path}')
+
+        assert r.status_code == 200
+        assert 'ETag' not in r.headers
+        assert database.get_import_version(1) is None
+        assert manage.backfill_import_versions(database) == [{'import_id': 1, 'backfilled': True}]
+        assert manage.backfill_import_versions(database) == [{'import_id': 1, 'backfilled': False}]
+
+        body = r.content
+        r = requests.get(f'http://{service_address}/imports/1/{path}')
+
+        assert r.status_code == 200
+        assert r.headers['ETag']
+        assert r.content == body
+
+
+class TestReadRouting:
+    def test_get_reads_are_routed_to_read_database(
+            self,
+            monkeypatch: Any,
+            database: database_framework.DataBase,
+    ) -> None:
+        citizens = copy.deepcopy(CORRECT_CITIZENS_DATA['citizens'])
+        service = service_framework.Service()
+        import_id = service.import_citizens({'citizens': copy.deepcopy(citizens)})
+        replica = database.client[f'{database.db.name}_replica']
+        monkeypatch.setattr(database_client.DataBaseClient, 'get_read_database', classmethod(lambda cls: replica))
+        try:
+            assert list(database.iter_import_citizens(import_id)) == []
+            assert database.get_birthdays_presents(import_id) is None
+            assert database.get_towns_birth_dates(import_id) is None
+
+            citizens[0]['name'] = 'Иванов Петр Иванович'
+            patched_citizen = service.patch_import_citizen(import_id, 1, {'name': citizens[0]['name']})
+
+            assert patched_citizen == citizens[0]
+            assert [get_citizen(database, import_id, citizen['citizen_id']) for citizen in citizens] == citizens
+
+            for collection in database.db.list_collection_names():
+                documents = list(database.db[collection].find())
+                if documents:
+                    replica[collection].insert_many(documents)
+
+            assert list(service.iter_import_citizens(import_id)) == citizens
+            assert database.get_birthdays_presents(import_id) is not None
+        finally:
+            database.client.drop_database(replica.name)
+
+    def test_reads_from_lagging_secondary_are_not_cached(
+            self,
+            monkeypatch: Any,
+            database: database_framework.DataBase,
+    ) -> None:
+        service = service_framework.Service()
+        import_id = service.import_citizens(copy.deepcopy(CORRECT_CITIZENS_DATA))
+        replica = database.client[f'{database.db.name}_replica']
+
+        def replicate() -> None:
+            for collection in database.db.list_collection_names():
+                replica.drop_collection(collection)
+                documents = list(database.db[collection].find())
+                if documents:
+                    replica[collection].insert_many(documents)
+
+        monkeypatch.setattr(database_client.DataBaseClient, 'get_read_database', classmethod(lambda cls: replica))
+        monkeypatch.setattr(database_client.config, 'MONGO_GET_READ_PREFERENCE', 'secondaryPreferred')
+        try:
+            replicate()
+            towns_percentile_age_stats = service.get_towns_percentile_age_stats(import_id)
+
+            assert service.patch_import_citizen(import_id, 3, {'town': 'Москва'})
+            assert database.get_import_version(import_id) is None
+            assert service.get_import_version(import_id) is None
+            assert service.get_towns_percentile_age_stats(import_id) == towns_percentile_age_stats
+
+            replicate()
+
+            assert service.get_towns_percentile_age_stats(import_id) != towns_percentile_age_stats
+            assert [town_stats['town'] for town_stats in service.get_towns_percentile_age_stats(import_id)] == [
+                'Москва',
+            ]
+        finally:
+            database.client.drop_database(replica.name)
+
+
+def generate_columnar_citizens() -> service_framework.Citizens:
+    citizens = generate_10000_citizens_with_1000_relations()['citizens'][:10]
+    for i, citizen in enumerate(citizens):
+        citizen['town'] = ['Москва', 'Керчь', 'Абакан'][i % 3]
+        citizen['birth_date'] = f'{i + 10}.{i % 12 + 1:02}.{1950 + 7 * i}'
+    return citizens
+
+
+class TestColumnarStorage:
+    def test_columnar_import(self, monkeypatch: Any, database: database_framework.DataBase) -> None:
+        monkeypatch.setattr(columnar_database_framework.config, 'COLUMNAR_CHUNK_SIZE', 3)
+        columnar_database = columnar_database_framework.ColumnarDataBase()
+        citizens = generate_columnar_citizens()
+        import_id = columnar_database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+        chunks = database.db[columnar_database_framework.ColumnarChunksCollection]
+
+        assert columnar_database.is_columnar_import(import_id)
+        assert columnar_database.imports == [import_id]
+        assert chunks.count_documents({'import_id': import_id}) == 4
+        assert get_import_citizens(columnar_database, import_id) == citizens
+        assert list(
+            columnar_database.iter_import_citizens(import_id, limit=4, after_citizen_id=2, fields=['town', 'relatives'])
+        ) == [
+            {'citizen_id': citizen['citizen_id'], 'town': citizen['town'], 'relatives': citizen['relatives']}
+            for citizen in citizens[2:6]
+        ]
+
+        import_columns = columnar_database.get_import_columns(import_id)
+
+        assert import_columns.citizen_ids.tolist() == [citizen['citizen_id'] for citizen in citizens]
+        assert [import_columns.towns_dictionary[town] for town in import_columns.towns.tolist()] == [
+            citizen['town'] for citizen in citizens
+        ]
+        assert import_columns.relatives_offsets.tolist() == [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+
+        columnar_database.drop_import(import_id)
+
+        assert not columnar_database.import_exists(import_id)
+        assert chunks.count_documents({'import_id': import_id}) == 0
+
+    def test_columnar_patch(self, monkeypatch: Any, database: database_framework.DataBase) -> None:
+        monkeypatch.setattr(columnar_database_framework.config, 'COLUMNAR_CHUNK_SIZE', 3)
+        columnar_database = columnar_database_framework.ColumnarDataBase()
+        citizens = generate_columnar_citizens()
+        import_id = columnar_database.insert_citizens_to_new_import(prepare_citizens(copy.deepcopy(citizens)))
+        citizen, version = columnar_database.get_citizen_with_version(import_id, 3)
+        patched_citizen = prepare_citizens([dict(citizen, town='Якутск', relatives=[1])])[0]
+
+        assert citizen == citizens[2]
+        assert columnar_database.update_citizen_with_relatives(import_id, 3, version, patched_citizen, [1], [4])
+        assert not columnar_database.update_citizen_with_relatives(import_id, 3, version, {'street': 'Ленина'}, [], [])
+
+        citizens[0]['relatives'] = [2, 3]
+        citizens[2].update(town='Якутск', relatives=[1])
+        citizens[3]['relatives'] = []
+
+        assert get_import_citizens(columnar_database, import_id) == citizens
+        assert columnar_database.get_import_version(import_id)[1] == 1
+        assert columnar_database.get_import_columns(import_id).towns_dictionary == [
+            'Москва', 'Керчь', 'Абакан', 'Якутск',
+        ]
+
+    def test_columnar_computations_are_equal_to_documents(
+            self,
+            monkeypatch: Any,
+            database: database_framework.DataBase,
+    ) -> None:
+        citizens = generate_columnar_citizens()
+        monkeypatch.setattr(service_framework.config, 'STORAGE_BACKEND', 'documents')
+        documents_import_id = service_framework.Service().import_citizens({'citizens': copy.deepcopy(citizens)})
+        monkeypatch.setattr(service_framework.config, 'STORAGE_BACKEND', 'columnar')
+        service = service_framework.Service()
+        columnar_import_id = service.import_citizens({'citizens': copy.deepcopy(citizens)})
+
+        assert service.database.is_columnar_import(columnar_import_id)
+        assert not service.database.is_columnar_import(documents_import_id)
+        assert service.get_import_citizens_birthdays(columnar_import_id) == service.get_import_citizens_birthdays(
+            documents_import_id
+        )
+        assert service.get_towns_percentile_age_stats(columnar_import_id) == service.get_towns_percentile_age_stats(
+            documents_import_id
+        )
+        assert list(service.iter_import_citizens(columnar_import_id)) == list(
+            service.iter_import_citizens(documents_import_id)
+        )
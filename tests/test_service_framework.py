@@ -0,0 +1,461 @@
+import collections
+import copy
+import datetime
+import json
+import numpy
+import random
+import threading
+import time
+from concurrent import futures
+from typing import Any, Dict, List
+
+import pytest
+
+from service import database_framework
+from service import service_framework
+
+CORRECT_CITIZEN = {
+    'citizen_id': 1,
+    'town': 'Москва',
+    'street': 'Льва Толстого',
+    'building': '16к7стр5',
+    'apartment': 7,
+    'name': 'Иванов Иван Иванович',
+    'birth_date': '26.12.1986',
+    'gender': 'male',
+    'relatives': [2],
+}
+FUZZ_ITERATIONS = 2000
+FUZZ_SEED = 20190830
+FUZZ_STRINGS = [
+    '', ' ', '_', '-', '!', '_a', ' a', 'a', '1', 'Москва', 'a' * 256, 'a' * 257, '1' * 300,
+    'male', 'female', 'mala', 'MALE', '26.12.1986', '31.02.1999', '29.02.2000', '29.02.2001', '1.1.2000',
+    '01.01.0001', '2019-08-30',
+    (datetime.datetime.utcnow() + datetime.timedelta(days=1)).strftime('%d.%m.%Y'),
+]
+FUZZ_SCALARS = [
+    None, True, False, 0, 1, -1, 2, 10 ** 20, 1.0, 15.5, float('nan'), [], {}, [1], {'a': 1},
+    (), (2,), (1, 'a'), b'', b'\x02', bytearray(b'\x02'),
+]
+
+
+def calculate_citizen_age(current_date: datetime.date, citizen_birth_date: datetime.date) -> int:
+    citizen_birth_date_passed = (
+            (current_date.month, current_date.day) < (citizen_birth_date.month, citizen_birth_date.day)
+    )
+    return current_date.year - citizen_birth_date.year - citizen_birth_date_passed
+
+
+def random_value(rnd: random.Random) -> Any:
+    kind = rnd.random()
+    if kind < 0.45:
+        return rnd.choice(FUZZ_STRINGS)
+    if kind < 0.6:
+        return ''.join(rnd.choice('aб1 _-.!') for _ in range(rnd.randint(0, 5)))
+    if kind < 0.8:
+        return rnd.choice(FUZZ_SCALARS)
+    return [rnd.choice(FUZZ_SCALARS + [rnd.randint(0, 5)]) for _ in range(rnd.randint(0, 3))]
+
+
+def mutate_citizen(rnd: random.Random) -> Dict[str, Any]:
+    citizen = copy.deepcopy(CORRECT_CITIZEN)
+    for _ in range(rnd.randint(0, 2)):
+        action = rnd.random()
+        field = rnd.choice(list(citizen) or ['citizen_id'])
+        if action < 0.7:
+            citizen[field] = random_value(rnd)
+        elif action < 0.85:
+            citizen.pop(field, None)
+        else:
+            citizen[rnd.choice(['external', 'Town', '_id'])] = random_value(rnd)
+    return citizen
+
+
+class TestFastValidator:
+    def test_fast_validator_accepts_correct_citizen(self) -> None:
+        validated_citizen = service_framework.CitizenValidator.FAST_VALIDATOR.validated(copy.deepcopy(CORRECT_CITIZEN))
+
+        expected_citizen = copy.deepcopy(CORRECT_CITIZEN)
+        expected_citizen['birth_date'] = datetime.datetime(1986, 12, 26)
+
+        assert validated_citizen == expected_citizen
+
+    @pytest.mark.parametrize(
+        'document',
+        [None, 1, 'citizen', [], [CORRECT_CITIZEN]],
+        ids=['null', 'number', 'string', 'empty list', 'list with citizen'],
+    )
+    def test_fast_validator_rejects_non_mapping(self, document: Any) -> None:
+        assert service_framework.CitizenValidator.FAST_VALIDATOR.validated(document) is None
+
+    def test_fast_validator_rejects_unsupported_rules(self) -> None:
+        with pytest.raises(ValueError):
+            service_framework.FastValidator({'name': {'type': 'string', 'regex': '^a'}})
+
+    def test_fast_validator_is_equivalent_to_reference_validator(self) -> None:
+        rnd = random.Random(FUZZ_SEED)
+        fast_validator = service_framework.CitizenValidator.FAST_VALIDATOR
+        reference_validator = service_framework.CitizenValidator.REFERENCE_VALIDATOR
+        accepted = 0
+        for _ in range(FUZZ_ITERATIONS):
+            citizen = mutate_citizen(rnd)
+
+            fast_result = fast_validator.validated(copy.deepcopy(citizen))
+            reference_result = reference_validator.validated(copy.deepcopy(citizen))
+
+            assert fast_result == reference_result, citizen
+            accepted += fast_result is not None
+        assert 0 < accepted < FUZZ_ITERATIONS
+
+
+class TestCitizensRelativesCheck:
+    @pytest.mark.parametrize(
+        'citizen_ids, citizens_relatives, expected',
+        [
+            ([1, 2, 3], [[2], [1], []], True),
+            ([1, 2, 3], [[2, 3], [1], [1]], True),
+            ([1, 2, 3], [[], [], []], True),
+            ([1, 2, 3], [[2], [], []], False),
+            ([1, 2, 3], [[2, 3], [1], []], False),
+            ([1, 2], [[2, 2], [1, 1]], False),
+            ([1, 1], [[], []], False),
+            ([1, 2], [[3], []], False),
+            ([1, 2], [[3], [3]], False),
+            ([2 ** 70, 1], [[1], [2 ** 70]], True),
+            ([2 ** 70, 1], [[1], []], False),
+            ([2 ** 70, 2 ** 70], [[], []], False),
+        ],
+        ids=[
+            'symmetric pair',
+            'symmetric star',
+            'no relatives',
+            'one-sided relation',
+            'one-sided relation in star',
+            'duplicated relatives',
+            'duplicated citizen_id',
+            'relative not in import',
+            'relatives not in import',
+            'symmetric pair with big citizen_id',
+            'one-sided relation with big citizen_id',
+            'duplicated big citizen_id',
+        ],
+    )
+    def test_check_citizens_relatives(
+            self,
+            citizen_ids: List[int],
+            citizens_relatives: List[List[int]],
+            expected: bool,
+    ) -> None:
+        assert service_framework.CitizensValidator.check_citizens_relatives(citizen_ids, citizens_relatives) == expected
+
+    def test_check_citizens_relatives_time(self) -> None:
+        citizens_count = 50000
+        citizen_ids = list(range(citizens_count))
+        citizens_relatives = [
+            [(citizen_id - 1) % citizens_count, (citizen_id + 1) % citizens_count] for citizen_id in citizen_ids
+        ]
+
+        start_time = datetime.datetime.utcnow()
+        result = service_framework.CitizensValidator.check_citizens_relatives(citizen_ids, citizens_relatives)
+        eval_time = (datetime.datetime.utcnow() - start_time).total_seconds()
+
+        assert result
+        assert eval_time <= 1.0
+
+
+class TestCitizensBirthdays:
+    def test_calculate_presents(self) -> None:
+        presents = service_framework.CitizensBirthdays.calculate_presents([1, 2, 3], [[2, 3], [1], [1]], [4, 12, 12])
+
+        assert presents == {12: {1: 2}, 4: {2: 1, 3: 1}}
+
+    @pytest.mark.parametrize(
+        'citizen_id_offset',
+        [0, 2 ** 59 - 300, 2 ** 59 - 150, 2 ** 70],
+        ids=['small citizen_id', 'max key citizen_id', 'citizen_id above key', 'big citizen_id'],
+    )
+    def test_numpy_presents_are_equal_to_python_presents(self, citizen_id_offset: int) -> None:
+        rnd = random.Random(FUZZ_SEED)
+        citizen_ids = [citizen_id_offset + citizen_id for citizen_id in range(300)]
+        relatives = {citizen_id: set() for citizen_id in citizen_ids}
+        for _ in range(600):
+            citizen_id, relative_id = rnd.sample(citizen_ids, 2)
+            relatives[citizen_id].add(relative_id)
+            relatives[relative_id].add(citizen_id)
+        citizens_relatives = [sorted(relatives[citizen_id]) for citizen_id in citizen_ids]
+        citizens_birth_months = [rnd.randint(1, 12) for _ in citizen_ids]
+
+        python_presents = service_framework.CitizensBirthdays.calculate_presents(
+            citizen_ids, citizens_relatives, citizens_birth_months,
+        )
+        numpy_presents = service_framework.CitizensBirthdays.calculate_presents_with_numpy(
+            citizen_ids, citizens_relatives, citizens_birth_months,
+        )
+
+        assert json.dumps(service_framework.CitizensBirthdays.format_birthdays(numpy_presents)) == json.dumps(
+            service_framework.CitizensBirthdays.format_birthdays(python_presents)
+        )
+
+    def test_presents_from_columns_are_equal_to_python_presents(self) -> None:
+        rnd = random.Random(FUZZ_SEED)
+        citizen_ids = list(range(1, 301))
+        relatives = {citizen_id: set() for citizen_id in citizen_ids}
+        for _ in range(600):
+            citizen_id, relative_id = rnd.sample(citizen_ids, 2)
+            relatives[citizen_id].add(relative_id)
+            relatives[relative_id].add(citizen_id)
+        citizens_relatives = [sorted(relatives[citizen_id]) for citizen_id in citizen_ids]
+        birth_dates = [
+            datetime.date(1950, 1, 1) + datetime.timedelta(days=rnd.randint(0, 25000)) for _ in citizen_ids
+        ]
+        import_columns = database_framework.ImportColumns(
+            citizen_ids=numpy.array(citizen_ids, dtype=numpy.int64),
+            towns=numpy.zeros(len(citizen_ids), dtype=numpy.int32),
+            towns_dictionary=['Москва'],
+            birth_dates=numpy.array([birth_date.toordinal() for birth_date in birth_dates], dtype=numpy.int32),
+            relatives_offsets=numpy.cumsum([0] + [len(citizen_relatives) for citizen_relatives in citizens_relatives]),
+            relatives=numpy.array(
+                [relative_id for citizen_relatives in citizens_relatives for relative_id in citizen_relatives],
+                dtype=numpy.int64,
+            ),
+        )
+
+        columns_presents = service_framework.CitizensBirthdays.calculate_presents_from_columns(import_columns)
+        python_presents = service_framework.CitizensBirthdays.calculate_presents(
+            citizen_ids, citizens_relatives, [birth_date.month for birth_date in birth_dates],
+        )
+
+        assert json.dumps(service_framework.CitizensBirthdays.format_birthdays(columns_presents)) == json.dumps(
+            service_framework.CitizensBirthdays.format_birthdays(python_presents)
+        )
+
+    def test_presents_delta_matches_recalculation(self) -> None:
+        rnd = random.Random(FUZZ_SEED)
+        citizens_count = 8
+        citizen_ids = list(range(1, citizens_count + 1))
+        birth_months = {citizen_id: rnd.randint(1, 12) for citizen_id in citizen_ids}
+        relatives = {citizen_id: set() for citizen_id in citizen_ids}
+        presents = service_framework.CitizensBirthdays.calculate_presents(
+            citizen_ids, [[] for _ in citizen_ids], [birth_months[citizen_id] for citizen_id in citizen_ids],
+        )
+        for _ in range(200):
+            citizen_id = rnd.choice(citizen_ids)
+            new_birth_month = rnd.choice([birth_months[citizen_id], rnd.randint(1, 12)])
+            new_relatives = set(rnd.sample([i for i in citizen_ids if i != citizen_id], rnd.randint(0, 3)))
+
+            delta = service_framework.CitizensBirthdays.calculate_presents_delta(
+                citizen_id,
+                birth_months[citizen_id],
+                new_birth_month,
+                relatives[citizen_id],
+                new_relatives,
+                {relative_id: birth_months[relative_id] for relative_id in relatives[citizen_id] ^ new_relatives},
+            )
+            for month, citizens_presents in delta.items():
+                for relative_id, relative_presents in citizens_presents.items():
+                    presents.setdefault(month, {})[relative_id] = (
+                            presents.get(month, {}).get(relative_id, 0) + relative_presents
+                    )
+            for relative_id in relatives[citizen_id] - new_relatives:
+                relatives[relative_id].discard(citizen_id)
+            for relative_id in new_relatives:
+                relatives[relative_id].add(citizen_id)
+            relatives[citizen_id] = new_relatives
+            birth_months[citizen_id] = new_birth_month
+
+            expected_presents = service_framework.CitizensBirthdays.calculate_presents(
+                citizen_ids,
+                [sorted(relatives[i]) for i in citizen_ids],
+                [birth_months[i] for i in citizen_ids],
+            )
+            assert (
+                    service_framework.CitizensBirthdays.format_birthdays(presents)
+                    == service_framework.CitizensBirthdays.format_birthdays(expected_presents)
+            )
+
+
+class TestComputeExecutor:
+    @pytest.mark.parametrize('processes', [0, 2])
+    def test_map_keeps_order(self, monkeypatch: Any, processes: int) -> None:
+        monkeypatch.setattr(service_framework.config, 'VALIDATION_PROCESSES', processes)
+        chunks = [[i, i + 1] for i in range(0, 100, 2)]
+
+        results = list(service_framework.ComputeExecutor.map(sum, chunks))
+
+        assert results == [sum(chunk) for chunk in chunks]
+
+    @pytest.mark.parametrize('processes, size', [(0, None), (2, None), (2, 0)])
+    def test_submit(self, monkeypatch: Any, processes: int, size: Any) -> None:
+        monkeypatch.setattr(service_framework.config, 'VALIDATION_PROCESSES', processes)
+
+        future = service_framework.ComputeExecutor.submit(
+            service_framework.CitizensBirthdays.calculate_presents, [1, 2], [[2], [1]], [3, 4], size=size,
+        )
+
+        assert future.result() == {3: {2: 1}, 4: {1: 1}}
+
+        future = service_framework.ComputeExecutor.submit(int, 'a', size=size)
+
+        with pytest.raises(ValueError):
+            future.result()
+
+    def test_import_slot_limits_imports_in_flight(self, monkeypatch: Any) -> None:
+        monkeypatch.setattr(service_framework.config, 'MAX_IMPORTS_IN_FLIGHT', 2)
+        in_flight = collections.Counter()
+        lock = threading.Lock()
+
+        def import_citizens() -> None:
+            with service_framework.ComputeExecutor.import_slot():
+                with lock:
+                    in_flight['current'] += 1
+                    in_flight['max'] = max(in_flight['max'], in_flight['current'])
+                time.sleep(0.05)
+                with lock:
+                    in_flight['current'] -= 1
+
+        with futures.ThreadPoolExecutor(6) as executor:
+            for _ in range(6):
+                executor.submit(import_citizens)
+
+        assert in_flight['max'] == 2
+
+
+class TestLRUCache:
+    def test_lru_cache_evicts_least_recently_used(self) -> None:
+        cache = service_framework.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+
+        assert cache.get('a') == 1
+
+        cache.put('c', 3)
+
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+
+    def test_lru_cache_size_budget(self) -> None:
+        cache = service_framework.LRUCache(10, sizeof=len)
+        cache.put('a', b'12345')
+        cache.put('b', b'1234')
+        cache.put('c', b'12345678901')
+
+        assert cache.get('c') is None
+        assert cache.size == 9
+
+        cache.put('a', b'123')
+        cache.put('c', b'1234')
+
+        assert cache.get('b') is None
+        assert cache.get('a') == b'123'
+        assert cache.size == 7
+
+    def test_disabled_lru_cache(self) -> None:
+        cache = service_framework.LRUCache(0)
+        cache.put('a', 1)
+
+        assert cache.get('a') is None
+
+
+class TestTownsAgeStats:
+    @pytest.mark.parametrize(
+        'current_date',
+        [datetime.date(2019, 8, 30), datetime.date(2020, 2, 28), datetime.date(2020, 2, 29), datetime.date(2021, 3, 1)],
+    )
+    def test_calculate_ages(self, current_date: datetime.date) -> None:
+        rnd = random.Random(FUZZ_SEED)
+        birth_dates = [datetime.datetime(2000, 2, 29), datetime.datetime(current_date.year - 30, 8, 30)]
+        birth_dates.extend(
+            datetime.datetime(1900, 1, 1) + datetime.timedelta(days=rnd.randint(0, 40000)) for _ in range(1000)
+        )
+
+        ages = service_framework.TownsAgeStats.calculate_ages(birth_dates, current_date)
+
+        assert ages.tolist() == [
+            calculate_citizen_age(current_date, birth_date.date())
+            for birth_date in birth_dates
+        ]
+
+    def test_calculate_percentile_age_stats(self) -> None:
+        rnd = random.Random(FUZZ_SEED)
+        towns = [rnd.choice(['Москва', 'Керчь', 'Абакан', 'Ярославль']) for _ in range(1000)] + ['Якутск']
+        ages = [rnd.randint(0, 100) for _ in towns]
+        towns_ages = collections.defaultdict(list)
+        for town, age in zip(towns, ages):
+            towns_ages[town].append(age)
+        expected_towns_percentile_age_stats = [
+            {
+                'town': town,
+                **{f'p{p}': round(numpy.percentile(numpy.array(town_ages), p), 2) for p in [50, 75, 99]},
+            }
+            for town, town_ages in towns_ages.items()
+        ]
+
+        towns_percentile_age_stats = service_framework.TownsAgeStats.calculate_percentile_age_stats(
+            towns, numpy.array(ages),
+        )
+
+        assert json.dumps(towns_percentile_age_stats) == json.dumps(expected_towns_percentile_age_stats)
+
+    @pytest.mark.parametrize('citizens_count', [1, 2, 3, 4, 7, 100, 1001])
+    def test_percentiles_from_counts_are_equal_to_numpy_percentiles(self, citizens_count: int) -> None:
+        rnd = random.Random(FUZZ_SEED + citizens_count)
+        for _ in range(50):
+            ages = sorted(rnd.randint(0, 100) for _ in range(citizens_count))
+            distinct_ages, counts = numpy.unique(ages, return_counts=True)
+
+            percentiles = service_framework.TownsAgeStats.calculate_percentiles(distinct_ages, counts)
+
+            assert json.dumps([round(p, 2) for p in percentiles]) == json.dumps(
+                [round(numpy.percentile(numpy.array(ages), p), 2) for p in [50, 75, 99]]
+            )
+
+    def test_towns_birth_dates_percentile_age_stats(self) -> None:
+        rnd = random.Random(FUZZ_SEED)
+        current_date = datetime.date(2020, 2, 29)
+        towns = [rnd.choice(['Москва', 'Керчь', 'Абакан']) for _ in range(1000)]
+        birth_dates = [
+            datetime.datetime(1950, 1, 1) + datetime.timedelta(days=rnd.randint(0, 25000)) for _ in towns
+        ]
+        towns_birth_dates = service_framework.TownsAgeStats.calculate_towns_birth_dates(
+            towns + ['Якутск'], [birth_date.toordinal() for birth_date in birth_dates] + [737000],
+        )
+        towns_birth_dates[-1][1][737000] = 0
+
+        towns_percentile_age_stats = service_framework.TownsAgeStats.calculate_towns_birth_dates_percentile_age_stats(
+            towns_birth_dates, current_date,
+        )
+
+        expected_towns_percentile_age_stats = service_framework.TownsAgeStats.calculate_percentile_age_stats(
+            towns, service_framework.TownsAgeStats.calculate_ages(birth_dates, current_date),
+        )
+        assert json.dumps(towns_percentile_age_stats) == json.dumps(expected_towns_percentile_age_stats)
+
+    def test_columns_percentile_age_stats(self) -> None:
+        rnd = random.Random(FUZZ_SEED)
+        current_date = datetime.date(2020, 2, 29)
+        towns_dictionary = ['Москва', 'Керчь', 'Якутск', 'Абакан']
+        towns = [rnd.choice(['Абакан', 'Москва', 'Керчь']) for _ in range(1000)]
+        birth_dates = [
+            datetime.datetime(1950, 1, 1) + datetime.timedelta(days=rnd.randint(0, 25000)) for _ in towns
+        ]
+        import_columns = database_framework.ImportColumns(
+            citizen_ids=numpy.arange(1, len(towns) + 1),
+            towns=numpy.array([towns_dictionary.index(town) for town in towns], dtype=numpy.int32),
+            towns_dictionary=towns_dictionary,
+            birth_dates=numpy.array([birth_date.toordinal() for birth_date in birth_dates], dtype=numpy.int32),
+            relatives_offsets=numpy.zeros(len(towns) + 1, dtype=numpy.int64),
+            relatives=numpy.empty(0, dtype=numpy.int64),
+        )
+
+        towns_percentile_age_stats = service_framework.TownsAgeStats.calculate_columns_percentile_age_stats(
+            import_columns, current_date,
+        )
+
+        expected_towns_percentile_age_stats = service_framework.TownsAgeStats.calculate_percentile_age_stats(
+            towns, service_framework.TownsAgeStats.calculate_ages(birth_dates, current_date),
+        )
+        assert [town_stats['town'] for town_stats in towns_percentile_age_stats] == ['Москва', 'Керчь', 'Абакан']
+        assert sorted(towns_percentile_age_stats, key=lambda town_stats: town_stats['town']) == sorted(
+            expected_towns_percentile_age_stats, key=lambda town_stats: town_stats['town'],
+        )